@@ -20,6 +20,7 @@ import logging
 import os
 import textwrap
 import time
+import uuid
 
 import requests
 from requests.exceptions import ConnectionError, HTTPError
@@ -33,6 +34,30 @@ REQ_HEADERS = {'Content-Type': 'application/json'}
 
 TERMINAL_STATUS = (
     "success", "error", "dead", "killed", "shutting", "idle")
+BATCH_TERMINAL_STATUS = ("success", "error", "dead", "killed")
+
+# Driver entry point and packaged `jobs` for batches, paths Livy can read
+JOBS_DRIVER = os.environ.get(
+    "JOBS_DRIVER", "/usr/local/lib/jobs/src/main.py")
+JOBS_PACKAGE = os.environ.get(
+    "JOBS_PACKAGE", "/usr/local/lib/jobs/dist/jobs-0.0.1-py3-none-any.whl")
+# Printed by the driver before the JSON results
+RESULT_MARKER = "PIPELINE_RESULT "
+# Log lines searched for the results
+BATCH_LOG_LINES = 10000
+
+# Resources of a batch, held only while it runs
+BATCH_SIZES = {
+    "small": {
+        "driverMemory": "1g", "executorMemory": "2g",
+        "executorCores": 1, "numExecutors": 2},
+    "medium": {
+        "driverMemory": "2g", "executorMemory": "4g",
+        "executorCores": 2, "numExecutors": 4},
+    "large": {
+        "driverMemory": "4g", "executorMemory": "8g",
+        "executorCores": 4, "numExecutors": 8}
+}
 
 JOB_TEMPLATE = """
 # sc = spark.sparkContext
@@ -41,7 +66,7 @@ from jobs.core.base import JobHolder
         
 Job = JobHolder.get_registry()['{job_key_in_registry}']
 job = Job({job_args_kwargs})
-results = [res for re in job.execute_extra()]
+results = [res for res in job.execute_extra()]
 result = results[0]
 print(result)
 """
@@ -55,9 +80,15 @@ SAMPLE_JOBS = {
         "previous_job_temp_table": lambda table: table},
     "DropNullColumns": {
         "previous_job_temp_table": lambda table: table},
+    "CompactSchema": {
+        "previous_job_temp_table": lambda table: table},
     "SetTrainingData": {
         "previous_job_temp_table": lambda table: table},
+    "QuantileBinning": {
+        "previous_job_temp_table": lambda table: table},
     "BenchmarkModel": {
+        "previous_job_temp_table": lambda table: table},
+    "ScoreLoans": {
         "previous_job_temp_table": lambda table: table}
 }
 
@@ -118,18 +149,36 @@ def check_job(session_url: str):
     return response["state"]
 
 
+def check_statement(statement_url: str) -> dict:
+    """Check a statement
+
+    :param statement_url: Session statements URL
+    :return: statement, with its `state` and `output` once available
+    """
+    req = requests.get(LIVY_HOST + statement_url, headers=REQ_HEADERS)
+    req.raise_for_status()
+    return req.json()
+
+
 def get_job_output(statement_url: str) -> str:
     """Get job output
 
     :param statement_url: Session statements URL
     :return: job output
     """
-    req = requests.get(LIVY_HOST + statement_url, headers=REQ_HEADERS)
-    req.raise_for_status()
-    response = req.json()
+    response = check_statement(statement_url)
     if response["state"] == "waiting":
         time.sleep(10)
         return get_job_output(statement_url)
+    return statement_output(response)
+
+
+def statement_output(response: dict) -> str:
+    """Output of a finished statement
+
+    :param response: statement as returned by `check_statement`
+    :return: job output
+    """
     result = response["output"]
     try:
         if result["status"] == 'error':
@@ -171,15 +220,13 @@ def kill_session(session_url: str) -> None:
     req.raise_for_status()
 
 
-def execute_job_output(
-        job: str, sess_url: str, *job_args, **job_kwargs) -> str:
-    """Execute a job in our registry and return output
+def job_code(job: str, *job_args, **job_kwargs) -> str:
+    """Code statement running a job in our registry
 
-    The job is found in our job registry
     :param job: Job name or job class name
-    :param session_url: Livy session url
-    :param code: code statements to execute
-    :return: job output
+    :param job_args: job args, as code
+    :param job_kwargs: job kwargs, values as code
+    :return: code statement
     """
     args = ["sc"]  # spark context will be provided by livy
     kwargs = ",".join(["{}={}".format(k, v) for k, v in job_kwargs.items()])
@@ -188,10 +235,23 @@ def execute_job_output(
         job_args_kwargs += ", "
         job_args_kwargs += kwargs
 
-    code = JOB_TEMPLATE.format(
+    return JOB_TEMPLATE.format(
         job_key_in_registry=job,
         job_args_kwargs=job_args_kwargs
     )
+
+
+def execute_job_output(
+        job: str, sess_url: str, *job_args, **job_kwargs) -> str:
+    """Execute a job in our registry and return output
+
+    The job is found in our job registry
+    :param job: Job name or job class name
+    :param session_url: Livy session url
+    :param code: code statements to execute
+    :return: job output
+    """
+    code = job_code(job, *job_args, **job_kwargs)
     _, stmnt_url = execute_code(sess_url, code)
     _status = check_job(sess_url)
     while _status not in TERMINAL_STATUS:
@@ -200,6 +260,124 @@ def execute_job_output(
     return get_job_output(stmnt_url)
 
 
+def submit_batch(pipeline, run_id: str = None, size: str = "medium",
+                 conf: dict = None, **job_kwargs) -> (int, str):
+    """Submit a pipeline as a Livy batch
+
+    The driver gets its arguments as a list, job kwargs as JSON
+
+    :param pipeline: pipeline name or list of job names
+    :param run_id: run id of the pipeline
+    :param size: resources of the batch, a key of `BATCH_SIZES`
+    :param conf: extra Spark settings
+    :param job_kwargs: kwargs passed to every job
+    :return: (Batch ID, Batch URL)
+    """
+    if not isinstance(pipeline, str):
+        pipeline = ",".join(pipeline)
+    args = ["--pipeline", pipeline, "--kwargs", json.dumps(job_kwargs)]
+    if run_id is not None:
+        args.extend(["--run-id", str(run_id)])
+    data = {
+        "file": JOBS_DRIVER,
+        "pyFiles": [JOBS_PACKAGE],
+        "args": args,
+        # Unique, Airflow retries submit the same run again
+        "name": "{}-{}-{}".format(
+            pipeline, run_id or int(time.time()), uuid.uuid4().hex[:8]),
+        "conf": conf or {}
+    }
+    data.update(BATCH_SIZES[size])
+    req = requests.post(
+        LIVY_HOST + '/batches',
+        data=json.dumps(data),
+        headers=REQ_HEADERS)
+    req.raise_for_status()
+    response = req.json()
+    return response["id"], "/batches/{}".format(response["id"])
+
+
+def check_batch(batch_url: str) -> str:
+    """Check status of a batch
+
+    :param batch_url: Livy batch url
+    :return: Batch Status
+    """
+    req = requests.get(LIVY_HOST + batch_url + "/state", headers=REQ_HEADERS)
+    req.raise_for_status()
+    return req.json()["state"]
+
+
+def wait_for_batch(batch_url: str, delay: float = 1.0,
+                   max_delay: float = 60.0, timeout: float = None) -> str:
+    """Poll a batch until it ends, doubling the delay between polls
+
+    :param batch_url: Livy batch url
+    :param delay: first delay in seconds
+    :param max_delay: longest delay in seconds
+    :param timeout: give up after this many seconds
+    :return: final Batch Status
+    """
+    started = time.time()
+    status = check_batch(batch_url)
+    while status not in BATCH_TERMINAL_STATUS:
+        if timeout is not None and time.time() - started > timeout:
+            raise SparkAppError(
+                "Batch {} still {} after {}s".format(
+                    batch_url, status, timeout))
+        LOGGER.info("Batch %s status %s", batch_url, status)
+        time.sleep(delay)
+        delay = min(delay * 2, max_delay)
+        status = check_batch(batch_url)
+    return status
+
+
+def get_batch_result(batch_url: str) -> dict:
+    """Results printed by the driver, None when missing
+
+    Livy only has the driver output when the driver runs on its host
+    (client deploy mode)
+
+    :param batch_url: Livy batch url
+    """
+    logs = get_session_logs(batch_url, size=BATCH_LOG_LINES)
+    for line in reversed(logs.splitlines()):
+        if line.startswith(RESULT_MARKER):
+            return json.loads(line[len(RESULT_MARKER):])
+    return None
+
+
+def execute_batch_output(pipeline, run_id: str = None,
+                         size: str = "medium", timeout: float = None,
+                         **job_kwargs) -> dict:
+    """Run a pipeline as a Livy batch and return its results
+
+    The batch is killed if it is still running when we stop waiting,
+    so its resources are released
+
+    :param pipeline: pipeline name or list of job names
+    :param run_id: run id of the pipeline
+    :param size: resources of the batch, a key of `BATCH_SIZES`
+    :param timeout: give up after this many seconds
+    :param job_kwargs: kwargs passed to every job
+    :return: results of the jobs, None when the driver output is not
+        in the batch logs
+    """
+    _, batch_url = submit_batch(pipeline, run_id, size, **job_kwargs)
+    status = None
+    try:
+        status = wait_for_batch(batch_url, timeout=timeout)
+        result = get_batch_result(batch_url)
+    finally:
+        if status not in BATCH_TERMINAL_STATUS:
+            kill_session(batch_url)
+    if result is not None and result["status"] != "success":
+        raise SparkAppError(result["error"])
+    if status != "success":
+        raise SparkAppError(get_session_logs(batch_url))
+    return result["results"] if result else None
+
+
 class AirflowDagCallable:
 
     # initialise pipeline key
@@ -247,6 +425,25 @@ class AirflowDagCallable:
         )
         logging.info(result)
 
+    @staticmethod
+    def execute_batch(**kwargs):
+        """Run a pipeline as a Livy batch
+
+        :param kwargs: `pipeline`, optional `size` and the task context
+        :return: results of the jobs
+        """
+        date_ = kwargs['ti'].xcom_pull(key="date", task_ids="init_key")
+        days_ = kwargs['ti'].xcom_pull(key="days", task_ids="init_key")
+        results = execute_batch_output(
+            kwargs["pipeline"],
+            run_id=date_,
+            size=kwargs.get("size", "medium"),
+            days=days_,
+            date=date_
+        )
+        logging.info(results)
+        return results
+
     @staticmethod
     def spark_logs(**kwargs):
         """Check if livy session is ready to get our code statements"""
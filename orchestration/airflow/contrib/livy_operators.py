@@ -0,0 +1,179 @@
+"""Airflow operators and sensors for Livy
+
+Operators submit work to Livy and return at once, keeping its Livy URL in
+XCom. Sensors run in reschedule mode: each check is a short task run and
+the worker slot is free between checks, so a small pool of workers can
+drive many Spark jobs::
+
+    start = LivySessionOperator(task_id="init_session")
+    ready = LivySessionSensor(task_id="session_ready",
+                              submit_task_id="init_session")
+    load = LivyStatementOperator(task_id="load_csv", job="LoadCSV",
+                                 session_task_id="init_session",
+                                 job_kwargs={"filename": "'loan.csv'"})
+    loaded = LivyStatementSensor(task_id="load_csv_done",
+                                 submit_task_id="load_csv")
+    start >> ready >> load >> loaded
+"""
+from abc import abstractmethod
+import logging
+
+from airflow.exceptions import AirflowException
+from airflow.models import BaseOperator
+try:
+    from airflow.sensors.base import BaseSensorOperator
+except ImportError:  # Airflow 1.10
+    from airflow.sensors.base_sensor_operator import BaseSensorOperator
+try:
+    from airflow.utils.decorators import apply_defaults
+except ImportError:  # Applied by BaseOperator since Airflow 2
+    def apply_defaults(func):
+        """No-op"""
+        return func
+
+import livy
+
+
+LOGGER = logging.getLogger(__name__)
+
+# Seconds between checks of a sensor
+POKE_INTERVAL = 30
+
+
+class LivySessionOperator(BaseOperator):
+    """Start a Livy session, its URL goes to XCom as `sess_url`"""
+
+    def execute(self, context):
+        _, sess_url = livy.start_session()
+        context["ti"].xcom_push(key="sess_url", value=sess_url)
+        return sess_url
+
+
+class LivyStatementOperator(BaseOperator):
+    """Submit a job in our registry as a statement of a Livy session
+
+    The session URL is taken from the XCom of `session_task_id`, the
+    statement URL goes to XCom as `statement_url`. Job kwargs values are
+    code, e.g. `{"date": "'2020-01-01'"}`.
+    """
+
+    template_fields = ("job_kwargs",)
+
+    @apply_defaults
+    def __init__(self, job: str, session_task_id: str = "init_session",
+                 job_kwargs: dict = None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.job = job
+        self.session_task_id = session_task_id
+        self.job_kwargs = job_kwargs or {}
+
+    def execute(self, context):
+        sess_url = context["ti"].xcom_pull(
+            key="sess_url", task_ids=self.session_task_id)
+        _, statement_url = livy.execute_code(
+            sess_url, livy.job_code(self.job, **self.job_kwargs))
+        context["ti"].xcom_push(key="statement_url", value=statement_url)
+        return statement_url
+
+
+class LivyBatchOperator(BaseOperator):
+    """Submit a pipeline as a Livy batch
+
+    The batch URL goes to XCom as `batch_url`
+    """
+
+    template_fields = ("run_id", "job_kwargs")
+
+    @apply_defaults
+    def __init__(self, pipeline, run_id: str = None, size: str = "medium",
+                 job_kwargs: dict = None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pipeline = pipeline
+        self.run_id = run_id
+        self.size = size
+        self.job_kwargs = job_kwargs or {}
+
+    def execute(self, context):
+        _, batch_url = livy.submit_batch(
+            self.pipeline, self.run_id, self.size, **self.job_kwargs)
+        context["ti"].xcom_push(key="batch_url", value=batch_url)
+        return batch_url
+
+
+class LivySensor(BaseSensorOperator):
+    """Wait for the Livy resource submitted by `submit_task_id`
+
+    Reschedule mode by default, no worker slot is held between checks
+    """
+
+    url_key = None
+
+    @apply_defaults
+    def __init__(self, submit_task_id: str, *args, **kwargs):
+        kwargs.setdefault("mode", "reschedule")
+        kwargs.setdefault("poke_interval", POKE_INTERVAL)
+        super().__init__(*args, **kwargs)
+        self.submit_task_id = submit_task_id
+
+    def url(self, context) -> str:
+        """Livy URL from the XCom of the submitting task"""
+        return context["ti"].xcom_pull(
+            key=self.url_key, task_ids=self.submit_task_id)
+
+    @abstractmethod
+    def poke(self, context):
+        """Whether the Livy resource is done, raises when it failed"""
+        raise NotImplementedError
+
+
+class LivySessionSensor(LivySensor):
+    """Wait for a Livy session to be idle"""
+
+    url_key = "sess_url"
+
+    def poke(self, context):
+        state = livy.check_job(self.url(context))
+        LOGGER.info("Session state %s", state)
+        if state in ("error", "dead", "killed", "shutting_down"):
+            raise AirflowException("Livy session is {}".format(state))
+        return state == "idle"
+
+
+class LivyStatementSensor(LivySensor):
+    """Wait for a Livy statement, logging its output"""
+
+    url_key = "statement_url"
+
+    def poke(self, context):
+        statement = livy.check_statement(self.url(context))
+        LOGGER.info("Statement state %s", statement["state"])
+        if statement["state"] in ("error", "cancelling", "cancelled"):
+            raise AirflowException(
+                "Livy statement is {}".format(statement["state"]))
+        if statement["state"] != "available":
+            return False
+        try:
+            output = livy.statement_output(statement)
+        except livy.SparkAppError as err:
+            raise AirflowException(str(err))
+        LOGGER.info(output)
+        return True
+
+
+class LivyBatchSensor(LivySensor):
+    """Wait for a Livy batch, logging its results"""
+
+    url_key = "batch_url"
+
+    def poke(self, context):
+        state = livy.check_batch(self.url(context))
+        LOGGER.info("Batch state %s", state)
+        if state not in livy.BATCH_TERMINAL_STATUS:
+            return False
+        result = livy.get_batch_result(self.url(context))
+        if state != "success" or (result and result["status"] != "success"):
+            raise AirflowException(
+                (result or {}).get("error") or
+                livy.get_session_logs(self.url(context)))
+        LOGGER.info(result)
+        return True
@@ -6,7 +6,7 @@ from setuptools import setup
 
 setup(
     name='airflow_contrib',
-    py_modules=["livy"],
+    py_modules=["livy", "livy_operators"],
     version='0.0.1',
     author='James Wanderi',
     author_email='wanderikinyanjui@gmail.com',
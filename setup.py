@@ -32,6 +32,8 @@ setup(
     platforms='any',
     packages=find_packages("src", exclude="tests"),
     package_dir={"": "src"},
+    # Configs must travel with the package submitted to Spark
+    package_data={"jobs.config": ["conf/*.json"]},
     classifiers=[
         'Development Status :: 4 - Beta',
         'Environment :: Console',
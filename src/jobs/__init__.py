@@ -1,18 +1,30 @@
 """Job package"""
 
 from .jobs import LoadCSV
+from .jobs import LoadExport
 from .jobs import GetTrainingData
 from .jobs import DropNullAndDuplicateRow
 from .jobs import DropNullColumns
+from .jobs import CompactSchema
 from .jobs import SetTrainingData
+from .jobs import QuantileBinning
 from .jobs import BenchmarkModel
+from .jobs import ScoreLoans
+from .jobs import ExportEnsemble
+from .jobs import StreamLoans
 
 
 __all__ = [
     "LoadCSV",
+    "LoadExport",
     "GetTrainingData",
     "DropNullAndDuplicateRow",
     "DropNullColumns",
+    "CompactSchema",
     "SetTrainingData",
-    "BenchmarkModel"
+    "QuantileBinning",
+    "BenchmarkModel",
+    "ScoreLoans",
+    "ExportEnsemble",
+    "StreamLoans"
 ]
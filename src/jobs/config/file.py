@@ -1,11 +1,14 @@
 """Accessing configs from files"""
+import hashlib
 import json
 import os
+import zipfile
 
-__all__ = ["FromFile"]
+__all__ = ["FromFile", "conf_version"]
 
 
 THIS_DIR = os.path.abspath(os.path.dirname(__file__))
+CONF_DIR = os.path.join(THIS_DIR, "conf")
 
 
 class FromFile:
@@ -24,10 +27,20 @@ class FromFile:
     def load_file(filename: str) -> str:
         """Read file contents
 
+        When the package is imported from a zip (Spark `pyFiles`), files
+        inside the zip are read from it
+
         :param filename: file with config to read=
         """
-        with open(filename) as f_conf:
-            return f_conf.read(-1)
+        try:
+            with open(filename) as f_conf:
+                return f_conf.read(-1)
+        except NotADirectoryError:
+            pass
+        try:
+            return __loader__.get_data(filename).decode("utf-8")
+        except OSError:
+            raise FileNotFoundError(filename)
 
     def __getitem__(self, item):
         path = item.split(".")
@@ -58,3 +71,25 @@ class FromJson(FromFile):
             return json_conf[key]
         except KeyError:
             raise AttributeError("%s cannot be found" % item)
+
+
+def conf_filenames() -> list:
+    """Names of the configuration files, in a directory or a zip"""
+    if os.path.isdir(CONF_DIR):
+        return sorted(os.listdir(CONF_DIR))
+    archive = __loader__.archive
+    prefix = os.path.relpath(CONF_DIR, archive).replace(os.sep, "/") + "/"
+    with zipfile.ZipFile(archive) as f_zip:
+        names = [name[len(prefix):] for name in f_zip.namelist()
+                 if name.startswith(prefix)]
+    return sorted(name for name in names if name and "/" not in name)
+
+
+def conf_version() -> str:
+    """Hash of the names and contents of the configuration files"""
+    digest = hashlib.sha1()
+    for filename in conf_filenames():
+        digest.update(filename.encode("utf-8"))
+        digest.update(FromFile.load_file(
+            os.path.join(CONF_DIR, filename)).encode("utf-8"))
+    return digest.hexdigest()
@@ -4,7 +4,20 @@ Provides common functionalities for other jobs.
 """
 # pylint:disable=too-few-public-methods
 from abc import abstractmethod
-from time import time
+import hashlib
+import inspect
+import os
+import sys
+from time import strftime, time
+
+from jobs.config.file import conf_version
+from jobs.core.cache import ResultCache
+from jobs.core.profiling import PROFILERS, Profiler
+from jobs.core.util import to_bytes
+
+
+# Default size budget of memoized results
+MEMO_MAX_BYTES = "10g"
 
 
 class Singleton(type):
@@ -41,6 +54,13 @@ class BaseRegistry(metaclass=JobHolder):
     """Inherit this to register your job"""
     abstract = True
     execution_time: float = 0.000
+    # Kwargs naming the run or instrumenting it, not in the memoization
+    # key: the inputs a run-scoped table name points at are in
+    # `memo_inputs`
+    memo_ignored_kwargs = (
+        "run_id", "previous_job_temp_table", "profile", "profile_top",
+        "profile_interval", "profile_dir", "plan_dir", "partition_stats",
+        "spark_profile", "spark_hints")
 
     @abstractmethod
     def _execute(self):
@@ -67,6 +87,130 @@ class BaseRegistry(metaclass=JobHolder):
             metrics["execution_time"] = self.execution_time
         return metrics
 
+    def result_cache(self) -> ResultCache:
+        """Cache of memoized results, when the `memo_dir` kwarg is given"""
+        kwargs = getattr(self, "kwargs", {})
+        if not kwargs.get("memo_dir"):
+            return None
+        return ResultCache(
+            kwargs["memo_dir"],
+            to_bytes(kwargs.get("memo_max_bytes", MEMO_MAX_BYTES)))
+
+    def profiler(self) -> Profiler:
+        """Driver profiler, when the `profile` kwarg is `cprofile` or
+        `sampling`
+
+        `profile_top` hotspots go to the metrics, `profile_interval` is the
+        sampling period in seconds.
+        """
+        kwargs = getattr(self, "kwargs", {})
+        if not kwargs.get("profile"):
+            return None
+        if kwargs["profile"] not in PROFILERS:
+            raise ValueError("Unknown profiler %s" % kwargs["profile"])
+        top = int(kwargs.get("profile_top", 20))
+        if kwargs["profile"] == "sampling":
+            return PROFILERS["sampling"](
+                top, float(kwargs.get("profile_interval", 0.005)))
+        return PROFILERS[kwargs["profile"]](top)
+
+    def save_profile(self, profiler: Profiler) -> dict:
+        """Profile summary, the profile is saved under the `profile_dir`
+        kwarg as `<job>/<run>` (`run_id` or a timestamp)"""
+        summary = profiler.summary()
+        profile_dir = getattr(self, "kwargs", {}).get("profile_dir")
+        if profile_dir:
+            job_dir = os.path.join(profile_dir, self.__class__.__name__)
+            os.makedirs(job_dir, exist_ok=True)
+            run_id = getattr(self, "run_id", None) or strftime(
+                "%Y%m%dT%H%M%S")
+            summary["path"] = os.path.join(
+                job_dir, str(run_id) + profiler.extension)
+            profiler.dump(summary["path"])
+        return summary
+
+    @classmethod
+    def code_version(cls) -> str:
+        """Hash of the source of the modules defining this job and of the
+        configuration files it may read"""
+        sources = [conf_version()]
+        for klass in cls.__mro__:
+            if not issubclass(klass, BaseRegistry):
+                continue
+            module = sys.modules[klass.__module__]
+            try:
+                sources.append(inspect.getsource(module))
+            except (OSError, TypeError):
+                sources.append(klass.__qualname__)
+        return hashlib.sha1("".join(sources).encode("utf-8")).hexdigest()
+
+    def memo_inputs(self) -> list:
+        """Fingerprints of the job inputs, part of the memoization key"""
+        return []
+
+    def memo_save(self, key: str, result, path: str):
+        """Save the job output to `path` for memoization
+
+        :param key: memoization key
+        :param result: job result
+        :param path: directory to save in
+        """
+        raise NotImplementedError
+
+    def memo_restore(self, key: str, result, path: str):
+        """Restore the job output saved by `memo_save`
+
+        Also called right after saving, so the output is read from where
+        the cache keeps it.
+
+        :param key: memoization key
+        :param result: job result, as cached
+        :param path: directory it was saved in
+        :return: job result, e.g. renamed for this run
+        """
+        raise NotImplementedError
+
+    def memo_pinned(self) -> set:
+        """Keys of cache entries in use by this process, never evicted"""
+        return set()
+
+    def execute_memoized(self, cache: ResultCache):
+        """Restore the result when inputs, kwargs and code are unchanged,
+        otherwise execute and cache it
+
+        :param cache: memoized results
+        :return: job result
+        """
+        kwargs = {key: value for key, value in
+                  getattr(self, "kwargs", {}).items()
+                  if not key.startswith("memo_")
+                  and key not in self.memo_ignored_kwargs}
+        key = cache.key(self.__class__.__name__, self.memo_inputs(), kwargs,
+                        self.code_version())
+        entry = cache.get(key)
+        evicted = []
+        if entry is not None:
+            result = self.memo_restore(
+                key, entry["result"], cache.entry_dir(key))
+            self.metrics = dict(entry["metrics"])
+        else:
+            result = self.execute()
+            self.metrics = dict(getattr(self, "metrics", {}))
+            evicted = cache.put(
+                key, lambda path: self.memo_save(key, result, path),
+                result, self.metrics, keep=self.memo_pinned())
+            result = self.memo_restore(key, result, cache.entry_dir(key))
+
+        stats = cache.stats()
+        self.metrics["memo"] = {
+            "key": key,
+            "hit": entry is not None,
+            "hits": stats["hits"],
+            "misses": stats["misses"],
+            "evicted": len(evicted)
+        }
+        return result
+
     # Use this entrypoint for monitoring
     # Collect metrics such as execution_time and results.
     # Such metrics can be used for anomaly detection
@@ -81,6 +225,17 @@ class BaseRegistry(metaclass=JobHolder):
 
         """
         start_time = float(time())
-        yield self.execute()
+        cache = self.result_cache()
+        profiler = self.profiler()
+        if profiler is None:
+            result = self.execute() if cache is None \
+                else self.execute_memoized(cache)
+        else:
+            with profiler.running():
+                result = self.execute() if cache is None \
+                    else self.execute_memoized(cache)
+            self.metrics = getattr(self, "metrics", {})
+            self.metrics["profile"] = self.save_profile(profiler)
+        yield result
         self.execution_time = time() - start_time
         self.side_effect()
@@ -0,0 +1,165 @@
+"""Content-addressed cache of job results on the local filesystem"""
+import hashlib
+import json
+import os
+import shutil
+from threading import Lock
+from time import time
+
+
+__all__ = ["ResultCache"]
+
+
+class ResultCache:
+    """Keep job results keyed by their inputs, kwargs and code
+
+    Layout::
+
+        <root_dir>/<key>/meta.json  result, metrics, last_used
+        <root_dir>/<key>/...        anything the job saves, e.g. Parquet
+        <root_dir>/stats.json       hit and miss counters
+
+    Least recently used entries are evicted to keep within `max_bytes`,
+    except those still in use, e.g. backing Spark views.
+    """
+
+    meta_file = "meta.json"
+    stats_file = "stats.json"
+    _lock = Lock()
+
+    def __init__(self, root_dir: str, max_bytes: int):
+        """
+        :param root_dir: Directory to keep the results in
+        :param max_bytes: Size budget of the cache
+        """
+        self.root_dir = root_dir
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(*parts) -> str:
+        """Key of json serializable parts"""
+        content = json.dumps(parts, sort_keys=True, default=str)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def entry_dir(self, key: str) -> str:
+        """Directory of a cache entry"""
+        return os.path.join(self.root_dir, key)
+
+    def get(self, key: str) -> dict:
+        """Metadata of an entry, counting the hit or miss
+
+        :param key: cache key
+        :return: entry metadata or None
+        """
+        meta_path = os.path.join(self.entry_dir(key), self.meta_file)
+        with self._lock:
+            if not os.path.isfile(meta_path):
+                self._count("misses")
+                return None
+            with open(meta_path) as f_meta:
+                meta = json.load(f_meta)
+            meta["last_used"] = time()
+            self._write_json(meta_path, meta)
+            self._count("hits")
+        return meta
+
+    def put(self, key: str, save, result, metrics: dict,
+            keep=()) -> list:
+        """Add an entry and evict over the size budget
+
+        :param key: cache key
+        :param save: callable writing the job output to a directory
+        :param result: job result
+        :param metrics: job metrics
+        :param keep: keys of entries in use, never evicted, nor is this one
+        :return: evicted keys
+        """
+        target_dir = self.entry_dir(key)
+        tmp_dir = "{}.tmp{}".format(target_dir, id(save))
+        if os.path.isdir(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+        try:
+            save(tmp_dir)
+            now = time()
+            self._write_json(os.path.join(tmp_dir, self.meta_file), {
+                "key": key,
+                "result": result,
+                "metrics": metrics,
+                "created_at": now,
+                "last_used": now
+            })
+            with self._lock:
+                if os.path.isdir(target_dir):
+                    shutil.rmtree(target_dir)
+                os.rename(tmp_dir, target_dir)
+        finally:
+            if os.path.isdir(tmp_dir):
+                shutil.rmtree(tmp_dir)
+        return self.evict(set(keep) | {key})
+
+    def entries(self) -> list:
+        """Metadata and size of all entries"""
+        if not os.path.isdir(self.root_dir):
+            return []
+        entries = []
+        for key in os.listdir(self.root_dir):
+            meta_path = os.path.join(self.entry_dir(key), self.meta_file)
+            if not os.path.isfile(meta_path):
+                continue
+            with open(meta_path) as f_meta:
+                meta = json.load(f_meta)
+            meta["size"] = self._dir_size(self.entry_dir(key))
+            entries.append(meta)
+        return entries
+
+    def evict(self, keep=()) -> list:
+        """Remove least recently used entries over the size budget
+
+        :param keep: keys of entries in use, never evicted
+        :return: evicted keys
+        """
+        with self._lock:
+            entries = sorted(
+                self.entries(), key=lambda meta: meta["last_used"])
+            total = sum(meta["size"] for meta in entries)
+            evicted = []
+            for meta in entries:
+                if total <= self.max_bytes:
+                    break
+                if meta["key"] in keep:
+                    continue
+                shutil.rmtree(self.entry_dir(meta["key"]))
+                total -= meta["size"]
+                evicted.append(meta["key"])
+        return evicted
+
+    def stats(self) -> dict:
+        """Hit and miss counters"""
+        stats_path = os.path.join(self.root_dir, self.stats_file)
+        if not os.path.isfile(stats_path):
+            return {"hits": 0, "misses": 0}
+        with open(stats_path) as f_stats:
+            return json.load(f_stats)
+
+    def _count(self, counter: str):
+        """Increment a counter"""
+        stats = self.stats()
+        stats[counter] += 1
+        os.makedirs(self.root_dir, exist_ok=True)
+        self._write_json(os.path.join(self.root_dir, self.stats_file), stats)
+
+    @staticmethod
+    def _write_json(path: str, content: dict):
+        """Write a json file"""
+        with open(path, "w") as f_obj:
+            json.dump(content, f_obj, sort_keys=True, default=str)
+
+    @staticmethod
+    def _dir_size(path: str) -> int:
+        """Size of all files in a directory"""
+        size = 0
+        for dir_, _, files in os.walk(path):
+            for file_ in files:
+                size += os.path.getsize(os.path.join(dir_, file_))
+        return size
@@ -0,0 +1,446 @@
+"""Performance reports of job runs from Spark event logs
+
+Spark writes an event log (JSON lines) when `spark.eventLog.enabled` is
+set. Jobs tag their Spark jobs with their job group, `<run_id>:<job>`,
+so the stages and tasks of a log map back to the registry jobs that ran
+them, after the application is gone.
+
+Usage::
+
+    python -m jobs.core.eventlog <log> [--run RUN]
+    python -m jobs.core.eventlog <base_log> <head_log> [--threshold 0.2]
+
+reports wall time, critical path, shuffle, spill, skew and GC per job,
+or compares the jobs of two runs (two logs, or `--base-run` and
+`--head-run` of one log) and exits with 1 when a job got slower by more
+than the threshold. A log of several runs is only compared with the run
+ids given.
+
+Spark jobs only run on actions. A job that passes on a lazy view
+(filters, selects) runs no Spark job of its own, its work is charged to
+the downstream job whose action computes the view: wall times are of the
+Spark jobs each job triggered, not of the job's own transformations.
+"""
+import argparse
+from collections import OrderedDict
+import gzip
+import json
+import os
+import re
+import sys
+
+from jobs.core.stats import skew_stats
+
+
+__all__ = ["read_events", "parse_events", "job_reports", "compare_runs",
+           "safe_run_id"]
+
+
+# Reminder printed with the reports
+LAZY_NOTE = ("Wall times include lazy upstream work, charged to the job "
+             "whose action ran it")
+
+
+JOB_GROUP = "spark.jobGroup.id"
+UNGROUPED = "(ungrouped)"
+
+
+def open_log(path: str):
+    """Text file of an event log, gzip by extension"""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt")
+    if path.endswith((".lz4", ".lzf", ".snappy", ".zstd")):
+        raise ValueError("Unsupported event log codec: %s" % path)
+    return open(path)
+
+
+def read_events(path: str):
+    """Events of an event log file, or of a rolling event log directory
+
+    :param path: event log file or `eventlog_v2_*` directory
+    :return: generator of event dicts
+    """
+    if os.path.isdir(path):
+        # Rolling logs: events_<index>_<app id>, in index order
+        files = sorted(
+            (file_ for file_ in os.listdir(path)
+             if file_.startswith("events_")),
+            key=lambda file_: int(file_.split("_")[1]))
+        paths = [os.path.join(path, file_) for file_ in files]
+    else:
+        paths = [path]
+    for path_ in paths:
+        with open_log(path_) as f_log:
+            for line in f_log:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+
+def safe_run_id(run_id) -> str:
+    """Run id as in job groups and table names, word characters only
+
+    :param run_id: run id as given, e.g. `2020-01-01T00:00`
+    :return: e.g. `2020_01_01T00_00`, None for None
+    """
+    if run_id is None:
+        return None
+    return re.sub(r"\W", "_", str(run_id))
+
+
+def split_group(group: str) -> tuple:
+    """Run id and job name of a job group"""
+    if not group:
+        return None, UNGROUPED
+    if ":" in group:
+        run_id, job = group.rsplit(":", 1)
+        return run_id, job
+    return None, group
+
+
+def task_summary(event: dict) -> dict:
+    """Metrics of a finished task"""
+    info = event.get("Task Info", {})
+    metrics = event.get("Task Metrics") or {}
+    shuffle_read = metrics.get("Shuffle Read Metrics", {})
+    shuffle_write = metrics.get("Shuffle Write Metrics", {})
+    return {
+        "duration": (info.get("Finish Time", 0) -
+                     info.get("Launch Time", 0)) / 1000.0,
+        "failed": bool(info.get("Failed")),
+        "run_time": metrics.get("Executor Run Time", 0) / 1000.0,
+        "gc_time": metrics.get("JVM GC Time", 0) / 1000.0,
+        "input_bytes": metrics.get("Input Metrics", {}).get("Bytes Read", 0),
+        "shuffle_read_bytes": shuffle_read.get("Remote Bytes Read", 0) +
+        shuffle_read.get("Local Bytes Read", 0),
+        "shuffle_fetch_wait": shuffle_read.get("Fetch Wait Time", 0) / 1000.0,
+        "shuffle_write_bytes": shuffle_write.get("Shuffle Bytes Written", 0),
+        "memory_spilled": metrics.get("Memory Bytes Spilled", 0),
+        "disk_spilled": metrics.get("Disk Bytes Spilled", 0)
+    }
+
+
+def parse_events(events) -> dict:
+    """Spark jobs, stages and tasks of an application
+
+    :param events: event dicts, see `read_events`
+    :return: `app` name and id, `jobs` by Spark job id with their group,
+        times and stages, `stages` by stage id with their parents, times
+        and task summaries
+    """
+    parsed = {"app": {}, "jobs": {}, "stages": {}}
+    for event in events:
+        type_ = event.get("Event")
+        if type_ == "SparkListenerApplicationStart":
+            parsed["app"] = {"name": event.get("App Name"),
+                             "id": event.get("App ID")}
+        elif type_ == "SparkListenerJobStart":
+            properties = event.get("Properties") or {}
+            parsed["jobs"][event["Job ID"]] = {
+                "group": properties.get(JOB_GROUP),
+                "submitted": event.get("Submission Time"),
+                "completed": None,
+                "result": None,
+                "stages": list(event.get("Stage IDs", []))
+            }
+            for info in event.get("Stage Infos", []):
+                stage = parsed["stages"].setdefault(
+                    info["Stage ID"], new_stage(info))
+                stage["job"] = event["Job ID"]
+        elif type_ == "SparkListenerJobEnd":
+            job = parsed["jobs"].get(event["Job ID"])
+            if job is not None:
+                job["completed"] = event.get("Completion Time")
+                job["result"] = event.get("Job Result", {}).get("Result")
+        elif type_ == "SparkListenerStageCompleted":
+            info = event["Stage Info"]
+            stage = parsed["stages"].setdefault(
+                info["Stage ID"], new_stage(info))
+            # The last attempt has the times of the stage
+            stage["submitted"] = info.get("Submission Time")
+            stage["completed"] = info.get("Completion Time")
+            stage["attempts"] = info.get("Stage Attempt ID", 0) + 1
+            stage["failure"] = info.get("Failure Reason")
+        elif type_ == "SparkListenerTaskEnd":
+            stage = parsed["stages"].setdefault(
+                event["Stage ID"], new_stage({"Stage ID": event["Stage ID"]}))
+            stage["tasks"].append(task_summary(event))
+    return parsed
+
+
+def new_stage(info: dict) -> dict:
+    """Stage from its stage info"""
+    return {
+        "id": info["Stage ID"],
+        "name": info.get("Stage Name"),
+        "parents": list(info.get("Parent IDs", [])),
+        "job": None,
+        "submitted": None,
+        "completed": None,
+        "attempts": 0,
+        "failure": None,
+        "tasks": []
+    }
+
+
+def stage_duration(stage: dict) -> float:
+    """Seconds from submission to completion, 0 when skipped"""
+    if stage["submitted"] is None or stage["completed"] is None:
+        return 0.0
+    return (stage["completed"] - stage["submitted"]) / 1000.0
+
+
+def critical_path(stages: dict) -> tuple:
+    """Longest chain of dependent stages
+
+    :param stages: stages by id, parents outside are ignored
+    :return: seconds and stage ids of the chain, first stage first
+    """
+    longest = {}
+
+    def visit(stage_id):
+        if stage_id not in longest:
+            parents = [visit(parent)
+                       for parent in stages[stage_id]["parents"]
+                       if parent in stages]
+            seconds, path = max(parents, key=lambda found: found[0]) \
+                if parents else (0.0, [])
+            longest[stage_id] = (
+                seconds + stage_duration(stages[stage_id]), path + [stage_id])
+        return longest[stage_id]
+
+    if not stages:
+        return 0.0, []
+    return max((visit(stage_id) for stage_id in sorted(stages)),
+               key=lambda found: found[0])
+
+
+def job_report(spark_jobs: list, stages: dict) -> dict:
+    """Report of the Spark jobs of one job run
+
+    The wall time spans the Spark jobs of the group, including the lazy
+    upstream work their actions computed
+
+    :param spark_jobs: Spark jobs of the group
+    :param stages: all stages by id
+    """
+    submitted = [job["submitted"] for job in spark_jobs
+                 if job["submitted"] is not None]
+    completed = [job["completed"] for job in spark_jobs
+                 if job["completed"] is not None]
+    report = {
+        "spark_jobs": len(spark_jobs),
+        "failed_jobs": sum(1 for job in spark_jobs
+                           if job["result"] not in (None, "JobSucceeded")),
+        "wall_time": (max(completed) - min(submitted)) / 1000.0
+        if submitted and completed else 0.0,
+        "critical_path": 0.0,
+        "critical_stages": [],
+        "stages": 0,
+        "retried_stages": 0,
+        "tasks": 0,
+        "failed_tasks": 0
+    }
+    totals = OrderedDict((key, 0) for key in (
+        "run_time", "gc_time", "input_bytes", "shuffle_read_bytes",
+        "shuffle_fetch_wait", "shuffle_write_bytes", "memory_spilled",
+        "disk_spilled"))
+    worst_skew = None
+    for spark_job in spark_jobs:
+        job_stages = {stage_id: stages[stage_id]
+                      for stage_id in spark_job["stages"]
+                      if stage_id in stages and
+                      stages[stage_id]["completed"] is not None}
+        # Spark jobs of a job run one after the other
+        seconds, path = critical_path(job_stages)
+        report["critical_path"] += seconds
+        report["critical_stages"].extend(path)
+        for stage in job_stages.values():
+            report["stages"] += 1
+            report["retried_stages"] += 1 if stage["attempts"] > 1 else 0
+            tasks = stage["tasks"]
+            report["tasks"] += len(tasks)
+            report["failed_tasks"] += sum(1 for task in tasks
+                                          if task["failed"])
+            for key in totals:
+                totals[key] += sum(task[key] for task in tasks)
+            done = [task["duration"] for task in tasks if not task["failed"]]
+            if len(done) > 1:
+                skew = skew_stats(done)
+                if worst_skew is None or skew["max_median_ratio"] > \
+                        worst_skew["max_median_ratio"]:
+                    worst_skew = dict(skew, stage=stage["id"],
+                                      name=stage["name"])
+    report.update(totals)
+    report["gc_fraction"] = totals["gc_time"] / totals["run_time"] \
+        if totals["run_time"] else 0.0
+    report["skew"] = worst_skew
+    return report
+
+
+def job_reports(parsed: dict, run_id: str = None) -> dict:
+    """Report of each job run in an application
+
+    :param parsed: output of `parse_events`
+    :param run_id: only the jobs of this run, as given or as in the job
+        groups, see `safe_run_id`
+    :return: reports by job group, with their `run_id` and `job`, in the
+        order the jobs started
+    """
+    run_id = safe_run_id(run_id)
+    groups = OrderedDict()
+    for job_id in sorted(parsed["jobs"]):
+        spark_job = parsed["jobs"][job_id]
+        group = spark_job["group"] or UNGROUPED
+        if run_id is None or split_group(group)[0] == run_id:
+            groups.setdefault(group, []).append(spark_job)
+    reports = OrderedDict()
+    for group, spark_jobs in groups.items():
+        run_id_, job = split_group(group)
+        reports[group] = dict(job_report(spark_jobs, parsed["stages"]),
+                              run_id=run_id_, job=job)
+    return reports
+
+
+def by_job(reports: dict) -> dict:
+    """Job reports of one run by job name"""
+    jobs = {}
+    for group, report in reports.items():
+        if report["job"] in jobs:
+            raise ValueError(
+                "{} ran more than once ({}, {}), compare one run of each "
+                "log".format(report["job"], jobs[report["job"]]["group"],
+                             group))
+        jobs[report["job"]] = dict(report, group=group)
+    return jobs
+
+
+def compare_runs(base: dict, head: dict, threshold: float = 0.2) -> dict:
+    """Compare the jobs of two runs
+
+    :param base: job reports of the earlier run, see `job_reports`
+    :param head: job reports of the later run
+    :param threshold: relative wall time increase flagged as a regression
+    :return: per job base and head values and changes, and the jobs
+        `regressed`, `added` and `removed`
+    :raises ValueError: when a job ran more than once in base or head,
+        reports of several runs must be narrowed to one run first
+    """
+    base_jobs, head_jobs = by_job(base), by_job(head)
+    keys = ("wall_time", "critical_path", "shuffle_read_bytes",
+            "shuffle_write_bytes", "disk_spilled", "gc_time")
+    compared = {"jobs": OrderedDict(), "regressed": [],
+                "added": sorted(set(head_jobs) - set(base_jobs)),
+                "removed": sorted(set(base_jobs) - set(head_jobs))}
+    for job in [job for job in head_jobs if job in base_jobs]:
+        changes = OrderedDict()
+        for key in keys:
+            before, after = base_jobs[job][key], head_jobs[job][key]
+            changes[key] = {
+                "base": before, "head": after,
+                "change": (after - before) / float(before) if before else (
+                    float("inf") if after else 0.0)}
+        compared["jobs"][job] = changes
+        if changes["wall_time"]["change"] > threshold:
+            compared["regressed"].append(job)
+    return compared
+
+
+def size(num_bytes: float) -> str:
+    """Readable size"""
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(num_bytes) < 1024:
+            return "{:.1f}{}".format(num_bytes, unit)
+        num_bytes /= 1024.0
+    return "{:.1f}TB".format(num_bytes)
+
+
+def report_text(reports: dict) -> str:
+    """Readable job reports"""
+    lines = []
+    for group, report in reports.items():
+        lines.append(
+            "{}: {:.1f}s wall, {:.1f}s critical path (stages {}), "
+            "{} Spark jobs, {} stages, {} tasks ({} failed)".format(
+                group, report["wall_time"], report["critical_path"],
+                report["critical_stages"], report["spark_jobs"],
+                report["stages"], report["tasks"], report["failed_tasks"]))
+        lines.append(
+            "  shuffle read {}, write {}, fetch wait {:.1f}s; spilled {} "
+            "memory, {} disk; GC {:.1f}s ({:.0%} of run time)".format(
+                size(report["shuffle_read_bytes"]),
+                size(report["shuffle_write_bytes"]),
+                report["shuffle_fetch_wait"], size(report["memory_spilled"]),
+                size(report["disk_spilled"]), report["gc_time"],
+                report["gc_fraction"]))
+        if report["skew"]:
+            lines.append(
+                "  most skewed stage {} ({}): max task {:.1f}s, {:.1f}x "
+                "the median".format(
+                    report["skew"]["stage"], report["skew"]["name"],
+                    report["skew"]["max"],
+                    report["skew"]["max_median_ratio"]))
+    if lines:
+        lines.append(LAZY_NOTE)
+    return "\n".join(lines)
+
+
+def compare_text(compared: dict) -> str:
+    """Readable comparison of two runs"""
+    lines = []
+    for job, changes in compared["jobs"].items():
+        lines.append("{}: {}".format(job, ", ".join(
+            "{} {:.1f} -> {:.1f} ({:+.0%})".format(
+                key, change["base"], change["head"], change["change"])
+            for key, change in changes.items())))
+    for title, key in (("Regressed", "regressed"), ("Added", "added"),
+                       ("Removed", "removed")):
+        if compared[key]:
+            lines.append("{}: {}".format(title, ", ".join(compared[key])))
+    if compared["jobs"]:
+        lines.append(LAZY_NOTE)
+    return "\n".join(lines)
+
+
+def main(argv=None) -> int:
+    """Report the jobs of a run or compare two runs"""
+    parser = argparse.ArgumentParser(
+        description="Per job performance reports from Spark event logs")
+    parser.add_argument("log", help="Event log file or directory")
+    parser.add_argument("head_log", nargs="?",
+                        help="Event log of the later run to compare")
+    parser.add_argument("--run", help="Only report this run")
+    parser.add_argument("--base-run", help="Earlier run id to compare")
+    parser.add_argument("--head-run", help="Later run id to compare")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Wall time increase flagged as a regression")
+    parser.add_argument("--json", action="store_true",
+                        help="Print JSON instead of text")
+    args = parser.parse_args(argv)
+
+    parsed = parse_events(read_events(args.log))
+    if not (args.head_log or args.base_run or args.head_run):
+        reports = job_reports(parsed, args.run)
+        print(json.dumps(reports, indent=2) if args.json
+              else report_text(reports))
+        return 0
+
+    head_parsed = parse_events(read_events(args.head_log)) \
+        if args.head_log else parsed
+    base = job_reports(parsed, args.base_run)
+    head = job_reports(head_parsed, args.head_run)
+    if not base or not head:
+        print("Need jobs in both runs to compare")
+        return 2
+    try:
+        compared = compare_runs(base, head, args.threshold)
+    except ValueError as err:
+        print("{}: pass --base-run and --head-run".format(err))
+        return 2
+    print(json.dumps(compared, indent=2) if args.json
+          else compare_text(compared))
+    return 1 if compared["regressed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
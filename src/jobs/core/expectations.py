@@ -0,0 +1,185 @@
+"""Declarative data quality checks
+
+Expectations are dicts, configured per job in `conf/expectations.json`::
+
+    {"type": "not_null", "column": "loan_amnt", "max_fraction": 0.01}
+    {"type": "range", "column": "int_rate", "min": 0, "max": 40}
+    {"type": "allowed_values", "column": "grade", "values": ["A", "B"]}
+    {"type": "unique", "columns": ["member_id", "issue_d"]}
+    {"type": "row_count", "min": 1000}
+
+`max_fraction` is the share of rows allowed to fail (0 by default),
+`policy` is `fail` (default) or `warn`, `name` labels the check in the
+metrics.
+
+All the checks of a table compile to a single aggregation, so checking
+costs one scan whatever their number.
+"""
+import pandas as pd
+from pyspark.sql.functions import (
+    col, count, countDistinct, lit, max as max_, min as min_, sum as sum_,
+    when)
+
+
+__all__ = ["ExpectationError", "spark_aggs", "pandas_stats", "evaluate"]
+
+
+POLICIES = ("fail", "warn")
+ROWS = "_rows"
+
+
+class ExpectationError(Exception):
+    """Raise when an expectation with the `fail` policy is not met"""
+
+
+def stat_name(index: int, stat: str) -> str:
+    """Alias of a statistic of an expectation in the aggregation"""
+    return "e{}_{}".format(index, stat)
+
+
+def check_expectation(expectation: dict):
+    """Raise ValueError on unknown types or policies and missing params"""
+    required = {
+        "not_null": ("column",),
+        "range": ("column",),
+        "allowed_values": ("column", "values"),
+        "unique": ("columns",),
+        "row_count": ()
+    }
+    type_ = expectation.get("type")
+    if type_ not in required:
+        raise ValueError("Unknown expectation type %s" % type_)
+    missing = [param for param in required[type_]
+               if param not in expectation]
+    if missing:
+        raise ValueError("%s expectation needs %s" % (type_, missing))
+    if expectation.get("policy", "fail") not in POLICIES:
+        raise ValueError("Unknown policy %s" % expectation["policy"])
+
+
+def spark_aggs(expectations: list) -> list:
+    """Aggregate columns computing the statistics of all expectations
+
+    :param expectations: expectation dicts
+    :return: pyspark columns for `DataFrame.agg`
+    """
+    aggs = [count(lit(1)).alias(ROWS)]
+    for index, expectation in enumerate(expectations):
+        check_expectation(expectation)
+        type_ = expectation["type"]
+        if type_ == "not_null":
+            aggs.append(sum_(col(expectation["column"]).isNull().cast("int"))
+                        .alias(stat_name(index, "failed")))
+        elif type_ == "range":
+            column = col(expectation["column"])
+            outside = lit(False)
+            if expectation.get("min") is not None:
+                outside = outside | (column < expectation["min"])
+            if expectation.get("max") is not None:
+                outside = outside | (column > expectation["max"])
+            aggs.extend([
+                sum_(when(outside, 1).otherwise(0))
+                .alias(stat_name(index, "failed")),
+                min_(column).alias(stat_name(index, "min")),
+                max_(column).alias(stat_name(index, "max"))])
+        elif type_ == "allowed_values":
+            column = col(expectation["column"])
+            aggs.append(sum_(when(
+                column.isNotNull() & ~column.isin(*expectation["values"]), 1
+            ).otherwise(0)).alias(stat_name(index, "failed")))
+        elif type_ == "unique":
+            columns = [col(col_) for col_ in expectation["columns"]]
+            complete = columns[0].isNotNull()
+            for column in columns[1:]:
+                complete = complete & column.isNotNull()
+            # Rows with a null key are not compared, like countDistinct
+            aggs.extend([
+                sum_(complete.cast("int")).alias(stat_name(index, "keys")),
+                countDistinct(*columns).alias(stat_name(index, "distinct"))
+            ])
+    return aggs
+
+
+def pandas_stats(pdf: pd.DataFrame, expectations: list) -> dict:
+    """Statistics of all expectations on a pandas dataframe, as
+    `spark_aggs` computes them"""
+    stats = {ROWS: len(pdf)}
+    for index, expectation in enumerate(expectations):
+        check_expectation(expectation)
+        type_ = expectation["type"]
+        if type_ == "not_null":
+            stats[stat_name(index, "failed")] = int(
+                pdf[expectation["column"]].isna().sum())
+        elif type_ == "range":
+            values = pdf[expectation["column"]].dropna()
+            outside = pd.Series(False, index=values.index)
+            if expectation.get("min") is not None:
+                outside |= values < expectation["min"]
+            if expectation.get("max") is not None:
+                outside |= values > expectation["max"]
+            stats[stat_name(index, "failed")] = int(outside.sum())
+            # Python scalars, as collected from Spark
+            low, high = values.agg(["min", "max"]).tolist() \
+                if len(values) else (None, None)
+            stats[stat_name(index, "min")] = low
+            stats[stat_name(index, "max")] = high
+        elif type_ == "allowed_values":
+            values = pdf[expectation["column"]].dropna()
+            stats[stat_name(index, "failed")] = int(
+                (~values.isin(expectation["values"])).sum())
+        elif type_ == "unique":
+            keys = pdf[expectation["columns"]].dropna()
+            stats[stat_name(index, "keys")] = len(keys)
+            stats[stat_name(index, "distinct")] = len(keys.drop_duplicates())
+    return stats
+
+
+def expectation_name(expectation: dict) -> str:
+    """Label of an expectation in the metrics"""
+    if expectation.get("name"):
+        return expectation["name"]
+    columns = expectation.get("columns") or [expectation.get("column")]
+    columns = [col_ for col_ in columns if col_]
+    return "{}({})".format(expectation["type"], ", ".join(columns))
+
+
+def evaluate(expectations: list, stats: dict) -> dict:
+    """Check the expectations against their statistics
+
+    :param expectations: expectation dicts
+    :param stats: output of `spark_aggs` or `pandas_stats`
+    :return: `passed`, names of the `failed` and `warned` expectations and
+        the `observed` values of each
+    """
+    rows = int(stats[ROWS])
+    report = {"passed": True, "rows": rows, "failed": [], "warned": [],
+              "observed": {}}
+    for index, expectation in enumerate(expectations):
+        type_ = expectation["type"]
+        name = expectation_name(expectation)
+        if type_ == "row_count":
+            observed = {"rows": rows}
+            passed = rows >= expectation.get("min", 0) and (
+                expectation.get("max") is None or rows <= expectation["max"])
+        else:
+            if type_ == "unique":
+                failed = int(stats[stat_name(index, "keys")] or 0) - int(
+                    stats[stat_name(index, "distinct")] or 0)
+            else:
+                failed = int(stats[stat_name(index, "failed")] or 0)
+            fraction = float(failed) / rows if rows else 0.0
+            observed = {"failed": failed, "fraction": fraction}
+            if type_ == "range":
+                for stat in ("min", "max"):
+                    value = stats[stat_name(index, stat)]
+                    observed[stat] = None if pd.isnull(value) else value
+            passed = fraction <= float(expectation.get("max_fraction", 0))
+
+        report["observed"][name] = observed
+        if not passed:
+            if expectation.get("policy", "fail") == "fail":
+                report["passed"] = False
+                report["failed"].append(name)
+            else:
+                report["warned"].append(name)
+    return report
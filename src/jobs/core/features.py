@@ -0,0 +1,169 @@
+"""Date partitioned feature tables on the local filesystem"""
+import json
+import os
+import re
+import shutil
+from threading import Lock
+from time import time
+import uuid
+
+from jobs.core.local import spark_dtypes
+
+
+__all__ = ["FeatureStore"]
+
+
+class FeatureStore:
+    """Keep engineered features as Parquet, one partition per date
+
+    Layout::
+
+        <root_dir>/<table>/date=<date>/*.parquet  features of a date
+        <root_dir>/<table>/manifest.json          schema, rows and write
+                                                  time of each partition
+
+    Writes replace (`overwrite`) or add to (`append`) the partition of
+    their date only. Readers pick partitions from the manifest, so a date
+    range never lists or scans other dates.
+    """
+
+    manifest_file = "manifest.json"
+    partition_column = "date"
+    modes = ("overwrite", "append")
+    _lock = Lock()
+
+    def __init__(self, root_dir: str):
+        """
+        :param root_dir: Directory to keep the tables in
+        """
+        self.root_dir = root_dir
+
+    def table_dir(self, table: str) -> str:
+        """Directory of a table"""
+        return os.path.join(self.root_dir, table)
+
+    def partition_dir(self, table: str, date: str) -> str:
+        """Directory of the partition of a date"""
+        if not re.match(r"^[\w\-]+$", str(date)):
+            raise ValueError("Invalid partition date %s" % date)
+        return os.path.join(self.table_dir(table), "{}={}".format(
+            self.partition_column, date))
+
+    def manifest(self, table: str) -> dict:
+        """Partitions of a table by date"""
+        path = os.path.join(self.table_dir(table), self.manifest_file)
+        if not os.path.isfile(path):
+            return {"table": table, "partitions": {}}
+        with open(path) as f_manifest:
+            return json.load(f_manifest)
+
+    def dates(self, table: str, start: str = None, end: str = None) -> list:
+        """Dates of the partitions of a table, from start to end included"""
+        return sorted(
+            date for date in self.manifest(table)["partitions"]
+            if (start is None or date >= str(start)) and
+            (end is None or date <= str(end)))
+
+    def write_spark(self, df_, table: str, date: str, rows: int,
+                    mode: str = "overwrite") -> dict:
+        """Write the features of a date from a pyspark dataframe
+
+        :param df_: pyspark dataframe, without the date column
+        :param table: table name
+        :param date: partition date
+        :param rows: rows of the dataframe
+        :param mode: `overwrite` or `append` the partition
+        :return: manifest entry of the partition
+        """
+        return self._write(
+            table, date, mode, rows, df_.dtypes,
+            lambda path: df_.write.parquet(path))
+
+    def write_pandas(self, pdf, table: str, date: str,
+                     mode: str = "overwrite") -> dict:
+        """Write the features of a date from a pandas dataframe
+
+        :param pdf: pandas dataframe, without the date column
+        :return: manifest entry of the partition
+        """
+        def save(path):
+            os.makedirs(path)
+            pdf.to_parquet(os.path.join(
+                path, "part-{}.parquet".format(uuid.uuid4().hex)),
+                index=False)
+        return self._write(table, date, mode, len(pdf), spark_dtypes(pdf),
+                           save)
+
+    def read(self, reader, table: str, start: str = None, end: str = None):
+        """Features of a date range
+
+        :param reader: DataFrameReader
+        :param table: table name
+        :param start: first date, from the first partition when None
+        :param end: last date, to the last partition when None
+        :return: pyspark dataframe with the date column
+        """
+        dates = self.dates(table, start, end)
+        if not dates:
+            raise ValueError("No partitions of {} from {} to {}".format(
+                table, start, end))
+        partitions = self.manifest(table)["partitions"]
+        if len({json.dumps(partitions[date]["schema"])
+                for date in dates}) > 1:
+            reader = reader.option("mergeSchema", "true")
+        return reader.option("basePath", self.table_dir(table)).parquet(
+            *[self.partition_dir(table, date) for date in dates])
+
+    def _write(self, table: str, date: str, mode: str, rows: int,
+               schema: list, save) -> dict:
+        """Write files next to the partition, then swap or move them in
+
+        :param save: callable writing Parquet files to a new directory
+        """
+        if mode not in self.modes:
+            raise ValueError("Unknown write mode %s" % mode)
+        date = str(date)
+        schema = [list(field) for field in schema]
+        if self.partition_column in [name for name, _ in schema]:
+            raise ValueError("%s is the partition column" %
+                             self.partition_column)
+        target_dir = self.partition_dir(table, date)
+        tmp_dir = "{}.tmp{}".format(target_dir, uuid.uuid4().hex)
+        save(tmp_dir)
+        try:
+            with self._lock:
+                manifest = self.manifest(table)
+                previous = manifest["partitions"].get(date)
+                if mode == "append" and previous:
+                    if previous["schema"] != schema:
+                        raise ValueError(
+                            "Schema of {} differs from partition {}".format(
+                                table, date))
+                    for file_ in os.listdir(tmp_dir):
+                        if file_.endswith(".parquet"):
+                            os.rename(os.path.join(tmp_dir, file_),
+                                      os.path.join(target_dir, file_))
+                    rows += previous["rows"]
+                else:
+                    old_dir = tmp_dir + ".old"
+                    if os.path.isdir(target_dir):
+                        os.rename(target_dir, old_dir)
+                    os.rename(tmp_dir, target_dir)
+                    shutil.rmtree(old_dir, ignore_errors=True)
+
+                manifest["partitions"][date] = {
+                    "rows": rows,
+                    "schema": schema,
+                    "written_at": time()
+                }
+                self._write_manifest(table, manifest)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        return manifest["partitions"][date]
+
+    def _write_manifest(self, table: str, manifest: dict):
+        """Replace the manifest of a table"""
+        path = os.path.join(self.table_dir(table), self.manifest_file)
+        with open(path + ".tmp", "w") as f_manifest:
+            json.dump(manifest, f_manifest, sort_keys=True)
+        os.replace(path + ".tmp", path)
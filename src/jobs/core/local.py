@@ -0,0 +1,159 @@
+"""Pandas tables for jobs run without Spark
+
+Small inputs are cheaper to process in the driver than to start a JVM
+for. Jobs running on the local engine keep their outputs here, by temp
+table name, instead of registering Spark views.
+"""
+import glob
+import os
+from threading import Lock
+
+import pandas as pd
+
+from jobs.core.base import Singleton
+
+
+__all__ = [
+    "LocalCatalog", "local_path", "local_size", "read_csv_chunked",
+    "spark_dtypes", "string_columns"]
+
+
+# Rows per chunk when reading CSV files
+CSV_CHUNK_ROWS = 100000
+# Spark type names of pandas dtypes, nullable ones included
+SPARK_TYPES = {
+    "int8": "tinyint", "Int8": "tinyint",
+    "int16": "smallint", "Int16": "smallint",
+    "int32": "int", "Int32": "int",
+    "int64": "bigint", "Int64": "bigint",
+    "float32": "float", "Float32": "float",
+    "float64": "double", "Float64": "double",
+    "bool": "boolean", "boolean": "boolean"
+}
+
+
+class LocalCatalog(metaclass=Singleton):
+    """Pandas dataframes of local job outputs, by temp table name
+
+    Tables can carry Spark column metadata, set on their columns when they
+    move to Spark
+    """
+
+    def __init__(self):
+        self.tables = {}
+        self.column_metadata = {}
+        self._lock = Lock()
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.tables
+
+    def register(self, name: str, pdf: pd.DataFrame, metadata: dict = None):
+        """Register a dataframe as a table
+
+        :param name: table name
+        :param pdf: pandas dataframe
+        :param metadata: column to its Spark metadata
+        """
+        with self._lock:
+            self.tables[name] = pdf
+            self.column_metadata[name] = dict(metadata or {})
+
+    def get(self, name: str) -> pd.DataFrame:
+        """Dataframe of a table"""
+        try:
+            return self.tables[name]
+        except KeyError:
+            raise KeyError("Table or view not found: %s" % name)
+
+    def get_metadata(self, name: str) -> dict:
+        """Column metadata of a table"""
+        return self.column_metadata.get(name, {})
+
+    def drop(self, name: str):
+        """Drop a table if it exists"""
+        with self._lock:
+            self.tables.pop(name, None)
+            self.column_metadata.pop(name, None)
+
+
+def string_columns(pdf: pd.DataFrame) -> list:
+    """Columns Spark would type as string"""
+    return [col_ for col_ in pdf.columns
+            if pdf[col_].dtype == object or
+            pd.api.types.is_string_dtype(pdf[col_])]
+
+
+def spark_dtypes(pdf: pd.DataFrame) -> list:
+    """(column, Spark type name) of a pandas dataframe, like
+    `DataFrame.dtypes` in pyspark"""
+    string_cols = string_columns(pdf)
+    return [(col_, "string" if col_ in string_cols else
+             SPARK_TYPES.get(str(dtype), str(dtype)))
+            for col_, dtype in pdf.dtypes.items()]
+
+
+def local_path(path: str) -> str:
+    """Path on the local filesystem, None for other filesystems
+    (s3://, hdfs://)"""
+    if path.startswith("file://"):
+        return path[len("file://"):]
+    return None if "://" in path else path
+
+
+def local_paths(path: str) -> list:
+    """Files of a local path, directory or glob, None for other
+    filesystems"""
+    path = local_path(path)
+    if path is None:
+        return None
+    paths = []
+    for match in sorted(glob.glob(path)):
+        if os.path.isdir(match):
+            paths.extend(sorted(
+                os.path.join(dir_, file_)
+                for dir_, _, files in os.walk(match)
+                for file_ in files if not file_.startswith(("_", "."))))
+        else:
+            paths.append(match)
+    return paths
+
+
+def local_size(path: str) -> int:
+    """Bytes of the files of a local path, None when not local"""
+    paths = local_paths(path)
+    if not paths:
+        return None
+    return sum(os.path.getsize(path_) for path_ in paths)
+
+
+def read_csv_chunked(path: str, exclude: list = None, row_filter=None,
+                     chunk_rows: int = CSV_CHUNK_ROWS) -> pd.DataFrame:
+    """Read CSV files in chunks, dropping columns and rows as they come
+
+    Values of a column typed differently across chunks are kept as
+    strings, as Spark would infer the column as string.
+
+    :param path: local file, directory or glob
+    :param exclude: columns not to read
+    :param row_filter: callable returning a boolean mask of rows to keep
+    :param chunk_rows: rows per chunk
+    :return: pandas dataframe
+    """
+    exclude = set(exclude or [])
+    chunks = []
+    for path_ in local_paths(path):
+        for chunk in pd.read_csv(path_, chunksize=chunk_rows,
+                                 usecols=lambda col_: col_ not in exclude,
+                                 low_memory=False):
+            if row_filter is not None:
+                chunk = chunk[row_filter(chunk)]
+            chunks.append(chunk)
+    if not chunks:
+        return pd.DataFrame()
+    pdf = pd.concat(chunks, ignore_index=True)
+    for col_ in pdf.columns[pdf.dtypes == object]:
+        values = pdf[col_].dropna()
+        if not values.map(lambda val: isinstance(val, str)).all():
+            pdf[col_] = pdf[col_].where(
+                pdf[col_].isna(), pdf[col_].astype(str))
+    return pdf
@@ -0,0 +1,215 @@
+"""Query plans captured per job run, and diffs between runs
+
+Usage::
+
+    python -m jobs.core.plans <plan_dir> <job> [--base RUN] [--head RUN]
+
+compares the plans of two runs of a job (the last two by default) and
+exits with 1 when the newer one has more exchanges or scans.
+"""
+import argparse
+from collections import Counter
+import difflib
+import hashlib
+import json
+import os
+import re
+import sys
+from time import time
+
+
+__all__ = ["PlanStore", "normalize_plan", "plan_fingerprint", "diff_plans"]
+
+
+# Ids that change from run to run without the plan changing
+VOLATILE_PATTERNS = (
+    (re.compile(r"#\d+L?"), ""),
+    (re.compile(r",?\s*\[(plan_)?id=#?\d+\]"), ""),
+    (re.compile(r"\*\(\d+\)\s*"), ""),
+    (re.compile(r"\b(subquery|Subquery)\s*\d+"), r"\1"),
+    (re.compile(r"\bisFinalPlan=(true|false)"), ""),
+)
+TREE_PREFIX = re.compile(r"^[\s:+\-|]*")
+OPERATOR = re.compile(r"^(\w+)(\s+(csv|parquet|json|orc|text|jdbc|"
+                      r"hashpartitioning|rangepartitioning|"
+                      r"RoundRobinPartitioning|SinglePartition))?",
+                      re.IGNORECASE)
+
+
+def normalize_plan(plan: str) -> str:
+    """Plan text without expression ids and codegen stage ids"""
+    lines = []
+    for line in plan.strip().splitlines():
+        for pattern, replacement in VOLATILE_PATTERNS:
+            line = pattern.sub(replacement, line)
+        lines.append(line.rstrip())
+    return "\n".join(lines)
+
+
+def plan_fingerprint(plan: str) -> str:
+    """Fingerprint of a normalized plan"""
+    return hashlib.sha1(normalize_plan(plan).encode("utf-8")).hexdigest()
+
+
+def operators(plan: str) -> Counter:
+    """Operators of a plan, with the format of scans and the
+    partitioning of exchanges"""
+    found = Counter()
+    for line in normalize_plan(plan).splitlines():
+        match = OPERATOR.match(TREE_PREFIX.sub("", line))
+        if match:
+            parts = (match.group(1), match.group(3))
+            found[" ".join(part for part in parts if part)] += 1
+    return found
+
+
+def is_exchange(operator: str) -> bool:
+    """Shuffle or broadcast"""
+    return "Exchange" in operator
+
+
+def is_scan(operator: str) -> bool:
+    """Reading a source or a cached relation"""
+    return "Scan" in operator or operator.startswith("Relation")
+
+
+def is_join(operator: str) -> bool:
+    """Join strategy"""
+    return "Join" in operator or operator == "CartesianProduct"
+
+
+def diff_plans(base: dict, head: dict) -> dict:
+    """Compare the plans of two runs
+
+    :param base: captured plans of the earlier run
+    :param head: captured plans of the later run
+    :return: report with added/removed operators, flagged regressions and
+        the diff of the normalized physical plans
+    """
+    base_ops, head_ops = operators(base["physical"]), operators(
+        head["physical"])
+    added = dict(head_ops - base_ops)
+    removed = dict(base_ops - head_ops)
+    base_joins = sorted(op for op in base_ops if is_join(op))
+    head_joins = sorted(op for op in head_ops if is_join(op))
+    return {
+        "changed": base["fingerprint"] != head["fingerprint"],
+        "added": added,
+        "removed": removed,
+        "new_exchanges": {
+            op: num for op, num in added.items() if is_exchange(op)},
+        "new_scans": {op: num for op, num in added.items() if is_scan(op)},
+        "join_strategy_changed": base_joins != head_joins,
+        "diff": list(difflib.unified_diff(
+            normalize_plan(base["physical"]).splitlines(),
+            normalize_plan(head["physical"]).splitlines(),
+            base.get("run_id", "base"), head.get("run_id", "head"),
+            lineterm=""))
+    }
+
+
+class PlanStore:
+    """Plans of each job run on the local filesystem
+
+    Layout: `<root_dir>/<job>/<run_id>.json`
+    """
+
+    def __init__(self, root_dir: str):
+        """
+        :param root_dir: Directory to keep the plans in
+        """
+        self.root_dir = root_dir
+
+    def save(self, job: str, run_id: str, optimized: str,
+             physical: str) -> dict:
+        """Save the plans of a run
+
+        :param job: job name
+        :param run_id: run the plans were captured in
+        :param optimized: optimized logical plan
+        :param physical: physical plan
+        :return: captured plans
+        """
+        captured = {
+            "job": job,
+            "run_id": run_id,
+            "captured_at": time(),
+            "optimized": optimized,
+            "physical": physical,
+            "fingerprint": plan_fingerprint(physical),
+            "optimized_fingerprint": plan_fingerprint(optimized)
+        }
+        job_dir = os.path.join(self.root_dir, job)
+        os.makedirs(job_dir, exist_ok=True)
+        with open(os.path.join(job_dir, run_id + ".json"), "w") as f_plan:
+            json.dump(captured, f_plan, sort_keys=True)
+        return captured
+
+    def runs(self, job: str) -> list:
+        """Captured plans of a job, oldest first"""
+        job_dir = os.path.join(self.root_dir, job)
+        if not os.path.isdir(job_dir):
+            return []
+        runs = []
+        for file_ in os.listdir(job_dir):
+            if file_.endswith(".json"):
+                with open(os.path.join(job_dir, file_)) as f_plan:
+                    runs.append(json.load(f_plan))
+        return sorted(runs, key=lambda run: run["captured_at"])
+
+    def get(self, job: str, run_id: str) -> dict:
+        """Captured plans of one run"""
+        with open(os.path.join(self.root_dir, job, run_id + ".json")) as f_:
+            return json.load(f_)
+
+
+def report(diff: dict) -> str:
+    """Readable report of a plan diff"""
+    if not diff["changed"]:
+        return "Plans unchanged"
+    lines = ["Plans changed"]
+    for title, key in (("New exchanges", "new_exchanges"),
+                       ("New scans", "new_scans"),
+                       ("Added operators", "added"),
+                       ("Removed operators", "removed")):
+        if diff[key]:
+            lines.append("{}: {}".format(title, ", ".join(
+                "{} x{}".format(op, num)
+                for op, num in sorted(diff[key].items()))))
+    if diff["join_strategy_changed"]:
+        lines.append("Join strategy changed")
+    lines.extend(diff["diff"])
+    return "\n".join(lines)
+
+
+def main(argv=None) -> int:
+    """Compare the plans of two runs of a job"""
+    parser = argparse.ArgumentParser(
+        description="Diff query plans between job runs")
+    parser.add_argument("plan_dir")
+    parser.add_argument("job")
+    parser.add_argument("--base", help="Earlier run id")
+    parser.add_argument("--head", help="Later run id")
+    args = parser.parse_args(argv)
+
+    store = PlanStore(args.plan_dir)
+    runs = store.runs(args.job)
+    base = store.get(args.job, args.base) if args.base else None
+    head = store.get(args.job, args.head) if args.head else None
+    if head is None:
+        head = runs[-1] if runs else None
+    if base is None:
+        earlier = [run for run in runs if run["run_id"] != head["run_id"]] \
+            if head else []
+        base = earlier[-1] if earlier else None
+    if base is None or head is None:
+        print("Need two runs of {} to compare".format(args.job))
+        return 2
+
+    diff = diff_plans(base, head)
+    print(report(diff))
+    return 1 if diff["new_exchanges"] or diff["new_scans"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,202 @@
+"""Python profiles of job runs on the driver
+
+Spark metrics miss the time spent in Python on the driver: building
+pandas frames, per column loops, parsing configuration. Jobs run with
+the `profile` kwarg are profiled with
+
+- `cprofile`: every call, deterministic but slower
+- `sampling`: the stack of the job's thread every `profile_interval`
+  seconds, cheap enough for long jobs
+
+The top hotspots go to the job metrics. With `profile_dir`, the whole
+profile is saved to `<profile_dir>/<job>/<run>.prof` (pstats) or
+`<run>.folded` (collapsed stacks, for flame graphs).
+"""
+from abc import ABC, abstractmethod
+import cProfile
+from collections import Counter
+from contextlib import contextmanager
+import logging
+import pstats
+import sys
+import threading
+from time import time
+
+
+__all__ = ["Profiler", "CProfiler", "SamplingProfiler", "PROFILERS"]
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+def frame_name(code) -> str:
+    """Function of a code object, as pstats names it"""
+    return "{}:{}({})".format(code.co_filename, code.co_firstlineno,
+                              code.co_name)
+
+
+class Profiler(ABC):
+    """Profile a block of code
+
+    Subclasses profile with `running` and describe the profile with
+    `hotspots` and `dump`.
+    """
+
+    extension = ""
+
+    def __init__(self, top: int = 20):
+        """
+        :param top: number of hotspots in the summary
+        """
+        self.top = top
+        self.duration = 0.0
+
+    @contextmanager
+    def running(self):
+        """Profile the code run in the block"""
+        start_time = time()
+        try:
+            yield self
+        finally:
+            self.duration = time() - start_time
+
+    @abstractmethod
+    def hotspots(self) -> list:
+        """Functions taking the most time, most first"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def dump(self, path: str):
+        """Save the whole profile"""
+        raise NotImplementedError
+
+    def summary(self) -> dict:
+        """Profile summary for the job metrics"""
+        return {
+            "profiler": self.__class__.__name__,
+            "duration": self.duration,
+            "hotspots": self.hotspots()
+        }
+
+
+class CProfiler(Profiler):
+    """Deterministic profile with cProfile
+
+    Only one cProfile runs at a time: jobs started while another is
+    profiled run unprofiled.
+    """
+
+    extension = ".prof"
+
+    def __init__(self, top: int = 20):
+        super().__init__(top)
+        self.profile = cProfile.Profile()
+        self.enabled = False
+
+    @contextmanager
+    def running(self):
+        try:
+            self.profile.enable()
+            self.enabled = True
+        except ValueError as err:
+            LOGGER.warning("Not profiling, %s", err)
+        try:
+            with super().running():
+                yield self
+        finally:
+            if self.enabled:
+                self.profile.disable()
+
+    def stats(self) -> pstats.Stats:
+        """Stats of the profile"""
+        return pstats.Stats(self.profile)
+
+    def hotspots(self) -> list:
+        if not self.enabled:
+            return []
+        # pylint:disable=no-member
+        stats = self.stats().stats
+        ordered = sorted(stats.items(), key=lambda item: item[1][2],
+                         reverse=True)
+        return [{
+            "function": "{}:{}({})".format(*function),
+            "calls": calls,
+            "self_time": self_time,
+            "total_time": total_time
+        } for function, (_, calls, self_time, total_time, _)
+            in ordered[:self.top]]
+
+    def dump(self, path: str):
+        if self.enabled:
+            self.profile.dump_stats(path)
+
+
+class SamplingProfiler(Profiler):
+    """Sample the stack of the profiled thread from a background thread"""
+
+    extension = ".folded"
+
+    def __init__(self, top: int = 20, interval: float = 0.005):
+        """
+        :param top: number of hotspots in the summary
+        :param interval: seconds between samples
+        """
+        super().__init__(top)
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+
+    def sample(self, thread_id: int, stop: threading.Event):
+        """Count the stacks of a thread until stopped"""
+        while not stop.wait(self.interval):
+            # pylint:disable=protected-access
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame_name(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.stacks[tuple(reversed(stack))] += 1
+                self.samples += 1
+
+    @contextmanager
+    def running(self):
+        stop = threading.Event()
+        sampler = threading.Thread(
+            target=self.sample, args=(threading.get_ident(), stop),
+            name="profile-sampler", daemon=True)
+        sampler.start()
+        try:
+            with super().running():
+                yield self
+        finally:
+            stop.set()
+            sampler.join()
+
+    def hotspots(self) -> list:
+        # Samples are late while the profiled thread holds the GIL, so
+        # times are shares of the duration rather than samples x interval
+        self_samples, total_samples = Counter(), Counter()
+        for stack, samples in self.stacks.items():
+            self_samples[stack[-1]] += samples
+            for function in set(stack):
+                total_samples[function] += samples
+        return [{
+            "function": function,
+            "samples": samples,
+            "self_time": self.duration * samples / self.samples,
+            "total_time": self.duration * total_samples[function] /
+            self.samples,
+            "fraction": float(samples) / self.samples
+        } for function, samples in self_samples.most_common(self.top)]
+
+    def dump(self, path: str):
+        with open(path, "w") as f_profile:
+            for stack, samples in sorted(self.stacks.items()):
+                f_profile.write("{} {}\n".format(";".join(stack), samples))
+
+
+PROFILERS = {
+    "cprofile": CProfiler,
+    "sampling": SamplingProfiler
+}
@@ -0,0 +1,218 @@
+"""One tuned SparkSession per process
+
+The session is built from a profile in `conf/spark.json`: adaptive query
+execution, shuffle partitions, Arrow, Kryo, broadcast threshold and an
+executor memory class. Jobs declare hints applied for the length of
+their run.
+"""
+from contextlib import contextmanager
+import logging
+import os
+from threading import Condition, Lock
+
+from pyspark.sql import SparkSession
+from jobs.config.file import THIS_DIR, FromJson
+from jobs.core.base import Singleton
+from jobs.core.util import to_bytes
+
+
+__all__ = ["SessionManager"]
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+# Profile used when none is given
+DEFAULT_PROFILE = "default"
+# Set on the session of every profile, once: jobs collect and create
+# pandas dataframes with Arrow, and flipping these per call would race
+# between concurrent jobs. Pipeline fan-outs need the FAIR scheduler,
+# which is only read when the SparkContext starts.
+SESSION_CONF = {
+    "spark.sql.execution.arrow.pyspark.enabled": "true",
+    "spark.sql.execution.arrow.pyspark.fallback.enabled": "true",
+    "spark.scheduler.mode": "FAIR"
+}
+
+
+class SessionManager(metaclass=Singleton):
+    """Builds and tunes the SparkSession of this process
+
+    The profile is the `profile` argument of the first instantiation,
+    `SPARK_PROFILE` or `default`. Settings that can't change on a running
+    session (Kryo, executor memory) only apply when the session is built
+    here, not when it wraps an existing SparkContext.
+    """
+
+    memory_classes_order = ("small", "medium", "large")
+
+    def __init__(self, profile: str = None):
+        """
+        :param profile: Profile name in `conf/spark.json`
+        """
+        self.profile = profile or os.environ.get(
+            "SPARK_PROFILE", DEFAULT_PROFILE)
+        self._session = None
+        self._lock = Lock()
+        # Setting to [value, value before the first holder, holders]
+        self._held = {}
+        self._held_changed = Condition()
+
+    def profile_conf(self) -> dict:
+        """Spark conf of the profile, with its memory class"""
+        profiles = FromJson(THIS_DIR)["conf.spark.profiles"]
+        if self.profile not in profiles:
+            raise ValueError("Unknown Spark profile %s" % self.profile)
+        conf = dict(SESSION_CONF)
+        conf.update(self.memory_conf(self.memory_class))
+        conf.update(profiles[self.profile].get("conf", {}))
+        return conf
+
+    @property
+    def memory_class(self) -> str:
+        """Executor memory class of the profile"""
+        return FromJson(THIS_DIR)["conf.spark.profiles"].get(
+            self.profile, {}).get("memory_class")
+
+    @staticmethod
+    def memory_conf(memory_class: str) -> dict:
+        """Executor settings of a memory class"""
+        if memory_class is None:
+            return {}
+        return FromJson(THIS_DIR)["conf.spark.memory_classes"][memory_class]
+
+    @property
+    def session(self):
+        """The SparkSession, built on first use"""
+        with self._lock:
+            if self._session is None:
+                conf = self.profile_conf()
+                builder = SparkSession.builder
+                for key, value in conf.items():
+                    builder = builder.config(key, value)
+                self._session = builder.getOrCreate()
+                # An existing SparkContext ignores the builder's conf
+                self._set_conf(self._session.conf, conf)
+        return self._session
+
+    def set_conf(self, conf: dict) -> dict:
+        """Set the settings a running session can change
+
+        :param conf: Spark settings
+        :return: previous values of the settings changed, None if unset
+        """
+        return self._set_conf(self.session.conf, conf)
+
+    @staticmethod
+    def _set_conf(runtime_conf, conf: dict) -> dict:
+        """Set modifiable settings of a `RuntimeConfig`"""
+        previous = {}
+        for key, value in conf.items():
+            if not runtime_conf.isModifiable(key):
+                continue
+            previous[key] = runtime_conf.get(key, None)
+            runtime_conf.set(key, str(value))
+        return previous
+
+    def restore_conf(self, previous: dict):
+        """Restore settings returned by `set_conf`"""
+        runtime_conf = self.session.conf
+        for key, value in previous.items():
+            if value is None:
+                runtime_conf.unset(key)
+            else:
+                runtime_conf.set(key, value)
+
+    def hold_conf(self, conf: dict) -> dict:
+        """Set settings a running session can change until released
+
+        Jobs running at the same time share the settings they agree on.
+        A job whose settings conflict with those held by running jobs
+        waits for them to be released, so none sees another's settings.
+
+        :param conf: Spark settings
+        :return: settings held, to pass to `release_conf`
+        """
+        runtime_conf = self.session.conf
+        conf = {key: str(value) for key, value in conf.items()
+                if runtime_conf.isModifiable(key)}
+        with self._held_changed:
+            self._held_changed.wait_for(lambda: all(
+                self._held[key][0] == value for key, value in conf.items()
+                if key in self._held))
+            for key, value in conf.items():
+                if key in self._held:
+                    self._held[key][2] += 1
+                else:
+                    previous = self.set_conf({key: value})
+                    self._held[key] = [value, previous[key], 1]
+        return conf
+
+    def release_conf(self, conf: dict):
+        """Release settings held by `hold_conf`, restoring them once no
+        job holds them"""
+        with self._held_changed:
+            for key in conf:
+                held = self._held[key]
+                held[2] -= 1
+                if not held[2]:
+                    del self._held[key]
+                    self.restore_conf({key: held[1]})
+            self._held_changed.notify_all()
+
+    @staticmethod
+    def hint_conf(hints: dict) -> dict:
+        """Spark settings of job hints
+
+        - `shuffle_partitions`: number of shuffle partitions
+        - `broadcast_threshold`: max size of broadcast join sides,
+          e.g. "64m"
+        - `conf`: any other Spark settings
+        """
+        conf = {}
+        if hints.get("shuffle_partitions"):
+            conf["spark.sql.shuffle.partitions"] = int(
+                hints["shuffle_partitions"])
+        if hints.get("broadcast_threshold") is not None:
+            conf["spark.sql.autoBroadcastJoinThreshold"] = to_bytes(
+                hints["broadcast_threshold"])
+        conf.update(hints.get("conf", {}))
+        return conf
+
+    def check_memory_class(self, memory_class: str, job: str) -> bool:
+        """Whether the session has the executor memory a job asks for
+
+        Executor memory is fixed for the life of the session, a job
+        asking for a larger class is only reported
+        """
+        if memory_class is None or self.memory_class is None:
+            return True
+        order = self.memory_classes_order
+        if order.index(memory_class) <= order.index(self.memory_class):
+            return True
+        LOGGER.warning("%s asks for %s executors, the session has %s",
+                       job, memory_class, self.memory_class)
+        return False
+
+    @contextmanager
+    def configured(self, hints: dict, job: str = ""):
+        """Apply job hints, restoring the settings after
+
+        Hints change the settings of the whole session: they are held
+        with `hold_conf`, so concurrent jobs with conflicting hints run
+        one after the other
+
+        :param hints: job hints, see `hint_conf`, and `memory_class`
+        :param job: job name for warnings
+        :return: Spark settings applied
+        """
+        self.check_memory_class(hints.get("memory_class"), job)
+        conf = self.hint_conf(hints)
+        if not conf:
+            yield {}
+            return
+        held = self.hold_conf(conf)
+        try:
+            yield held
+        finally:
+            self.release_conf(held)
@@ -0,0 +1,59 @@
+"""Summary statistics used in job metrics"""
+
+
+def median(values: list) -> float:
+    """Median of values"""
+    ordered = sorted(values)
+    size = len(ordered)
+    if not size:
+        return 0.0
+    middle = size // 2
+    if size % 2:
+        return float(ordered[middle])
+    return (ordered[middle - 1] + ordered[middle]) / 2.0
+
+
+def gini(values: list) -> float:
+    """Gini coefficient of values, 0 when evenly spread, close to 1 when
+    one value holds everything"""
+    ordered = sorted(values)
+    size, total = len(ordered), float(sum(ordered))
+    if not size or not total:
+        return 0.0
+    weighted = sum((index + 1) * value for index, value in enumerate(ordered))
+    return (2.0 * weighted) / (size * total) - (size + 1.0) / size
+
+
+def histogram(values: list, bins: int = 10) -> dict:
+    """Equal width histogram
+
+    :return: bin edges and the number of values in each bin
+    """
+    if not values:
+        return {"edges": [], "counts": []}
+    low, high = min(values), max(values)
+    width = (high - low) / float(bins) or 1.0
+    counts = [0] * bins
+    for value in values:
+        counts[min(int((value - low) / width), bins - 1)] += 1
+    return {
+        "edges": [low + width * index for index in range(bins + 1)],
+        "counts": counts
+    }
+
+
+def skew_stats(values: list) -> dict:
+    """Skew of values, e.g. rows per partition or task durations
+
+    :return: max, median, max to median ratio, Gini coefficient
+    """
+    med = median(values)
+    top = max(values) if values else 0
+    return {
+        "count": len(values),
+        "max": top,
+        "median": med,
+        "max_median_ratio": top / med if med else (
+            float("inf") if top else 0.0),
+        "gini": gini(values)
+    }
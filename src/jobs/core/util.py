@@ -6,6 +6,23 @@ import psycopg2
 from psycopg2.pool import SimpleConnectionPool
 
 
+SIZE_UNITS = {"": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3, "t": 1024 ** 4}
+
+
+def to_bytes(size) -> int:
+    """Convert a size such as `512m` or `2g` to bytes
+
+    :param size: int or str with an optional k/m/g/t suffix
+    :return: size in bytes
+    """
+    if isinstance(size, (int, float)):
+        return int(size)
+    match = re.match(r"^\s*(\d+(\.\d+)?)\s*([kmgt]?)b?\s*$", size.lower())
+    if not match:
+        raise ValueError("Invalid size %s" % size)
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(3)])
+
+
 @contextmanager
 def get_pool_conn(conn_details: dict):
     """Get connection from a connection pool
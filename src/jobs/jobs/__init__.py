@@ -1,17 +1,29 @@
 """ML Jobs"""
 from .acquire import LoadCSV
+from .acquire import LoadExport
 from .process import GetTrainingData
 from .process import DropNullAndDuplicateRow
 from .process import DropNullColumns
+from .process import CompactSchema
 from .process import SetTrainingData
+from .process import QuantileBinning
 from .train import BenchmarkModel
+from .serve import ScoreLoans
+from .serve import ExportEnsemble
+from .stream import StreamLoans
 
 
 __all__ = [
     "LoadCSV",
+    "LoadExport",
     "GetTrainingData",
     "DropNullAndDuplicateRow",
     "DropNullColumns",
+    "CompactSchema",
     "SetTrainingData",
-    "BenchmarkModel"
+    "QuantileBinning",
+    "BenchmarkModel",
+    "ScoreLoans",
+    "ExportEnsemble",
+    "StreamLoans"
 ]
@@ -1,6 +1,6 @@
 """Acquisition jobs
 """
 
-from .job import LoadCSV
+from .job import LoadCSV, LoadExport
 
-__all__ = ["LoadCSV"]
+__all__ = ["LoadCSV", "LoadExport"]
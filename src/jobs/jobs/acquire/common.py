@@ -1,7 +1,14 @@
 """Abstract clasess for sourcing data"""
 from abc import abstractmethod
+import shutil
+from time import time
 
+import pandas as pd
 from pyspark.sql import SQLContext, DataFrame
+from pyspark.storagelevel import StorageLevel
+from jobs.core.local import (
+    CSV_CHUNK_ROWS, local_path, local_size, read_csv_chunked)
+from jobs.jobs.acquire.export import EXPORTERS, Exporter
 from jobs.jobs.common import SparkSQL
 
 
@@ -10,12 +17,78 @@ class CSVRecord(SparkSQL):
     abstract = True
 
     def load_file(self):
-        """Load CSV to dataframe"""
+        """Load CSV (or Parquet) to dataframe"""
+        return self.apply_pushdown(
+            self.read_file(self.get_sql_context().read))
+
+    def read_file(self, reader, schema=None):
+        """Read `filename` with a batch or a streaming reader
+
+        :param reader: DataFrameReader or DataStreamReader
+        :param schema: StructType of the files, inferred when not given
+        :return: pyspark dataframe
+        """
+        filename = self.kwargs["filename"]
+        if schema is not None:
+            reader = reader.schema(schema)
+        if self.kwargs.get("file_format", "csv") == "parquet":
+            return reader.parquet(filename)
+
+        options = {"header": self.kwargs.get("header", True)}
+        if schema is None:
+            options["inferSchema"] = self.kwargs.get("inferSchema", True)
+            options["samplingRatio"] = self.kwargs.get("samplingRatio")
+        return reader.csv(filename, **options)
+
+    def input_bytes(self) -> int:
+        """Size of `filename` on the local filesystem
+
+        Files without a header are left to Spark
+        """
+        if not self.kwargs.get("header", True):
+            return None
+        return local_size(self.kwargs["filename"])
+
+    def load_file_local(self) -> pd.DataFrame:
+        """Load CSV (or Parquet) to a pandas dataframe
+
+        The drops and filter of the `pushdown_for` job are applied while
+        reading, chunk by chunk for CSV
+        """
+        job = self.pushdown_job()
+        exclude = job.pushdown_columns() if job else []
+        row_filter = job.pushdown_mask if job else None
         filename = self.kwargs["filename"]
-        header = self.kwargs.get("header", True)
-        infer_schema = self.kwargs.get("inferSchema", True)
-        return self.get_sql_context().read.csv(
-            filename, header=header, inferSchema=infer_schema)
+        if self.kwargs.get("file_format", "csv") != "parquet":
+            return read_csv_chunked(
+                filename, exclude, row_filter,
+                int(self.kwargs.get("local_chunk_rows", CSV_CHUNK_ROWS)))
+
+        pdf = pd.read_parquet(filename)
+        pdf = pdf.drop(columns=[col_ for col_ in exclude
+                                if col_ in pdf.columns])
+        if row_filter is not None:
+            pdf = pdf[row_filter(pdf)].reset_index(drop=True)
+        return pdf
+
+    def apply_pushdown(self, df):
+        """Apply the drops and filter of the `pushdown_for` job
+
+        Spark prunes the dropped columns from the file scan and pushes
+        the predicate down to the reader, so the rows and columns thrown
+        away downstream are never converted.
+
+        :param df: pyspark dataframe as read from the source
+        :return: projected and filtered pyspark dataframe
+        """
+        job = self.pushdown_job()
+        if job is None:
+            return df
+        df = df.drop(*job.pushdown_columns())
+        predicate = job.pushdown_predicate()
+        if predicate:
+            df = df.where(predicate)
+        return df
 
     @abstractmethod
     def _execute(self) -> str:
@@ -59,8 +132,131 @@ class DBRecord(SparkSQL):
             .option("query", query) \
             .load()
 
+    @staticmethod
+    def build_query(table: str, columns: list = None,
+                    predicate: str = "") -> str:
+        """Build a selectable query
+
+        :param table: source table
+        :param columns: columns to select, all when empty
+        :param predicate: optional WHERE clause
+        :return: sql query
+        """
+        query = "SELECT {} FROM {}".format(
+            ", ".join(columns) if columns else "*", table)
+        if predicate:
+            query += " WHERE {}".format(predicate)
+        return query
+
+    def pushdown_query(
+            self,
+            sql_context: SQLContext,
+            table: str,
+            connection_details: dict
+    ) -> str:
+        """Build the source query with the `pushdown_for` job's drops
+        and filter, so the database only sends the rows and columns we
+        keep
+
+        :param sql_context: spark SQLContext
+        :param table: source table
+        :param connection_details: Connection details
+        :return: sql query
+        """
+        return self.query_with_pushdown(
+            table,
+            lambda query: self.run_spark_jdbc_sql_query(
+                sql_context, query, connection_details).columns)
+
+    def query_with_pushdown(self, table: str, source_columns) -> str:
+        """Source query with the `pushdown_for` job's drops and filter
+
+        :param table: source table
+        :param source_columns: callable returning the columns of a query
+        :return: sql query
+        """
+        job = self.pushdown_job()
+        if job is None:
+            return self.build_query(table)
+
+        # Only resolves the schema, no rows are transferred
+        dropped = set(job.pushdown_columns())
+        columns = [
+            col_ for col_ in source_columns(
+                self.build_query(table, predicate="1 = 0"))
+            if col_ not in dropped]
+        return self.build_query(table, columns, job.pushdown_predicate())
+
     @abstractmethod
     def _execute(self) -> str:
         """Run this job"""
         raise NotImplementedError
 
+
+class ExportRecord(DBRecord):
+    """Get DB record through a bulk export
+
+    The `table` (with the `pushdown_for` job's drops and filter) is
+    exported to compressed files under `staging_dir`, read by Spark in
+    parallel, then the files are removed unless `keep_staged` is set.
+
+    The `exporter` kwarg names one of `EXPORTERS`. Override
+    `get_exporter` to plug in another `Exporter`.
+    """
+    abstract = True
+
+    def get_exporter(self) -> Exporter:
+        """Exporter from the `exporter` kwarg"""
+        name = self.kwargs.get("exporter", "postgres")
+        if name not in EXPORTERS:
+            raise ValueError("Unknown exporter %s" % name)
+        return EXPORTERS[name].from_job(self)
+
+    def staging_dir(self) -> str:
+        """Directory of this job's staged files"""
+        return "{}/{}".format(
+            self.kwargs["staging_dir"].rstrip("/"), self.temp_table)
+
+    def remove_staged(self, staging_dir: str):
+        """Remove staged files, through Hadoop for remote filesystems"""
+        path = local_path(staging_dir)
+        if path is not None:
+            shutil.rmtree(path, ignore_errors=True)
+            return
+        # pylint:disable=protected-access
+        jvm = self.spark_context._jvm
+        hadoop_path = jvm.org.apache.hadoop.fs.Path(staging_dir)
+        hadoop_path.getFileSystem(
+            self.spark_context._jsc.hadoopConfiguration()
+        ).delete(hadoop_path, True)
+
+    def load_export(self) -> DataFrame:
+        """Export the source table and read it
+
+        The result is persisted before the staged files are removed
+        """
+        exporter = self.get_exporter()
+        staging_dir = self.staging_dir()
+        query = self.query_with_pushdown(
+            self.kwargs["table"], exporter.columns)
+        self.remove_staged(staging_dir)
+        try:
+            start_time = time()
+            exporter.export(query, staging_dir)
+            self.metrics["export_seconds"] = time() - start_time
+            staged_bytes = local_size(staging_dir)
+            if staged_bytes is not None:
+                self.metrics["staged_bytes"] = staged_bytes
+
+            df = exporter.read(self.get_sql_context().read, staging_dir) \
+                .persist(StorageLevel.MEMORY_AND_DISK)
+            self.metrics["num_records"] = df.count()
+        finally:
+            if not self.kwargs.get("keep_staged"):
+                self.remove_staged(staging_dir)
+        return df
+
+    @abstractmethod
+    def _execute(self) -> str:
+        """Run this job"""
+        raise NotImplementedError
@@ -0,0 +1,277 @@
+"""Bulk export of query results to staged files
+
+A JDBC read pulls all rows through one connection. Warehouses export
+faster than they serve rows: Redshift UNLOADs from every slice in
+parallel, Postgres streams `COPY` output. The exporters here write query
+results to a staging directory of compressed files that Spark then reads
+in parallel.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import gzip
+import os
+import sqlite3
+
+import pandas as pd
+from jobs.config.secret import Secret
+from jobs.core.local import local_path
+from jobs.core.util import get_pool_conn
+
+
+__all__ = ["Exporter", "RedshiftExporter", "PostgresExporter",
+           "LocalExporter", "EXPORTERS"]
+
+
+def db_columns(connection_details: dict, query: str) -> list:
+    """Columns of a query's results on a Postgres compatible database,
+    planned but not run"""
+    with get_pool_conn(dict(connection_details)) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT * FROM ({}) AS q LIMIT 0".format(query))
+            return [column[0] for column in cursor.description]
+
+
+def driver_staging_dir(staging_dir: str) -> str:
+    """Local path of a staging directory written by the driver
+
+    Executors read the files at the same path, so it must be on a
+    filesystem mounted on every node (NFS, EFS...), or Spark must run
+    locally
+    """
+    path = local_path(staging_dir)
+    if path is None:
+        raise ValueError(
+            "%s is not on a local filesystem, files are written by the "
+            "driver to a shared mount" % staging_dir)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+class Exporter:
+    """Export query results to files in a staging directory
+
+    Subclasses export with `export` and describe the staged files with
+    `file_format`, so they can be read back with `read`.
+    """
+
+    file_format = "csv"
+
+    @classmethod
+    def from_job(cls, job):
+        """Exporter configured from a job's kwargs and source details
+
+        :param job: DBRecord job
+        """
+        raise NotImplementedError
+
+    def columns(self, query: str) -> list:
+        """Columns of a query's results, without fetching rows"""
+        raise NotImplementedError
+
+    def export(self, query: str, staging_dir: str):
+        """Export the results of a query
+
+        :param query: sql selectable query
+        :param staging_dir: empty directory to write the files to
+        """
+        raise NotImplementedError
+
+    def read(self, reader, staging_dir: str):
+        """Read the staged files with Spark
+
+        :param reader: DataFrameReader
+        :param staging_dir: directory the files were exported to
+        :return: pyspark dataframe
+        """
+        if self.file_format == "parquet":
+            return reader.parquet(staging_dir)
+        # gzip files are decompressed by extension
+        return reader.csv(staging_dir, header=True, inferSchema=True)
+
+
+class RedshiftExporter(Exporter):
+    """UNLOAD to S3, every slice writes its own files"""
+
+    file_format = "parquet"
+
+    def __init__(self, connection_details: dict, iam_role: str,
+                 max_file_size: str = None):
+        """
+        :param connection_details: url, user and password of the cluster
+        :param iam_role: ARN of a role allowed to write to the staging
+            bucket
+        :param max_file_size: max size of each file, e.g. `256 MB`
+        """
+        self.connection_details = connection_details
+        self.iam_role = iam_role
+        self.max_file_size = max_file_size
+
+    @classmethod
+    def from_job(cls, job):
+        return cls(job.get_source_details(),
+                   job.kwargs.get("iam_role") or
+                   Secret()["REDSHIFT_IAM_ROLE"],
+                   job.kwargs.get("max_file_size"))
+
+    def unload_statement(self, query: str, staging_dir: str) -> str:
+        """UNLOAD of a query to Parquet files
+
+        :param query: sql selectable query
+        :param staging_dir: s3:// directory
+        """
+        statement = "UNLOAD ('{}') TO '{}' IAM_ROLE '{}' FORMAT AS PARQUET" \
+            .format(query.replace("'", "''"),
+                    staging_dir.rstrip("/") + "/part-", self.iam_role)
+        if self.max_file_size:
+            statement += " MAXFILESIZE {}".format(self.max_file_size)
+        return statement
+
+    def columns(self, query: str) -> list:
+        return db_columns(self.connection_details, query)
+
+    def export(self, query: str, staging_dir: str):
+        with get_pool_conn(dict(self.connection_details)) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(self.unload_statement(query, staging_dir))
+
+
+class PostgresExporter(Exporter):
+    """`COPY ... TO STDOUT` into gzip CSV files
+
+    Split by `partition_column` (integer) into `num_parts` COPYs run in
+    parallel, a file each, rows with a null `partition_column` in the
+    first. The COPYs share the snapshot of one REPEATABLE READ
+    transaction, so the files add up to the results of one query even
+    while the tables change. The files are written by the driver:
+    `staging_dir` must be a filesystem shared with the executors, see
+    `driver_staging_dir`.
+    """
+
+    def __init__(self, connection_details: dict, num_parts: int = 1,
+                 partition_column: str = None):
+        """
+        :param connection_details: url, user and password of the database
+        :param num_parts: number of files
+        :param partition_column: integer column to split the files by
+        """
+        self.connection_details = connection_details
+        self.num_parts = num_parts if partition_column else 1
+        self.partition_column = partition_column
+
+    @classmethod
+    def from_job(cls, job):
+        return cls(job.get_source_details(),
+                   int(job.kwargs.get("num_parts", 1)),
+                   job.kwargs.get("partition_column"))
+
+    def part_queries(self, query: str) -> list:
+        """Query of each file"""
+        if self.num_parts <= 1:
+            return [query]
+        queries = [
+            "SELECT * FROM ({}) AS export WHERE mod({}, {}) IN ({}, -{})"
+            .format(query, self.partition_column, self.num_parts, part, part)
+            for part in range(self.num_parts)]
+        # mod() of null is null, those rows would be in no file
+        queries[0] += " OR {} IS NULL".format(self.partition_column)
+        return queries
+
+    @staticmethod
+    def copy_statement(query: str) -> str:
+        """COPY of a query to CSV with a header"""
+        return "COPY ({}) TO STDOUT WITH (FORMAT csv, HEADER)".format(query)
+
+    def columns(self, query: str) -> list:
+        return db_columns(self.connection_details, query)
+
+    def export_part(self, query: str, path: str, snapshot: str = None):
+        """Copy the results of a query to a gzip file
+
+        :param query: sql selectable query
+        :param path: gzip file to write
+        :param snapshot: id of an exported snapshot to read from
+        """
+        with get_pool_conn(dict(self.connection_details)) as conn:
+            with conn.cursor() as cursor, gzip.open(path, "wb") as f_part:
+                if snapshot is not None:
+                    cursor.execute(
+                        "SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+                    cursor.execute(
+                        "SET TRANSACTION SNAPSHOT %s", (snapshot,))
+                cursor.copy_expert(self.copy_statement(query), f_part)
+
+    def export(self, query: str, staging_dir: str):
+        staging_dir = driver_staging_dir(staging_dir)
+        queries = self.part_queries(query)
+        paths = [os.path.join(staging_dir, "part-{:05d}.csv.gz".format(part))
+                 for part in range(len(queries))]
+        if len(queries) == 1:
+            self.export_part(queries[0], paths[0])
+            return
+        # The snapshot can be imported while its transaction is open
+        with get_pool_conn(dict(self.connection_details)) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+                cursor.execute("SELECT pg_export_snapshot()")
+                snapshot = cursor.fetchone()[0]
+                with ThreadPoolExecutor(max_workers=len(queries)) as executor:
+                    # Raise the first failure
+                    list(executor.map(
+                        self.export_part, queries, paths,
+                        [snapshot] * len(queries)))
+
+
+class LocalExporter(Exporter):
+    """Stand-in exporting from a SQLite database to gzip CSV files of
+    `part_rows` rows, for tests and local runs
+
+    Written by the driver, as `PostgresExporter`
+    """
+
+    def __init__(self, database: str, part_rows: int = 100000):
+        """
+        :param database: SQLite database file
+        :param part_rows: rows per file
+        """
+        self.database = database
+        self.part_rows = part_rows
+
+    @classmethod
+    def from_job(cls, job):
+        return cls(job.kwargs["database"],
+                   int(job.kwargs.get("part_rows", 100000)))
+
+    def columns(self, query: str) -> list:
+        conn = sqlite3.connect(self.database)
+        try:
+            return [column[0] for column in
+                    conn.execute(query).description]
+        finally:
+            conn.close()
+
+    def export(self, query: str, staging_dir: str):
+        staging_dir = driver_staging_dir(staging_dir)
+        conn = sqlite3.connect(self.database)
+        try:
+            chunks = pd.read_sql_query(query, conn, chunksize=self.part_rows)
+            num_parts = 0
+            for part, chunk in enumerate(chunks):
+                chunk.to_csv(os.path.join(
+                    staging_dir, "part-{:05d}.csv.gz".format(part)),
+                    index=False, compression="gzip")
+                num_parts += 1
+            if not num_parts:
+                # Keep the header, Spark can't infer a schema from nothing
+                pd.DataFrame(columns=self.columns(query)).to_csv(
+                    os.path.join(staging_dir, "part-00000.csv.gz"),
+                    index=False, compression="gzip")
+        finally:
+            conn.close()
+
+
+EXPORTERS = {
+    "redshift": RedshiftExporter,
+    "postgres": PostgresExporter,
+    "local": LocalExporter
+}
@@ -1,7 +1,8 @@
 """Acquisition jobs"""
-from jobs.jobs.acquire.common import CSVRecord
+from jobs.config.secret import Secret
+from jobs.jobs.acquire.common import CSVRecord, ExportRecord
 
-__all__ = ["LoadCSV"]
+__all__ = ["LoadCSV", "LoadExport"]
 
 
 class LoadCSV(CSVRecord):
@@ -15,3 +16,32 @@ class LoadCSV(CSVRecord):
         self.metrics["num_columns"] = df.columns
         df.createOrReplaceTempView(self.temp_table)
         return self.temp_table
+
+    def _execute_local(self) -> str:
+        """Run this job on pandas"""
+        pdf = self.load_file_local()
+        self.metrics["num_records"] = len(pdf)
+        self.metrics["num_columns"] = list(pdf.columns)
+        return self.local_output(pdf)
+
+
+class LoadExport(ExportRecord):
+    """Get training data from the warehouse with a bulk export"""
+    metrics = {}
+
+    @staticmethod
+    def get_source_details() -> dict:
+        """Get source DB JDBC connection details"""
+        secret = Secret()
+        return {
+            "url": secret["SOURCE_JDBC_URL"],
+            "user": secret["SOURCE_JDBC_USER"],
+            "password": secret["SOURCE_JDBC_PASSWORD"]
+        }
+
+    def _execute(self) -> str:
+        """Run this job"""
+        df = self.load_export()
+        self.metrics["num_columns"] = df.columns
+        df.createOrReplaceTempView(self.temp_table)
+        return self.temp_table
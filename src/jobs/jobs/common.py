@@ -1,8 +1,57 @@
 """"""
 from abc import abstractmethod
+import hashlib
+import json
+import logging
+import os
+import pickle
+from time import strftime
 
-from pyspark.sql import SQLContext
-from jobs.core.base import BaseRegistry
+import pandas as pd
+import pyarrow as pa
+from pyspark.sql.functions import (
+    col, concat_ws, count, lit, sum as sum_, when, xxhash64)
+from pyspark.sql.pandas.serializers import ArrowCollectSerializer
+from pyspark.traceback_utils import SCCallSiteSync
+try:
+    from pyspark.errors.exceptions.captured import unwrap_spark_exception
+    from pyspark.util import _load_from_socket
+except ImportError:  # pyspark < 4
+    from pyspark.rdd import _load_from_socket
+    from pyspark.sql.utils import unwrap_spark_exception
+from jobs.config.file import THIS_DIR, FromJson
+from jobs.core.base import BaseRegistry, JobHolder
+from jobs.core.eventlog import safe_run_id
+from jobs.core.expectations import (
+    ExpectationError, evaluate, pandas_stats, spark_aggs)
+from jobs.core.features import FeatureStore
+from jobs.core.local import LocalCatalog
+from jobs.core.plans import PlanStore, diff_plans
+from jobs.core.session import SessionManager
+from jobs.core.stats import histogram, skew_stats
+from jobs.core.util import to_bytes
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+# Default budget for results collected to the driver
+DRIVER_MEMORY_BUDGET = "512m"
+
+
+# Inputs up to this size run on the local (pandas) engine
+LOCAL_MAX_BYTES = "64m"
+ENGINES = ("auto", "spark", "local")
+
+
+# Rows per partition pickled to estimate its size
+PARTITION_SAMPLE_ROWS = 100
+# Max to median rows per partition above which skew is reported
+SKEW_WARN_RATIO = 5.0
+
+
+class DriverMemoryError(Exception):
+    """Raise when collecting a result would exceed the driver budget"""
 
 
 class SparkSQL(BaseRegistry):
@@ -15,19 +64,376 @@ class SparkSQL(BaseRegistry):
         """
         self.spark_context = spark_context
         self.kwargs = kwargs
+        # Per instance, concurrent runs of a job must not share metrics
+        self.metrics = {}
+
+    # Memoization keys of the jobs that produced each temp table
+    table_keys = {}
+    # Spark settings for the length of `_execute`, see
+    # `SessionManager.configured`
+    spark_hints = {}
+
+    @property
+    def run_id(self) -> str:
+        """Run of a pipeline this job belongs to, from the `run_id` kwarg
+
+        Only word characters are kept so it can be part of table names,
+        see `safe_run_id`
+        """
+        return safe_run_id(self.kwargs.get("run_id"))
 
     @property
     def temp_table(self):
-        """Get temp table name to use"""
-        return "{}_data".format(self.__class__.__name__)
+        """Get temp table name to use
+
+        Scoped to the run, so concurrent runs of a job in one session do
+        not overwrite each other's views
+        """
+        if self.run_id is None:
+            return "{}_data".format(self.__class__.__name__)
+        return "{}_{}_data".format(self.__class__.__name__, self.run_id)
+
+    @property
+    def job_group(self) -> str:
+        """Spark job group of this job, `<run_id>:<job>`"""
+        if self.run_id is None:
+            return self.__class__.__name__
+        return "{}:{}".format(self.run_id, self.__class__.__name__)
+
+    def hints(self) -> dict:
+        """Spark hints of this job, updated with the `spark_hints` kwarg"""
+        hints = dict(self.spark_hints)
+        hints.update(self.kwargs.get("spark_hints") or {})
+        return hints
+
+    def execute(self):
+        """Execute entrypoint
+
+        Spark jobs are tagged with this job's group, so they can be
+        monitored and cancelled per job and run. The job's Spark hints
+        apply while it runs.
+        """
+        # Whatever memoized result produced the table, it is replaced now
+        self.table_keys.pop(self.temp_table, None)
+        engine = self.engine()
+        self.metrics["engine"] = engine
+        if engine == "local":
+            return self._execute_local()
+
+        if self.spark_context is None:
+            result = self._execute()
+        else:
+            self.spark_context.setJobGroup(
+                self.job_group,
+                "{} {}".format(self.__class__.__name__, self.kwargs))
+            manager = SessionManager(self.kwargs.get("spark_profile"))
+            with manager.configured(
+                    self.hints(), self.__class__.__name__) as spark_conf:
+                if spark_conf:
+                    self.metrics["spark_conf"] = spark_conf
+                result = self._execute()
+        # The Spark view replaces any local table of an earlier run
+        LocalCatalog().drop(self.temp_table)
+        return result
+
+    @classmethod
+    def has_local_engine(cls) -> bool:
+        """Whether this job implements `_execute_local`"""
+        return cls._execute_local is not SparkSQL._execute_local
+
+    def input_bytes(self) -> int:
+        """Size of the input files, None when not known"""
+        return None
+
+    def engine(self) -> str:
+        """Engine to run on, from the `engine` kwarg
+
+        - `spark` (default)
+        - `local`: pandas in the driver
+        - `auto`: local when the job has a local engine and reads a local
+          table, or reads at most `local_max_bytes` of local files. Local
+          results may differ slightly, e.g. exact distinct counts where
+          Spark approximates them
+        """
+        engine = self.kwargs.get("engine", "spark")
+        if engine not in ENGINES:
+            raise ValueError("Unknown engine %s" % engine)
+        if engine == "local" and not self.has_local_engine():
+            raise ValueError(
+                "%s has no local engine" % self.__class__.__name__)
+        if engine != "auto":
+            return engine
+        if not self.has_local_engine():
+            return "spark"
+
+        table = self.kwargs.get("previous_job_temp_table")
+        if table:
+            return "local" if table in LocalCatalog() else "spark"
+        size = self.input_bytes()
+        max_bytes = to_bytes(self.kwargs.get(
+            "local_max_bytes", LOCAL_MAX_BYTES))
+        return "local" if size is not None and size <= max_bytes \
+            else "spark"
+
+    def _execute_local(self) -> str:
+        """Run this job on pandas"""
+        raise NotImplementedError
+
+    def local_input(self) -> pd.DataFrame:
+        """The input temp table as a pandas dataframe"""
+        table = self.kwargs["previous_job_temp_table"]
+        if table in LocalCatalog():
+            return LocalCatalog().get(table)
+        return self.to_pandas(self.df_from_temp_table(table))
+
+    def local_output(self, pdf: pd.DataFrame, metadata: dict = None) -> str:
+        """Register a pandas dataframe as this job's temp table
+
+        As in a Spark select, columns of the input table keep their
+        metadata, updated with `metadata`
+
+        :param pdf: pandas dataframe
+        :param metadata: column to its Spark metadata
+        """
+        columns = {}
+        for source in (LocalCatalog().get_metadata(
+                self.kwargs.get("previous_job_temp_table")), metadata or {}):
+            for col_, meta in source.items():
+                if col_ in pdf.columns:
+                    columns[col_] = dict(columns.get(col_, {}), **meta)
+        LocalCatalog().register(self.temp_table, pdf, columns)
+        return self.temp_table
+
+    @classmethod
+    def pushdown_columns(cls) -> list:
+        """Columns this job drops from its input
+
+        Acquisition jobs can leave them out while reading the source
+        """
+        return []
+
+    @classmethod
+    def pushdown_predicate(cls) -> str:
+        """SQL predicate this job applies to its input rows
+
+        Acquisition jobs can apply it while reading the source
+        """
+        return ""
+
+    @classmethod
+    def pushdown_mask(cls, pdf: pd.DataFrame) -> pd.Series:
+        """`pushdown_predicate` on a pandas dataframe, rows to keep"""
+        if cls.pushdown_predicate():
+            raise NotImplementedError(
+                "%s has no pandas version of its predicate" % cls.__name__)
+        return pd.Series(True, index=pdf.index)
+
+    def pushdown_job(self):
+        """Downstream job whose drops and filters we apply when reading
+
+        Set with the `pushdown_for` kwarg, e.g.
+        `pushdown_for="GetTrainingData"`
+        """
+        job_name = self.kwargs.get("pushdown_for")
+        if not job_name:
+            return None
+        return JobHolder.get_registry()[job_name]
 
     def side_effect(self):
-        """Not using side effects for now"""
-        pass
+        """Optional instrumentation of the output temp table
+
+        - `partition_stats=True`: rows, sizes and skew of its partitions
+        - `plan_dir`: capture its query plans and compare with the
+          previous run
+        - expectations: data quality checks, see `expectations`
+        """
+        expectations = self.expectations()
+        if self.temp_table in LocalCatalog():
+            if expectations:
+                self.check_expectations(
+                    pandas_stats(LocalCatalog().get(self.temp_table),
+                                 expectations), expectations)
+            return
+        if not (self.kwargs.get("partition_stats") or
+                self.kwargs.get("plan_dir") or expectations) or \
+                not self.has_output():
+            return
+        df = self.df_from_temp_table(self.temp_table)
+        if self.kwargs.get("partition_stats"):
+            self.metrics["partition_skew"] = self.partition_stats(
+                df, float(self.kwargs.get("skew_warn_ratio", SKEW_WARN_RATIO)))
+        if self.kwargs.get("plan_dir"):
+            self.metrics["plan"] = self.capture_plans(df)
+        if expectations:
+            self.check_expectations(
+                df.agg(*spark_aggs(expectations)).first().asDict(),
+                expectations)
+
+    def load_fitted(self, path_kwarg: str, columns: list, compute,
+                    refit: bool = False) -> dict:
+        """Per column state fitted once and kept in the JSON file of a
+        kwarg, the missing columns are computed and saved there
+
+        :param path_kwarg: kwarg with the path of the JSON file
+        :param columns: columns to get the state of
+        :param compute: callable returning the state of columns
+        :param refit: compute all columns again
+        """
+        path = self.kwargs.get(path_kwarg)
+        saved = {}
+        if path and os.path.isfile(path) and not refit:
+            with open(path) as f_saved:
+                saved = json.load(f_saved)
+        missing = [col_ for col_ in columns if col_ not in saved]
+        if missing:
+            saved.update(compute(missing))
+            if path:
+                with open(path, "w") as f_saved:
+                    json.dump(saved, f_saved, sort_keys=True)
+        return {col_: saved[col_] for col_ in columns}
+
+    def feature_store(self) -> FeatureStore:
+        """Feature store, when `feature_store_dir` is given"""
+        root_dir = self.kwargs.get("feature_store_dir")
+        return FeatureStore(root_dir) if root_dir else None
+
+    @property
+    def feature_table(self) -> str:
+        """Feature store table, from the `feature_table` kwarg"""
+        return self.kwargs.get("feature_table", "training_data")
+
+    @property
+    def partition_date(self) -> str:
+        """Date of the pipeline run, from the `date` kwarg, today by
+        default"""
+        return str(self.kwargs.get("date") or strftime("%Y-%m-%d"))
+
+    def expectations(self) -> list:
+        """Data quality checks of the output, see `jobs.core.expectations`
+
+        From the `expectations` kwarg (a list, or False to skip them) or
+        this job's entry in `conf/expectations.json`
+        """
+        expectations = self.kwargs.get("expectations")
+        if expectations is None:
+            try:
+                expectations = FromJson(THIS_DIR)[
+                    "conf.expectations.{}".format(self.__class__.__name__)]
+            except AttributeError:
+                expectations = []
+        return list(expectations or [])
+
+    def check_expectations(self, stats: dict, expectations: list):
+        """Report the expectations in the metrics
+
+        Unmet `warn` expectations are logged, unmet `fail` ones raise
+        ExpectationError
+
+        :param stats: statistics of the expectations, in one aggregation
+        :param expectations: expectation dicts
+        """
+        report = evaluate(expectations, stats)
+        self.metrics["expectations"] = report
+        for name in report["warned"]:
+            LOGGER.warning("%s output does not meet %s: %s", self.job_group,
+                           name, report["observed"][name])
+        if report["failed"]:
+            raise ExpectationError("{} output does not meet {}".format(
+                self.job_group, ", ".join(
+                    "{} {}".format(name, report["observed"][name])
+                    for name in report["failed"])))
+
+    def has_output(self) -> bool:
+        """Whether this job's temp table exists"""
+        return self.temp_table in [
+            table.name
+            for table in self.get_sql_context().catalog.listTables()]
+
+    def capture_plans(self, df_) -> dict:
+        """Save the optimized and physical plans of a dataframe
+
+        Stored under `plan_dir` per run (`run_id` or a timestamp) and
+        compared with the previous run of this job
+
+        :param df_: pyspark dataframe
+        :return: plan fingerprint and changes since the previous run
+        """
+        # pylint:disable=protected-access
+        query_execution = df_._jdf.queryExecution()
+        store = PlanStore(self.kwargs["plan_dir"])
+        job, run_id = (self.__class__.__name__,
+                       self.run_id or strftime("%Y%m%dT%H%M%S"))
+        previous = [run for run in store.runs(job)
+                    if run["run_id"] != run_id]
+        captured = store.save(
+            job, run_id,
+            query_execution.optimizedPlan().toString(),
+            query_execution.executedPlan().toString())
+
+        plan = {"fingerprint": captured["fingerprint"], "changed": False}
+        if previous:
+            diff = diff_plans(previous[-1], captured)
+            plan.update({
+                "changed": diff["changed"],
+                "new_exchanges": diff["new_exchanges"],
+                "new_scans": diff["new_scans"],
+                "join_strategy_changed": diff["join_strategy_changed"]
+            })
+            if diff["new_exchanges"] or diff["new_scans"]:
+                LOGGER.warning(
+                    "%s plan has new exchanges %s or scans %s",
+                    self.job_group, diff["new_exchanges"],
+                    diff["new_scans"])
+        return plan
+
+    @staticmethod
+    def partition_sizes(df_, sample_rows: int = PARTITION_SAMPLE_ROWS):
+        """Rows and approximate bytes of each partition in one pass
+
+        The size is extrapolated from the pickled size of the first rows
+
+        :param df_: pyspark dataframe
+        :param sample_rows: rows to pickle per partition
+        :return: list of (rows, bytes), one per partition
+        """
+        def count_partition(rows):
+            num_rows, sample_bytes = 0, 0
+            for row in rows:
+                if num_rows < sample_rows:
+                    sample_bytes += len(pickle.dumps(tuple(row)))
+                num_rows += 1
+            yield num_rows, int(
+                sample_bytes * num_rows / min(num_rows, sample_rows)
+                if num_rows else 0)
+
+        return df_.rdd.mapPartitions(count_partition).collect()
+
+    def partition_stats(self, df_, warn_ratio: float = SKEW_WARN_RATIO):
+        """Partition level row counts, sizes and skew statistics
+
+        :param df_: pyspark dataframe
+        :param warn_ratio: max to median rows ratio to warn about
+        :return: dict for the metrics
+        """
+        sizes = self.partition_sizes(df_)
+        rows = [num_rows for num_rows, _ in sizes]
+        stats = skew_stats(rows)
+        stats.update({
+            "rows": rows,
+            "bytes": [num_bytes for _, num_bytes in sizes],
+            "histogram": histogram(rows),
+            "skewed": stats["max_median_ratio"] > warn_ratio
+        })
+        if stats["skewed"]:
+            LOGGER.warning(
+                "%s output is skewed: %s rows in the largest partition, "
+                "%s median (gini %.2f)", self.job_group, stats["max"],
+                stats["median"], stats["gini"])
+        return stats
 
     def get_sql_context(self):
-        """Get sql context to use"""
-        return SQLContext(self.spark_context)
+        """SparkSession shared by the jobs of this process"""
+        return SessionManager(self.kwargs.get("spark_profile")).session
 
     def df_from_temp_table(self, table_name):
         """Execute a spark sql
@@ -35,9 +441,190 @@ class SparkSQL(BaseRegistry):
         :param table_name: spark temp table name
         :return: pyspark dataframe
         """
-        return SQLContext(self.spark_context).sql(
+        if table_name in LocalCatalog():
+            # Output of a job run on the local engine, moved to Spark once
+            df = self.get_sql_context().createDataFrame(
+                LocalCatalog().get(table_name))
+            metadata = LocalCatalog().get_metadata(table_name)
+            if metadata:
+                df = df.select(*[
+                    col(c).alias(c, metadata=metadata[c])
+                    if c in metadata else col(c) for c in df.columns])
+            df.createOrReplaceTempView(table_name)
+            LocalCatalog().drop(table_name)
+        return self.get_sql_context().sql(
             "SELECT * FROM {}".format(table_name))
 
+    @staticmethod
+    def arrow_stream(df_):
+        """Arrow batches of a dataframe as the driver receives them
+
+        What `toPandas` reads with Arrow enabled, yielded one batch at a
+        time instead of all at once: the record batches in the order they
+        arrive, then the list of their indices in partition order.
+
+        :param df_: pyspark dataframe
+        :return: generator of record batches, then of the batch order
+        """
+        # pylint:disable=protected-access
+        with SCCallSiteSync(df_._sc):
+            port, secret, server = df_._jdf.collectAsArrowToPython()
+        try:
+            stream = _load_from_socket(
+                (port, secret), ArrowCollectSerializer())
+            # A context manager from pyspark 4, the stream itself before
+            if hasattr(stream, "__enter__"):
+                with stream as batches:
+                    yield from batches
+            else:
+                yield from stream
+        finally:
+            with unwrap_spark_exception():
+                server.getResult()
+
+    def to_pandas(self, df_, max_bytes=None) -> pd.DataFrame:
+        """Collect a dataframe to the driver as a pandas dataframe
+
+        Arrow is enabled on the session, see `SessionManager`. The result
+        comes in one pass, batch by batch, and the collection stops as
+        soon as the Arrow bytes received are over the budget, so a result
+        too large for the driver fails without ever being held whole. The
+        pandas frame is built releasing the Arrow buffers as it goes.
+
+        :param df_: pyspark dataframe
+        :param max_bytes: budget, defaults to `driver_memory_budget` kwarg
+        :return: pandas dataframe
+        """
+        budget = to_bytes(max_bytes or self.kwargs.get(
+            "driver_memory_budget", DRIVER_MEMORY_BUDGET))
+        batches, size = [], 0
+        for item in self.arrow_stream(df_):
+            if not isinstance(item, pa.RecordBatch):
+                # Last comes the order of the batches
+                batches = [batches[i] for i in item]
+                break
+            size += item.nbytes
+            self._check_budget(size, budget)
+            batches.append(item)
+        if not batches:
+            return df_.limit(0).toPandas()
+        table = pa.Table.from_batches(batches)
+        del batches
+        pdf = table.to_pandas(
+            date_as_object=True, self_destruct=True, split_blocks=True)
+        del table
+        self._check_budget(pdf.memory_usage(deep=True).sum(), budget)
+        return pdf
+
+    @staticmethod
+    def _check_budget(size: int, budget: int):
+        """Fail once collected data is over the budget"""
+        if size > budget:
+            raise DriverMemoryError(
+                "Collected {} bytes, over the driver budget of {}".format(
+                    size, budget))
+
+    @staticmethod
+    def fingerprint(df_) -> str:
+        """Content fingerprint of a dataframe
+
+        Schema, row count and an order independent sum of 64 bit row
+        hashes, computed in a single aggregation. The sum is a decimal so
+        it can't overflow, and a null mask is hashed as `xxhash64` skips
+        nulls.
+
+        :param df_: pyspark dataframe
+        :return: hex digest
+        """
+        cols_ = [col(col_) for col_ in df_.columns]
+        null_mask = concat_ws(
+            "", *[when(col_.isNull(), "1").otherwise("0") for col_ in cols_])
+        row = df_.agg(
+            count(lit(1)),
+            sum_(xxhash64(*cols_, null_mask).cast("decimal(38,0)"))
+        ).collect()[0]
+        content = "{}|{}|{}".format(df_.schema.simpleString(), row[0], row[1])
+        return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+    def memo_inputs(self) -> list:
+        """Input files (path, size, mtime) and the input temp table
+
+        A temp table is identified by the memoization key of the job that
+        produced it in this session, or by its content fingerprint
+        """
+        inputs = []
+        filenames = self.kwargs.get("filename") or []
+        if isinstance(filenames, str):
+            filenames = [filenames]
+        for filename in filenames:
+            paths = [filename]
+            if os.path.isdir(filename):
+                paths = sorted(
+                    os.path.join(dir_, file_)
+                    for dir_, _, files in os.walk(filename)
+                    for file_ in files)
+            for path in paths:
+                if os.path.isfile(path):
+                    stat = os.stat(path)
+                    inputs.append([path, stat.st_size, stat.st_mtime])
+                else:
+                    inputs.append([path])
+
+        table = self.kwargs.get("previous_job_temp_table")
+        if table in LocalCatalog() and table not in self.table_keys:
+            inputs.append(self.local_fingerprint(LocalCatalog().get(table)))
+        elif table:
+            inputs.append(self.table_keys.get(table) or self.fingerprint(
+                self.df_from_temp_table(table)))
+        return inputs
+
+    @staticmethod
+    def local_fingerprint(pdf: pd.DataFrame) -> str:
+        """Fingerprint of the rows and schema of a pandas dataframe"""
+        content = "{}|{}|{}".format(
+            len(pdf), list(zip(pdf.columns, map(str, pdf.dtypes))),
+            int(pd.util.hash_pandas_object(pdf, index=False).sum()))
+        return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+    def memo_save(self, key: str, result, path: str):
+        """Save the output temp table as Parquet"""
+        if result == self.temp_table and result in LocalCatalog():
+            LocalCatalog().get(result).to_parquet(
+                os.path.join(path, "data.parquet"))
+            with open(os.path.join(path, "metadata.json"), "w") as f_meta:
+                json.dump(LocalCatalog().get_metadata(result), f_meta)
+        elif result == self.temp_table:
+            self.df_from_temp_table(self.temp_table).write.parquet(
+                os.path.join(path, "data"))
+
+    def memo_restore(self, key: str, result, path: str):
+        """Restore the output temp table from Parquet
+
+        After saving too, so downstream jobs read the Parquet rather than
+        compute the lineage a second time. The table is the one of this
+        run, whichever run saved it.
+        """
+        data_path = os.path.join(path, "data")
+        if os.path.isfile(data_path + ".parquet"):
+            metadata = {}
+            if os.path.isfile(os.path.join(path, "metadata.json")):
+                with open(os.path.join(path, "metadata.json")) as f_meta:
+                    metadata = json.load(f_meta)
+            LocalCatalog().register(
+                self.temp_table, pd.read_parquet(data_path + ".parquet"),
+                metadata)
+            result = self.temp_table
+        elif os.path.isdir(data_path):
+            self.get_sql_context().read.parquet(data_path) \
+                .createOrReplaceTempView(self.temp_table)
+            result = self.temp_table
+        self.table_keys[self.temp_table] = key
+        return result
+
+    def memo_pinned(self) -> set:
+        """Keys of the entries backing temp tables of this session"""
+        return set(self.table_keys.values())
+
     @abstractmethod
     def _execute(self):
         """Job logic"""
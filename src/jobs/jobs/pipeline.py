@@ -0,0 +1,126 @@
+"""Running chains of registered jobs
+
+A pipeline is a list of job names from the registry, or the name of one
+in `conf/pipelines.json`. Each job reads the temp table of the previous
+one.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import logging
+
+from jobs.config.file import THIS_DIR, FromJson
+from jobs.core.base import JobHolder
+
+__all__ = ["run_pipeline", "PipelineFanOut"]
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+def pipeline_jobs(pipeline) -> list:
+    """Job names of a pipeline
+
+    :param pipeline: list of job names or a name in `conf/pipelines.json`
+    """
+    if isinstance(pipeline, str):
+        return FromJson(THIS_DIR)["conf.pipelines.{}".format(pipeline)]
+    return list(pipeline)
+
+
+def run_pipeline(spark_context, pipeline, run_id=None, job_kwargs=None,
+                 **kwargs) -> list:
+    """Run the jobs of a pipeline in order
+
+    :param spark_context: SparkContext
+    :param pipeline: list of job names or a name in `conf/pipelines.json`
+    :param run_id: scopes the temp tables and job groups of this run
+    :param job_kwargs: job name to kwargs of that job only, over `kwargs`
+    :param kwargs: passed to every job
+    :return: result and metrics of each job
+    """
+    registry = JobHolder.get_registry()
+    job_kwargs = job_kwargs or {}
+    previous_table, results = None, []
+    for job_name in pipeline_jobs(pipeline):
+        this_kwargs = dict(kwargs)
+        this_kwargs.update(job_kwargs.get(job_name) or {})
+        if run_id is not None:
+            this_kwargs["run_id"] = run_id
+        if previous_table is not None:
+            this_kwargs["previous_job_temp_table"] = previous_table
+        job = registry[job_name](spark_context, **this_kwargs)
+        result = [res for res in job.execute_extra()][0]
+        results.append({
+            "job": job_name,
+            "result": result,
+            "metrics": job.get_metrics()
+        })
+        previous_table = result
+    return results
+
+
+class PipelineFanOut:
+    """Run many instances of a pipeline concurrently in one SparkContext
+
+    Each run gets its own temp tables and job groups (`run_id`) and its
+    own FAIR scheduler pool, so runs share the executors fairly. The
+    SparkContext must be created with `spark.scheduler.mode=FAIR`, as
+    `SessionManager` does: it can't change once the context runs.
+    """
+
+    def __init__(self, spark_context, pipeline, max_workers: int = 4,
+                 pool_prefix: str = "pipeline"):
+        """
+        :param spark_context: SparkContext
+        :param pipeline: list of job names or a name in `conf/pipelines.json`
+        :param max_workers: Number of runs at the same time
+        :param pool_prefix: Prefix of the scheduler pool names
+        """
+        self.spark_context = spark_context
+        self.pipeline = pipeline_jobs(pipeline)
+        self.max_workers = max_workers
+        self.pool_prefix = pool_prefix
+
+    def pool_name(self, run_id) -> str:
+        """Scheduler pool of a run"""
+        return "{}_{}".format(self.pool_prefix, run_id)
+
+    def run_one(self, run_id, kwargs: dict) -> list:
+        """Run one instance in its scheduler pool
+
+        Local properties are per thread, they are cleared once done as
+        the thread is reused
+        """
+        self.spark_context.setLocalProperty(
+            "spark.scheduler.pool", self.pool_name(run_id))
+        try:
+            return run_pipeline(
+                self.spark_context, self.pipeline, run_id, **kwargs)
+        finally:
+            self.spark_context.setLocalProperty("spark.scheduler.pool", None)
+
+    def run(self, runs: dict) -> dict:
+        """Run all instances
+
+        :param runs: run id to the kwargs of that run, e.g. one per date
+            partition or source file
+        :return: run id to status, and results or error
+        """
+        mode = self.spark_context.getConf().get("spark.scheduler.mode")
+        if mode != "FAIR":
+            LOGGER.warning(
+                "spark.scheduler.mode is %s, not FAIR: runs are scheduled "
+                "first in first out and pools are ignored", mode)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {
+                run_id: executor.submit(self.run_one, run_id, kwargs)
+                for run_id, kwargs in runs.items()}
+        outcomes = {}
+        for run_id, future in futures.items():
+            error = future.exception()
+            if error is None:
+                outcomes[run_id] = {
+                    "status": "success", "results": future.result()}
+            else:
+                LOGGER.error("Run %s failed: %s", run_id, error)
+                outcomes[run_id] = {"status": "failed", "error": str(error)}
+        return outcomes
@@ -7,12 +7,16 @@
 from .job import GetTrainingData
 from .job import DropNullAndDuplicateRow
 from .job import DropNullColumns
+from .job import CompactSchema
 from .job import SetTrainingData
+from .job import QuantileBinning
 
 
 __all__ = [
     "GetTrainingData",
     "DropNullAndDuplicateRow",
     "DropNullColumns",
-    "SetTrainingData"
+    "CompactSchema",
+    "SetTrainingData",
+    "QuantileBinning"
 ]
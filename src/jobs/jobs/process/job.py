@@ -1,28 +1,71 @@
 # """Acquisition jobs"""
 # import math
+from itertools import chain
+
+import numpy as np
 import pandas as pd
 from pyspark.mllib.stat import Statistics
-from pyspark.ml.feature import StringIndexer
+from pyspark.ml.feature import Bucketizer, StringIndexer
 from pyspark.sql.functions import (
-    approx_count_distinct, isnan, when, count, col)
+    approx_count_distinct, isnan, when, count, col, broadcast, concat_ws,
+    lit, pmod, struct, sum as sum_, xxhash64, array, avg, create_map,
+    explode, floor, length, max as max_, min as min_)
+from pyspark.storagelevel import StorageLevel
 from jobs.config.file import THIS_DIR, FromJson
+from jobs.core.local import LocalCatalog, spark_dtypes, string_columns
 from jobs.jobs.common import SparkSQL
 
 
 class GetTrainingData(SparkSQL):
     """Get training data"""
     metrics = {}
+    target = "loan_status"
+    target_values = ("Fully Paid", "Charged Off")
+
+    @classmethod
+    def pushdown_columns(cls) -> list:
+        """Columns not used in modelling"""
+        return FromJson(THIS_DIR)["conf.modelling.drop_columns"]
+
+    @classmethod
+    def pushdown_predicate(cls) -> str:
+        """Only keep loans with a final status"""
+        return "{} IN ({})".format(
+            cls.target,
+            ", ".join("'{}'".format(val) for val in cls.target_values))
+
+    @classmethod
+    def pushdown_mask(cls, pdf: pd.DataFrame) -> pd.Series:
+        """Loans with a final status"""
+        return pdf[cls.target].isin(cls.target_values)
+
+    @classmethod
+    def transform(cls, df_):
+        """Drop unused columns and keep loans with a final status
+
+        Row by row, so it applies to batch and streaming dataframes alike
+        """
+        return df_.drop(*cls.pushdown_columns()).where(
+            cls.pushdown_predicate())
+
+    def _execute_local(self) -> str:
+        """Run this job on pandas"""
+        pdf = self.local_input()
+        pdf = pdf.drop(columns=[col_ for col_ in self.pushdown_columns()
+                                if col_ in pdf.columns])
+        pdf = pdf[self.pushdown_mask(pdf)].reset_index(drop=True)
+        self.metrics["num_records"] = len(pdf)
+        self.metrics["num_columns"] = len(pdf.columns)
+        return self.local_output(pdf)
 
     def _execute(self) -> str:
-        """Run this job"""
+        """Run this job
+
+        Dropping and filtering again is a no-op when the acquisition job
+        already applied them with `pushdown_for="GetTrainingData"`
+        """
         df = self.df_from_temp_table(self.kwargs["previous_job_temp_table"])
-        conf = FromJson(THIS_DIR)
-        columns_to_drop = conf["conf.modelling.drop_columns"]
-        df = df.drop(*columns_to_drop)
-        df = df.filter(
-            (df["loan_status"] == "Fully Paid") |
-            (df["loan_status"] == "Charged Off")
-        )
+        df = self.transform(df)
         self.metrics["num_records"] = df.count()
         self.metrics["num_columns"] = len(df.columns)
         df.createOrReplaceTempView(self.temp_table)
@@ -32,26 +75,192 @@ class GetTrainingData(SparkSQL):
 class DropNullAndDuplicateRow(SparkSQL):
     """Drop null rows and duplicates
 
-    Remove null and duplicate rows"""
+    Remove null and duplicate rows
+
+    Duplicates are found with `dedup_strategy`:
+    - `full`: compare every column (default)
+    - `key`: compare the `dedup_keys` business key, `skew_aware=True`
+      spreads hot keys over salted buckets before the final dedup
+    - `hash`: compare a 64 or 128 bit (`hash_bits`) row hash computed on
+      the map side, only the hashes are shuffled
+    """
 
     metrics = {}
+    strategies = ("full", "key", "hash")
+    hash_col = "_row_hash"
+    salt_col = "_dedup_salt"
+
+    def dedup_strategy(self) -> str:
+        """Checked `dedup_strategy` kwarg"""
+        strategy = self.kwargs.get("dedup_strategy", "full")
+        if strategy not in self.strategies:
+            raise ValueError("Unknown dedup strategy %s" % strategy)
+        if strategy == "key" and not self.dedup_keys():
+            raise ValueError("dedup_keys are needed to dedup on key")
+        return strategy
+
+    def dedup_keys(self) -> list:
+        """Business key columns from the `dedup_keys` kwarg"""
+        keys = self.kwargs.get("dedup_keys") or []
+        if isinstance(keys, str):
+            keys = [key.strip() for key in keys.split(",") if key.strip()]
+        return list(keys)
+
+    @classmethod
+    def with_row_hash(cls, df_, bits: int = 64):
+        """Add a row hash column
+
+        A null mask is hashed as well, as nulls are skipped by `xxhash64`
+
+        :param df_: pyspark dataframe
+        :param bits: 64 or 128
+        :return: pyspark dataframe with `hash_col`
+        """
+        cols_ = [col(c) for c in df_.columns]
+        null_mask = concat_ws(
+            "", *[when(c.isNull(), "1").otherwise("0") for c in cols_])
+        row_hash = xxhash64(*cols_, null_mask)
+        if int(bits) == 128:
+            row_hash = struct(
+                row_hash.alias("high"),
+                xxhash64(null_mask, *reversed(cols_)).alias("low"))
+        return df_.withColumn(cls.hash_col, row_hash)
+
+    def drop_hash_duplicates(self, df_):
+        """Drop duplicate rows by row hash
+
+        Hashes seen more than once are found by shuffling the hashes only.
+        Rows with those hashes, usually few, are deduplicated on their
+        own and the rest pass through with a broadcast anti join.
+
+        :param df_: pyspark dataframe
+        :return: (pyspark dataframe, number of duplicates, persisted hashed
+            rows to unpersist once the dataframe is materialized)
+        """
+        hashed = self.with_row_hash(
+            df_, self.kwargs.get("hash_bits", 64)
+        ).persist(StorageLevel.MEMORY_AND_DISK)
+        counts = hashed.groupBy(self.hash_col).count()
+        dup_hashes = counts.where(col("count") > 1).select(self.hash_col)
+        num_dup_hashes, num_duplicates = counts.where(col("count") > 1).agg(
+            count(lit(1)), sum_(col("count") - 1)).collect()[0]
+
+        if not num_dup_hashes:
+            return hashed.drop(self.hash_col), 0, hashed
+        if num_dup_hashes > int(self.kwargs.get(
+                "broadcast_max_hashes", 1000000)):
+            return hashed.dropDuplicates([self.hash_col]) \
+                .drop(self.hash_col), int(num_duplicates), hashed
+
+        uniques = hashed.join(
+            broadcast(dup_hashes), self.hash_col, "left_anti")
+        duplicates = hashed.join(
+            broadcast(dup_hashes), self.hash_col, "left_semi") \
+            .dropDuplicates([self.hash_col])
+        return uniques.unionByName(duplicates).drop(self.hash_col), \
+            int(num_duplicates), hashed
+
+    @staticmethod
+    def drop_null_rows(df_, threshold: float):
+        """Drop rows with fewer than `threshold` of their columns set
+
+        Row by row, so it applies to batch and streaming dataframes alike
+        """
+        return df_.dropna(thresh=int(threshold * len(df_.columns)))
+
+    def hot_keys(self, df_, keys: list) -> int:
+        """Number of keys holding more than `hot_key_ratio` of a sample"""
+        sample = df_.sample(
+            fraction=float(self.kwargs.get("skew_sample_fraction", 0.01)),
+            seed=42)
+        total = sample.count()
+        if not total:
+            return 0
+        ratio = float(self.kwargs.get("hot_key_ratio", 0.01))
+        return sample.groupBy(*keys).count() \
+            .where(col("count") > ratio * total).count()
+
+    def drop_key_duplicates(self, df_, keys: list):
+        """Keep one row per business key
+
+        With `skew_aware=True` and hot keys in a sample, rows are first
+        deduplicated per key and salt bucket (the row hash modulo
+        `skew_salt_buckets`), so the final dedup gets at most one row per
+        bucket of each hot key.
+
+        :param df_: pyspark dataframe
+        :param keys: business key columns
+        :return: pyspark dataframe
+        """
+        if not self.kwargs.get("skew_aware"):
+            return df_.dropDuplicates(keys)
+
+        self.metrics["hot_keys"] = self.hot_keys(df_, keys)
+        if not self.metrics["hot_keys"]:
+            return df_.dropDuplicates(keys)
+
+        buckets = int(self.kwargs.get("skew_salt_buckets", 16))
+        salted = self.with_row_hash(df_).withColumn(
+            self.salt_col, pmod(col(self.hash_col), lit(buckets)))
+        return salted.dropDuplicates(keys + [self.salt_col]) \
+            .dropDuplicates(keys).drop(self.hash_col, self.salt_col)
 
     def _execute(self) -> str:
         """Run this job"""
         df = self.df_from_temp_table(self.kwargs["previous_job_temp_table"])
-        cols_ = df.columns
-
         threshold = float(self.kwargs.get("na_threshold", "0.7"))
-
-        na_thresh = int(threshold * len(cols_))
-        df = df.dropna(thresh=na_thresh).dropDuplicates()
-
-        self.metrics["num_records"] = df.count()
+        df = self.drop_null_rows(df, threshold)
+
+        strategy = self.dedup_strategy()
+        if strategy == "hash":
+            df, num_duplicates, hashed = self.drop_hash_duplicates(df)
+            # The deduplicated rows back the view from now on
+            df = df.persist(StorageLevel.MEMORY_AND_DISK)
+            num_records = df.count()
+            hashed.unpersist()
+        else:
+            # Counted before and after the dedup, computed once
+            cached = df.persist(StorageLevel.MEMORY_AND_DISK)
+            num_input_records = cached.count()
+            if strategy == "key":
+                df = self.drop_key_duplicates(cached, self.dedup_keys())
+            else:
+                df = cached.dropDuplicates()
+            df = df.persist(StorageLevel.MEMORY_AND_DISK)
+            num_records = df.count()
+            cached.unpersist()
+            num_duplicates = num_input_records - num_records
+
+        self.metrics["num_records"] = num_records
         self.metrics["num_columns"] = len(df.columns)
+        self.metrics["dedup_strategy"] = strategy
+        self.metrics["num_duplicates"] = num_duplicates
 
         df.createOrReplaceTempView(self.temp_table)
         return self.temp_table
 
+    def _execute_local(self) -> str:
+        """Run this job on pandas
+
+        Every strategy compares the same columns as on Spark, the hash
+        strategy only differs in how Spark finds the duplicates
+        """
+        pdf = self.local_input()
+        threshold = float(self.kwargs.get("na_threshold", "0.7"))
+        pdf = pdf.dropna(thresh=int(threshold * len(pdf.columns)))
+
+        strategy = self.dedup_strategy()
+        num_input_records = len(pdf)
+        pdf = pdf.drop_duplicates(
+            subset=self.dedup_keys() if strategy == "key" else None
+        ).reset_index(drop=True)
+
+        self.metrics["num_records"] = len(pdf)
+        self.metrics["num_columns"] = len(pdf.columns)
+        self.metrics["dedup_strategy"] = strategy
+        self.metrics["num_duplicates"] = num_input_records - len(pdf)
+        return self.local_output(pdf)
+
 
 class DropNullColumns(SparkSQL):
     """Prepare training data
@@ -60,8 +269,8 @@ class DropNullColumns(SparkSQL):
 
     metrics = {}
 
-    @staticmethod
     def null_columns(
+            self,
             df_,
             num_rows_: int,
             threshold: float = 0.8) -> list:
@@ -75,7 +284,7 @@ class DropNullColumns(SparkSQL):
         df = df_.select(
             [count(when(isnan(c) | col(c).isNull(), c)).alias(c) for c in
              df_.columns])
-        cols_data = df.toPandas().to_dict()
+        cols_data = self.to_pandas(df).to_dict()
         cols_data = {col_: val[0] for col_, val in cols_data.items()}
 
         cols = []
@@ -102,14 +311,357 @@ class DropNullColumns(SparkSQL):
         df.createOrReplaceTempView(self.temp_table)
         return self.temp_table
 
+    def _execute_local(self) -> str:
+        """Run this job on pandas"""
+        pdf = self.local_input()
+        threshold = float(self.kwargs.get("na_threshold", "0.7"))
+        nulls = pdf.isna().sum()
+        columns_to_drop = [
+            col_ for col_ in pdf.columns
+            if float(nulls[col_]) / len(pdf) > threshold]
+        pdf = pdf.drop(columns=columns_to_drop)
+
+        self.metrics["num_records"] = len(pdf)
+        self.metrics["num_columns"] = len(pdf.columns)
+        self.metrics["columns_dropped"] = len(columns_to_drop)
+        return self.local_output(pdf)
+
+
+class CompactSchema(SparkSQL):
+    """Shrink column types
+
+    Profiled in one pass, columns are cast to the smallest type that
+    holds their values, so later jobs cache and shuffle less:
+    - integers, and doubles without fractions, to the smallest integer
+      type fitting their min and max
+    - other doubles to float
+    - strings with at most `max_code_cardinality` distinct values to
+      integer codes, the most frequent value first like `StringIndexer`
+
+    The codes are kept in `codes_path` (JSON) when given, and reused from
+    there by later runs so the same values get the same codes. Columns
+    declared continuous in `binning_columns`, binned by `QuantileBinning`,
+    are kept as they are.
+
+    The cast of each column, with the codes of strings, is in its
+    metadata, so `BenchmarkModel` saves the casts with the model and
+    `ScoreLoans` applies them instead of those fitted on its batch.
+    """
+
+    metrics = {}
+    target = "loan_status"
+    # (type, min, max) from the smallest
+    int_types = (
+        ("tinyint", -2 ** 7, 2 ** 7 - 1),
+        ("smallint", -2 ** 15, 2 ** 15 - 1),
+        ("int", -2 ** 31, 2 ** 31 - 1),
+        ("bigint", -2 ** 63, 2 ** 63 - 1)
+    )
+    float_max = 3.4028234e38
+    # Pandas types of the compact types on the local engine
+    local_types = {"tinyint": "Int8", "smallint": "Int16", "int": "Int32",
+                   "bigint": "Int64", "float": "float32"}
+    # Bytes per value in Spark's row format, strings add their length
+    type_bytes = {"tinyint": 1, "smallint": 2, "int": 4, "bigint": 8,
+                  "float": 4, "double": 8, "string": 8}
+    # Column metadata key of the cast of a compacted column
+    cast_key = "compact_cast"
+
+    @classmethod
+    def smallest_int_type(cls, min_value, max_value) -> str:
+        """Smallest integer type holding a range, None if there is none"""
+        for type_, low, high in cls.int_types:
+            if low <= min_value and max_value <= high:
+                return type_
+        return None
+
+    @classmethod
+    def compact_type(cls, dtype: str, profile: dict,
+                     max_code_cardinality: int) -> str:
+        """Type to cast a column to, None to keep it
+
+        :param dtype: current type
+        :param profile: `min`, `max`, `fractions` (non integral values)
+            and `distinct` of the column
+        :param max_code_cardinality: max distinct strings to code
+        """
+        if dtype == "string":
+            if profile["distinct"] <= max_code_cardinality:
+                return cls.smallest_int_type(0, max_code_cardinality - 1)
+            return None
+        if dtype not in ("tinyint", "smallint", "int", "bigint", "float",
+                         "double"):
+            return None
+        if profile["min"] is None:
+            # No values, nothing to keep
+            return "tinyint" if dtype != "tinyint" else None
+
+        type_ = None
+        if not profile.get("fractions"):
+            type_ = cls.smallest_int_type(profile["min"], profile["max"])
+        if type_ is None and dtype == "double" and \
+                max(abs(profile["min"]), abs(profile["max"])) <= \
+                cls.float_max:
+            type_ = "float"
+        if type_ is None or cls.type_bytes[type_] >= cls.type_bytes[dtype]:
+            return None
+        return type_
+
+    def profile(self, df_) -> dict:
+        """Rows and per column min, max, non integral values, distinct
+        values and average string length, in one aggregation"""
+        aggs = [count(lit(1)).alias("_rows")]
+        for col_, dtype in df_.dtypes:
+            if dtype == "string":
+                aggs.extend([
+                    approx_count_distinct(col(col_)).alias(col_ + ".distinct"),
+                    avg(length(col(col_))).alias(col_ + ".length")])
+            elif dtype in self.type_bytes:
+                aggs.extend([
+                    min_(col(col_)).alias(col_ + ".min"),
+                    max_(col(col_)).alias(col_ + ".max")])
+                if dtype in ("float", "double"):
+                    aggs.append(sum_(
+                        (col(col_) != floor(col(col_))).cast("int")
+                    ).alias(col_ + ".fractions"))
+        row = self.to_pandas(df_.agg(*aggs)).to_dict("records")[0]
+
+        profile = {"_rows": int(row.pop("_rows"))}
+        for key, value in row.items():
+            col_, stat = key.rsplit(".", 1)
+            profile.setdefault(col_, {})[stat] = \
+                None if pd.isnull(value) else value
+        return profile
+
+    def string_codes(self, df_, columns: list) -> dict:
+        """Values of string columns, most frequent first
+
+        One aggregation over (column, value) pairs for all columns
+        """
+        if not columns:
+            return {}
+        pairs = df_.select(explode(array(*[
+            struct(lit(col_).alias("column"),
+                   col(col_).alias("value")) for col_ in columns
+        ])).alias("pair")).select("pair.column", "pair.value") \
+            .where(col("value").isNotNull()) \
+            .groupBy("column", "value").count()
+        counts = self.to_pandas(pairs).sort_values(
+            ["count", "value"], ascending=[False, True])
+        return {col_: counts[counts["column"] == col_]["value"].tolist()
+                for col_ in columns}
+
+    @staticmethod
+    def string_codes_local(pdf: pd.DataFrame, columns: list) -> dict:
+        """`string_codes` of a pandas dataframe"""
+        codes = {}
+        for col_ in columns:
+            counts = pdf[col_].dropna().value_counts()
+            counts = pd.DataFrame(
+                {"value": counts.index, "count": counts.values}
+            ).sort_values(["count", "value"], ascending=[False, True])
+            codes[col_] = counts["value"].tolist()
+        return codes
+
+    def load_codes(self, columns: list, compute) -> dict:
+        """String codes from `codes_path`, the missing ones are computed
+        and saved there
+
+        :param columns: string columns to code
+        :param compute: callable returning the codes of columns
+        """
+        return self.load_fitted("codes_path", columns, compute)
+
+    @classmethod
+    def row_bytes(cls, dtypes: list, profile: dict) -> float:
+        """Estimated bytes per row of a schema"""
+        size = 0.0
+        for col_, dtype in dtypes:
+            size += cls.type_bytes.get(dtype, 8)
+            if dtype == "string":
+                size += profile.get(col_, {}).get("length") or 0.0
+        return size
+
+    def plan_casts(self, dtypes: list, profile: dict) -> dict:
+        """Column to (type, compact type) of the columns to cast"""
+        max_codes = int(self.kwargs.get("max_code_cardinality", 10))
+        continuous = set(self.kwargs.get("binning_columns") or [])
+        casts = {}
+        for col_, dtype in dtypes:
+            if col_ == self.target or col_ not in profile or \
+                    col_ in continuous:
+                continue
+            type_ = self.compact_type(dtype, profile[col_], max_codes)
+            if type_ is not None:
+                casts[col_] = (dtype, type_)
+        return casts
+
+    def set_metrics(self, dtypes: list, compact_dtypes: list, casts: dict,
+                    profile: dict):
+        """Casts and estimated savings"""
+        before = self.row_bytes(dtypes, profile)
+        after = self.row_bytes(compact_dtypes, profile)
+        self.metrics["num_records"] = profile["_rows"]
+        self.metrics["num_columns"] = len(compact_dtypes)
+        self.metrics["casts"] = {
+            col_: "{} -> {}".format(*types) for col_, types in casts.items()}
+        self.metrics["row_bytes_before"] = before
+        self.metrics["row_bytes_after"] = after
+        self.metrics["estimated_saved_bytes"] = int(
+            (before - after) * profile["_rows"])
+
+    @staticmethod
+    def column_casts(casts: dict, codes: dict) -> dict:
+        """Casts as kept in the column metadata
+
+        :param casts: column to (type, compact type), see `plan_casts`
+        :param codes: string column to its values, see `load_codes`
+        :return: column to `type`, `cast` and the `codes` of strings
+        """
+        return {col_: dict({"type": dtype, "cast": type_}, **(
+            {"codes": codes[col_]} if dtype == "string" else {}))
+            for col_, (dtype, type_) in casts.items()}
+
+    @staticmethod
+    def code_map(pairs):
+        """Map column of (key, value) pairs"""
+        return create_map(*chain.from_iterable(
+            (lit(key), lit(value)) for key, value in pairs))
+
+    @classmethod
+    def compact(cls, df_, casts: dict):
+        """Cast columns to their compact types, strings to their codes
+
+        :param df_: pyspark dataframe
+        :param casts: column to its cast, see `column_casts`
+        :return: pyspark dataframe, cast columns with their cast in their
+            metadata
+        """
+        if not any(col_ in casts for col_ in df_.columns):
+            return df_
+        exprs = []
+        for col_ in df_.columns:
+            cast = casts.get(col_)
+            if cast is None:
+                exprs.append(col(col_))
+                continue
+            value = col(col_)
+            if cast["type"] == "string":
+                value = cls.code_map(
+                    (value_, code)
+                    for code, value_ in enumerate(cast["codes"]))[value]
+            exprs.append(value.cast(cast["cast"]).alias(
+                col_, metadata={cls.cast_key: cast}))
+        return df_.select(*exprs)
+
+    @classmethod
+    def saved_casts(cls, df_) -> dict:
+        """Casts of the compacted columns of a pyspark dataframe, from
+        their metadata"""
+        return {field.name: field.metadata[cls.cast_key]
+                for field in df_.schema.fields
+                if cls.cast_key in field.metadata}
+
+    @classmethod
+    def uncompact(cls, df_):
+        """Compacted columns back to their types, codes to their values
+
+        :param df_: pyspark dataframe
+        :return: pyspark dataframe
+        """
+        casts = cls.saved_casts(df_)
+        if not casts:
+            return df_
+        exprs = []
+        for col_ in df_.columns:
+            cast = casts.get(col_)
+            if cast is None:
+                exprs.append(col(col_))
+            elif cast["type"] == "string":
+                exprs.append(cls.code_map(enumerate(cast["codes"]))[
+                    col(col_)].alias(col_))
+            else:
+                exprs.append(col(col_).cast(cast["type"]).alias(col_))
+        return df_.select(*exprs)
+
+    def _execute(self) -> str:
+        """Run this job"""
+        df = self.df_from_temp_table(self.kwargs["previous_job_temp_table"])
+        profile = self.profile(df)
+        dtypes = df.dtypes
+        casts = self.plan_casts(dtypes, profile)
+        codes = self.load_codes(
+            sorted(col_ for col_, (dtype, _) in casts.items()
+                   if dtype == "string"),
+            lambda columns: self.string_codes(df, columns))
+        df = self.compact(df, self.column_casts(casts, codes))
+        self.set_metrics(dtypes, df.dtypes, casts, profile)
+
+        df.createOrReplaceTempView(self.temp_table)
+        return self.temp_table
+
+    def profile_local(self, pdf: pd.DataFrame, dtypes: list) -> dict:
+        """`profile` of a pandas dataframe"""
+        profile = {"_rows": len(pdf)}
+        for col_, dtype in dtypes:
+            values = pdf[col_].dropna()
+            if dtype == "string":
+                profile[col_] = {
+                    "distinct": values.nunique(),
+                    "length": values.str.len().mean() if len(values)
+                    else None}
+            elif dtype in self.type_bytes:
+                profile[col_] = {
+                    "min": values.min() if len(values) else None,
+                    "max": values.max() if len(values) else None}
+                if dtype in ("float", "double"):
+                    profile[col_]["fractions"] = int(
+                        (values != values.round()).sum())
+        return profile
+
+    def _execute_local(self) -> str:
+        """Run this job on pandas
+
+        Integer columns become nullable pandas integers, as nulls are
+        kept as on Spark
+        """
+        pdf = self.local_input()
+        dtypes = spark_dtypes(pdf)
+        profile = self.profile_local(pdf, dtypes)
+        casts = self.plan_casts(dtypes, profile)
+        codes = self.load_codes(
+            sorted(col_ for col_, (dtype, _) in casts.items()
+                   if dtype == "string"),
+            lambda columns: self.string_codes_local(pdf, columns))
+
+        pdf = pdf.copy()
+        for col_, (dtype, type_) in casts.items():
+            values = pdf[col_]
+            if dtype == "string":
+                values = values.map({
+                    value: code for code, value in enumerate(codes[col_])})
+            pdf[col_] = values.astype(self.local_types[type_])
+        self.set_metrics(dtypes, spark_dtypes(pdf), casts, profile)
+        return self.local_output(pdf, {
+            col_: {self.cast_key: cast}
+            for col_, cast in self.column_casts(casts, codes).items()})
+
 
 class SetTrainingData(SparkSQL):
     """Get training data
 
-    Use category columns with few dimensions"""
+    Use category columns with few dimensions
+
+    With `feature_store_dir`, the training data is also kept in the
+    feature store, in the `date` partition of `feature_table`
+    (`feature_write_mode`: overwrite or append), once its expectations
+    are met. Indexes are fitted per run, so only the raw category columns
+    are stored: `BenchmarkModel` indexes the date range it reads."""
 
     metrics = {}
     target = "loan_status"
+    # Output persisted for the feature store write
+    persisted = None
 
     @staticmethod
     def index_columns(sdf_, cols: list):
@@ -153,29 +705,85 @@ class SetTrainingData(SparkSQL):
         :param columns: columns of type str in the dataframe
         :return: dict of columns and distinct values
         """
-        data = []
-        for c in columns:
-            cnt = df_.agg(approx_count_distinct(col(c)).alias(c)).collect()
-            data.append(cnt[0][0])
+        if not columns:
+            return {}
+        # One aggregation for all columns, a single row to the driver
+        counts = self.to_pandas(df_.agg(
+            *[approx_count_distinct(col(c)).alias(c) for c in columns]))
+        return self.sort_distinct({c: counts[c][0] for c in columns})
+
+    @staticmethod
+    def sort_distinct(counts: dict) -> dict:
+        """Columns and distinct values, fewest distinct values first"""
+        columns = list(counts)
         df_pd = pd.DataFrame(
             index=columns,
             columns=["num_distinct"],
-            data=data
+            data=[counts[c] for c in columns]
         )
         return df_pd.sort_values(
             "num_distinct", axis=0, ascending=True).to_dict()["num_distinct"]
 
+    @staticmethod
+    def split_columns(unq_grp: dict) -> (list, list):
+        """Columns to cast to float and category columns"""
+        to_double_col = [k for k, v in unq_grp.items() if (int(v) > 1000)]
+
+        # Only use category columns with fewer dimensions
+        category_cols = [k for k, v in unq_grp.items() if (int(v) <= 10)]
+        return to_double_col, category_cols
+
+    @staticmethod
+    def index_columns_local(pdf: pd.DataFrame, cols: list) -> pd.DataFrame:
+        """`index_columns` of a pandas dataframe
+
+        Labels are ordered like `StringIndexer`: most frequent first, ties
+        alphabetically. Rows with nulls in indexed columns are skipped.
+        """
+        indexes = {}
+        for col_ in cols:
+            counts = pdf[col_].dropna().value_counts()
+            labels = pd.DataFrame(
+                {"value": counts.index, "count": counts.values}
+            ).sort_values(["count", "value"], ascending=[False, True])
+            indexes[col_] = {
+                value: float(index)
+                for index, value in enumerate(labels["value"])}
+        if cols:
+            pdf = pdf[pdf[cols].notna().all(axis=1)]
+        pdf = pdf.copy()
+        for col_ in cols:
+            pdf["indexed{}".format(col_)] = \
+                pdf[col_].map(indexes[col_]).astype("float64")
+        return pdf
+
+    def _execute_local(self) -> str:
+        """Run this job on pandas"""
+        pdf = self.local_input()
+        str_col_ = string_columns(pdf)
+        non_str_col = [col_ for col_ in pdf.columns if col_ not in str_col_]
+        unq_grp = self.sort_distinct(
+            {col_: pdf[col_].nunique() for col_ in str_col_})
+        to_double_col, category_cols = self.split_columns(unq_grp)
+
+        pdf_train = pdf[non_str_col + category_cols].copy()
+        for col_ in to_double_col:
+            pdf_train[col_] = pd.to_numeric(
+                pdf[col_], errors="coerce").astype("float32")
+        pdf_train = self.index_columns_local(
+            pdf_train, category_cols).reset_index(drop=True)
+
+        self.metrics["num_records"] = len(pdf_train)
+        self.metrics["num_columns"] = len(pdf_train.columns)
+        return self.local_output(pdf_train)
+
     def _execute(self) -> str:
         """Run this job"""
         df = self.df_from_temp_table(self.kwargs["previous_job_temp_table"])
         str_col_ = [col[0] for col in df.dtypes if col[1] == "string"]
         non_str_col = [col[0] for col in df.dtypes if col[1] != "string"]
         unq_grp = self.group_distinct(df, str_col_)
-
-        to_double_col = [k for k, v in unq_grp.items() if (int(v) > 1000)]
-
-        # Only use category columns with fewer dimensions
-        category_cols = [k for k, v in unq_grp.items() if (int(v) <= 10)]
+        to_double_col, category_cols = self.split_columns(unq_grp)
 
         df_train = df.selectExpr(
             *non_str_col,
@@ -197,8 +805,201 @@ class SetTrainingData(SparkSQL):
         #
         # df_train = df_train.drop(*cols_to_drop)
 
+        if self.feature_store():
+            # Computed once for the count and the store, released once
+            # written in `side_effect`
+            df_train = df_train.persist(StorageLevel.MEMORY_AND_DISK)
+            self.persisted = df_train
         self.metrics["num_records"] = df_train.count()
         self.metrics["num_columns"] = len(df_train.columns)
 
         df_train.createOrReplaceTempView(self.temp_table)
         return self.temp_table
+
+    def side_effect(self):
+        """Checks of the output, then the feature store write"""
+        try:
+            super().side_effect()
+            self.write_features()
+        finally:
+            if self.persisted is not None:
+                self.persisted.unpersist()
+                self.persisted = None
+
+    def write_features(self):
+        """Write the output to the feature store, without the indexes"""
+        store = self.feature_store()
+        if not store:
+            return
+        mode = self.kwargs.get("feature_write_mode", "overwrite")
+        if self.temp_table in LocalCatalog():
+            pdf = LocalCatalog().get(self.temp_table)
+            self.metrics["feature_store"] = store.write_pandas(
+                pdf.drop(columns=self.indexed_columns(pdf.columns)),
+                self.feature_table, self.partition_date, mode)
+            return
+        df = self.df_from_temp_table(self.temp_table)
+        self.metrics["feature_store"] = store.write_spark(
+            df.drop(*self.indexed_columns(df.columns)), self.feature_table,
+            self.partition_date, self.metrics["num_records"], mode)
+
+    @staticmethod
+    def indexed_columns(columns: list) -> list:
+        """Columns added by `index_columns`"""
+        return [col_ for col_ in columns if col_.startswith("indexed")]
+
+
+class QuantileBinning(SparkSQL):
+    """Bin continuous features into quantile buckets
+
+    Float and double columns (or `binning_columns`) are replaced by the
+    index of their bucket, 0 to `num_buckets` - 1. Nulls and NaN go to one
+    more bucket. With few buckets `VectorIndexer` treats the features as
+    categorical, and the forest no longer searches splits over raw values.
+
+    The quantiles of all columns come from one `approxQuantile` call and
+    one `Bucketizer` bins them together. Splits are kept in `splits_path`
+    (JSON) when given and reused by later runs, pass `refit=True` to
+    compute them again. The splits of each binned column are also in its
+    metadata, so `BenchmarkModel` saves them with the model for
+    `ScoreLoans`.
+    """
+
+    metrics = {}
+    target = "loan_status"
+    continuous_types = ("float", "double")
+    # Column metadata key of the inner splits of a binned column
+    splits_key = "quantile_splits"
+
+    def binning_columns(self, dtypes: list) -> list:
+        """Continuous columns to bin"""
+        if self.kwargs.get("binning_columns"):
+            return list(self.kwargs["binning_columns"])
+        return [col_ for col_, dtype in dtypes
+                if dtype in self.continuous_types and col_ != self.target and
+                not col_.startswith("indexed")]
+
+    @property
+    def probabilities(self) -> list:
+        """Quantiles at the bucket boundaries"""
+        num_buckets = int(self.kwargs.get("num_buckets", 10))
+        return [index / float(num_buckets)
+                for index in range(1, num_buckets)]
+
+    @staticmethod
+    def splits(quantiles: list) -> list:
+        """Bucketizer splits of quantiles, open ended"""
+        return [-float("inf")] + sorted(set(quantiles)) + [float("inf")]
+
+    def fit_splits(self, df_, columns: list) -> dict:
+        """Inner splits of columns, one pass over the data
+
+        Columns without values get no splits
+        """
+        quantiles = df_.approxQuantile(
+            columns, self.probabilities,
+            float(self.kwargs.get("relative_error", 0.001)))
+        return {col_: sorted(set(values))
+                for col_, values in zip(columns, quantiles)}
+
+    def fit_splits_local(self, pdf: pd.DataFrame, columns: list) -> dict:
+        """`fit_splits` on pandas, exact quantiles taken from the values"""
+        splits = {}
+        for col_ in columns:
+            values = pdf[col_].dropna().astype("float64").to_numpy()
+            values = values[~np.isnan(values)]
+            splits[col_] = sorted(set(np.quantile(
+                values, self.probabilities, method="inverted_cdf").tolist()
+            )) if len(values) else []
+        return splits
+
+    @classmethod
+    def bucketize(cls, df_, splits: dict):
+        """Replace columns by their bucket index
+
+        Nulls are made NaN first: `Bucketizer` keeps nulls as nulls and
+        only puts NaN in the extra bucket
+
+        :param df_: pyspark dataframe
+        :param splits: column to inner splits, columns with no splits are
+            left as they are
+        :return: pyspark dataframe, binned columns with their splits in
+            their metadata
+        """
+        names = df_.columns
+        columns = [col_ for col_ in names if splits.get(col_)]
+        if not columns:
+            return df_
+        df_ = df_.select(*[
+            when(col(col_).isNull(), lit(float("nan")))
+            .otherwise(col(col_)).alias(col_)
+            if col_ in columns else col(col_) for col_ in names])
+        bucketizer = Bucketizer(
+            splitsArray=[cls.splits(splits[col_]) for col_ in columns],
+            inputCols=columns,
+            outputCols=["{}_bucket".format(col_) for col_ in columns],
+            handleInvalid="keep")
+        binned = bucketizer.transform(df_)
+        return binned.select(*[
+            col("{}_bucket".format(col_)).alias(col_, metadata=dict(
+                binned.schema["{}_bucket".format(col_)].metadata,
+                **{cls.splits_key: splits[col_]}))
+            if col_ in columns else col(col_) for col_ in names])
+
+    @classmethod
+    def column_splits(cls, df_) -> dict:
+        """Inner splits of the binned columns of a pyspark dataframe, from
+        their metadata"""
+        return {field.name: field.metadata[cls.splits_key]
+                for field in df_.schema.fields
+                if cls.splits_key in field.metadata}
+
+    @classmethod
+    def bucketize_local(cls, pdf: pd.DataFrame,
+                        splits: dict) -> pd.DataFrame:
+        """`bucketize` on pandas"""
+        pdf = pdf.copy()
+        for col_, inner in splits.items():
+            if not inner or col_ not in pdf.columns:
+                continue
+            bounds = cls.splits(inner)
+            values = pdf[col_].astype("float64").to_numpy(na_value=np.nan)
+            # The last bucket includes its upper bound
+            buckets = np.minimum(np.searchsorted(
+                bounds, values, side="right") - 1, len(bounds) - 2
+            ).astype("float64")
+            # Nulls and NaN to the extra bucket, like handleInvalid="keep"
+            buckets[np.isnan(values)] = len(bounds) - 1
+            pdf[col_] = buckets
+        return pdf
+
+    def set_metrics(self, splits: dict, num_columns: int):
+        """Binned columns and their number of buckets"""
+        self.metrics["num_columns"] = num_columns
+        self.metrics["binned_columns"] = {
+            col_: len(inner) + 1 for col_, inner in splits.items() if inner}
+
+    def _execute(self) -> str:
+        """Run this job"""
+        df = self.df_from_temp_table(self.kwargs["previous_job_temp_table"])
+        splits = self.load_fitted(
+            "splits_path", self.binning_columns(df.dtypes),
+            lambda columns: self.fit_splits(df, columns),
+            bool(self.kwargs.get("refit")))
+        df = self.bucketize(df, splits)
+        self.set_metrics(splits, len(df.columns))
+        df.createOrReplaceTempView(self.temp_table)
+        return self.temp_table
+
+    def _execute_local(self) -> str:
+        """Run this job on pandas"""
+        pdf = self.local_input()
+        splits = self.load_fitted(
+            "splits_path", self.binning_columns(spark_dtypes(pdf)),
+            lambda columns: self.fit_splits_local(pdf, columns),
+            bool(self.kwargs.get("refit")))
+        pdf = self.bucketize_local(pdf, splits)
+        self.set_metrics(splits, len(pdf.columns))
+        return self.local_output(pdf, {
+            col_: {self.splits_key: inner} for col_, inner in splits.items()
+            if inner and col_ in pdf.columns})
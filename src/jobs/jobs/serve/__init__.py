@@ -0,0 +1,9 @@
+"""Serving jobs, such as:
+- batch scoring
+- exporting models for Spark-free scoring
+"""
+
+from .job import ScoreLoans
+from .job import ExportEnsemble
+
+__all__ = ["ScoreLoans", "ExportEnsemble"]
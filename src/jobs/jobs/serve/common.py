@@ -0,0 +1,55 @@
+"""Abstract classes for serving saved models"""
+from abc import abstractmethod
+import json
+import os
+
+from pyspark.ml import PipelineModel
+from jobs.jobs.common import SparkSQL
+from jobs.jobs.train import BenchmarkModel
+from jobs.jobs.train.store import ModelStore
+
+
+class StoredModel(SparkSQL):
+    """Use a saved model
+
+    The model is taken from `model_store_dir` (latest version of
+    `model_name` unless `model_version` is given) or from `model_path`.
+    """
+    abstract = True
+
+    def load_model(self) -> (PipelineModel, dict):
+        """Load the pipeline model
+
+        :return: (pipeline model, version metadata: `features`,
+            `preprocessing`...). A `model_path` of the store has the
+            metadata next to it, other paths have none
+        """
+        if self.kwargs.get("model_path"):
+            model_path = self.kwargs["model_path"].rstrip("/")
+            meta_path = os.path.join(
+                os.path.dirname(model_path), ModelStore.meta_file)
+            meta = {}
+            if os.path.isfile(meta_path):
+                with open(meta_path) as f_meta:
+                    meta = json.load(f_meta)
+            return PipelineModel.load(model_path), meta
+
+        store = ModelStore(self.kwargs["model_store_dir"])
+        name = self.kwargs.get("model_name", BenchmarkModel.__name__)
+        version = self.kwargs.get("model_version")
+        if version is None:
+            meta = store.latest(name)
+        else:
+            meta = next((meta for meta in store.versions(name)
+                         if meta["version"] == int(version)), None)
+        if meta is None:
+            raise ValueError("No {} of model {} in {}".format(
+                "version" if version is None else "version %s" % version,
+                name, self.kwargs["model_store_dir"]))
+        self.metrics["model_version"] = meta["version"]
+        return store.load(meta), meta
+
+    @abstractmethod
+    def _execute(self) -> str:
+        """Run this job"""
+        raise NotImplementedError
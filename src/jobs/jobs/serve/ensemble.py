@@ -0,0 +1,293 @@
+"""Spark-free scoring of exported random forest pipelines
+
+`export_pipeline` turns a fitted `BenchmarkModel` pipeline into a
+`TreeEnsemble`: flat NumPy arrays holding the nodes of every tree, the
+`VectorIndexer` category maps, feature string indexes and output labels.
+`TreeEnsemble` scores micro-batches without a JVM, walking all trees for
+all records at once, one tree level per step.
+"""
+import json
+
+import numpy as np
+
+
+__all__ = ["TreeEnsemble", "export_pipeline"]
+
+
+class TreeEnsemble:
+    """Array backed random forest classifier
+
+    Node arrays, indexed by node id, across all trees:
+
+    - `feature`: split feature, -1 for leaves
+    - `threshold`: go left when value <= threshold (continuous splits)
+    - `category_mask`: bit c set when category c goes left
+      (categorical splits)
+    - `left`, `right`: child node ids
+    - `value`: class probabilities of leaves
+    """
+    # pylint:disable=too-many-instance-attributes
+
+    def __init__(self, arrays: dict, feature_cols: list, labels: list,
+                 category_maps: dict = None, string_maps: dict = None):
+        """
+        :param arrays: node arrays and `roots`, the root node of each tree
+        :param feature_cols: feature columns in vector order
+        :param labels: class labels in class index order
+        :param category_maps: feature index to {raw value: category}
+        :param string_maps: feature column to (raw column, {label: index})
+        """
+        self.feature = np.asarray(arrays["feature"], dtype=np.int32)
+        self.threshold = np.asarray(arrays["threshold"], dtype=np.float64)
+        self.categorical = np.asarray(arrays["categorical"], dtype=bool)
+        self.category_mask = np.asarray(
+            arrays["category_mask"], dtype=np.uint64)
+        self.left = np.asarray(arrays["left"], dtype=np.int32)
+        self.right = np.asarray(arrays["right"], dtype=np.int32)
+        self.value = np.asarray(arrays["value"], dtype=np.float64)
+        self.roots = np.asarray(arrays["roots"], dtype=np.int32)
+        self.max_depth = int(arrays["max_depth"])
+        self.feature_cols = list(feature_cols)
+        self.labels = list(labels)
+        self.string_maps = string_maps or {}
+        self.category_maps = {}
+        for index, mapping in (category_maps or {}).items():
+            raw = np.array(sorted(mapping), dtype=np.float64)
+            codes = np.array([mapping[val] for val in sorted(mapping)],
+                             dtype=np.float64)
+            self.category_maps[int(index)] = (raw, codes)
+
+    @classmethod
+    def from_trees(cls, trees: list, feature_cols: list, labels: list,
+                   category_maps: dict = None, string_maps: dict = None):
+        """Build from nested tree dicts
+
+        Internal nodes: `feature`, `left`, `right` and either `threshold`
+        or `left_categories`. Leaves: `stats`, class counts.
+
+        :param trees: root node of each tree
+        :return: TreeEnsemble
+        """
+        arrays = {key: [] for key in (
+            "feature", "threshold", "categorical", "category_mask",
+            "left", "right", "value")}
+        arrays["roots"] = []
+        arrays["max_depth"] = 0
+        num_classes = len(labels)
+
+        def add(node, depth):
+            node_id = len(arrays["feature"])
+            arrays["max_depth"] = max(arrays["max_depth"], depth)
+            for key in arrays:
+                if key not in ("roots", "max_depth"):
+                    arrays[key].append(None)
+            if "stats" in node:
+                stats = np.zeros(num_classes)
+                stats[:len(node["stats"])] = node["stats"]
+                total = stats.sum()
+                arrays["feature"][node_id] = -1
+                arrays["threshold"][node_id] = 0.0
+                arrays["categorical"][node_id] = False
+                arrays["category_mask"][node_id] = 0
+                arrays["left"][node_id] = node_id
+                arrays["right"][node_id] = node_id
+                arrays["value"][node_id] = stats / total if total else stats
+                return node_id
+
+            mask = 0
+            for category in node.get("left_categories", []):
+                mask |= 1 << int(category)
+            arrays["feature"][node_id] = int(node["feature"])
+            arrays["threshold"][node_id] = float(node.get("threshold", 0.0))
+            arrays["categorical"][node_id] = "left_categories" in node
+            arrays["category_mask"][node_id] = mask
+            arrays["value"][node_id] = np.zeros(num_classes)
+            arrays["left"][node_id] = add(node["left"], depth + 1)
+            arrays["right"][node_id] = add(node["right"], depth + 1)
+            return node_id
+
+        for tree in trees:
+            arrays["roots"].append(add(tree, 0))
+        return cls(arrays, feature_cols, labels, category_maps, string_maps)
+
+    def to_matrix(self, records: list) -> np.ndarray:
+        """Feature matrix of records (dicts of column to value)
+
+        Raw strings are indexed with the exported string indexes, unknown
+        or missing values become NaN.
+        """
+        matrix = np.full((len(records), len(self.feature_cols)), np.nan)
+        for row, record in enumerate(records):
+            for index, col_ in enumerate(self.feature_cols):
+                if col_ in record:
+                    value = record[col_]
+                elif col_ in self.string_maps:
+                    raw_col, mapping = self.string_maps[col_]
+                    value = mapping.get(record.get(raw_col))
+                else:
+                    value = None
+                if value is not None:
+                    matrix[row, index] = value
+        return matrix
+
+    def _index_categories(self, matrix: np.ndarray) -> (np.ndarray, list):
+        """Map categorical features to their category index
+
+        :return: (indexed matrix, mask of records that can be scored)
+        """
+        matrix = np.array(matrix, dtype=np.float64, ndmin=2)
+        valid = ~np.isnan(matrix).any(axis=1)
+        for index, (raw, codes) in self.category_maps.items():
+            values = matrix[:, index]
+            pos = np.clip(np.searchsorted(raw, values), 0, len(raw) - 1)
+            known = raw[pos] == values
+            valid &= known
+            matrix[:, index] = np.where(known, codes[pos], 0.0)
+        matrix[~valid] = 0.0
+        return matrix, valid
+
+    def predict_proba(self, matrix) -> np.ndarray:
+        """Class probabilities, NaN for records Spark would skip
+
+        :param matrix: features, one record per row
+        :return: array of shape (records, classes)
+        """
+        matrix, valid = self._index_categories(matrix)
+        num_records = matrix.shape[0]
+        nodes = np.repeat(self.roots[:, None], num_records, axis=1)
+        records = np.broadcast_to(np.arange(num_records), nodes.shape)
+        for _ in range(self.max_depth):
+            feature = self.feature[nodes]
+            internal = feature >= 0
+            if not internal.any():
+                break
+            values = matrix[records, np.where(internal, feature, 0)]
+            categorical = self.categorical[nodes]
+            codes = np.where(categorical, values, 0.0).astype(np.uint64)
+            go_left = np.where(
+                categorical,
+                ((self.category_mask[nodes] >> codes) & np.uint64(1)) == 1,
+                values <= self.threshold[nodes])
+            nodes = np.where(
+                go_left, self.left[nodes], self.right[nodes])
+
+        votes = self.value[nodes].sum(axis=0)
+        totals = votes.sum(axis=1, keepdims=True)
+        proba = np.divide(votes, totals, out=np.zeros_like(votes),
+                          where=totals != 0)
+        proba[~valid] = np.nan
+        return proba
+
+    def predict(self, matrix) -> np.ndarray:
+        """Class index of each record, -1 for records Spark would skip"""
+        proba = self.predict_proba(matrix)
+        valid = ~np.isnan(proba).any(axis=1)
+        return np.where(valid, np.argmax(np.nan_to_num(proba), axis=1), -1)
+
+    def predict_labels(self, records: list) -> list:
+        """Predicted label of each record (dicts of column to value)"""
+        return [self.labels[index] if index >= 0 else None
+                for index in self.predict(self.to_matrix(records))]
+
+    def save(self, path: str):
+        """Save to a compressed `.npz` file"""
+        meta = {
+            "feature_cols": self.feature_cols,
+            "labels": self.labels,
+            "max_depth": self.max_depth,
+            "category_maps": {
+                str(index): [raw.tolist(), codes.tolist()]
+                for index, (raw, codes) in self.category_maps.items()},
+            "string_maps": self.string_maps
+        }
+        np.savez_compressed(
+            path, feature=self.feature, threshold=self.threshold,
+            categorical=self.categorical, category_mask=self.category_mask,
+            left=self.left, right=self.right, value=self.value,
+            roots=self.roots, meta=np.array(json.dumps(meta)))
+
+    @classmethod
+    def load(cls, path: str):
+        """Load from a `.npz` file"""
+        with np.load(path) as data:
+            arrays = {key: data[key] for key in data.files if key != "meta"}
+            meta = json.loads(str(data["meta"]))
+        arrays["max_depth"] = meta["max_depth"]
+        category_maps = {
+            int(index): dict(zip(raw, codes))
+            for index, (raw, codes) in meta["category_maps"].items()}
+        string_maps = {
+            col_: (raw_col, mapping)
+            for col_, (raw_col, mapping) in meta["string_maps"].items()}
+        return cls(arrays, meta["feature_cols"], meta["labels"],
+                   category_maps, string_maps)
+
+
+def _java_node(node) -> dict:
+    """Nested dict of a Spark tree node (py4j object)"""
+    if node.getClass().getSimpleName() == "LeafNode":
+        return {"stats": list(node.impurityStats().stats())}
+    split = node.split()
+    tree_node = {
+        "feature": split.featureIndex(),
+        "left": _java_node(node.leftChild()),
+        "right": _java_node(node.rightChild())
+    }
+    if split.getClass().getSimpleName() == "CategoricalSplit":
+        tree_node["left_categories"] = list(split.leftCategories())
+    else:
+        tree_node["threshold"] = split.threshold()
+    return tree_node
+
+
+def string_maps(feature_cols: list, feature_labels: dict) -> dict:
+    """String indexes of the features, from the labels of the feature
+    indexers saved with the model
+
+    :param feature_cols: feature columns the model was fitted with
+    :param feature_labels: raw column to labels, see
+        `BenchmarkModel.fit_indexers`
+    :return: feature column to (raw column, {label: index})
+    """
+    maps = {}
+    for raw_col, labels in (feature_labels or {}).items():
+        col_ = "indexed{}".format(raw_col)
+        if col_ in feature_cols:
+            maps[col_] = (raw_col, {label: float(index)
+                                    for index, label in enumerate(labels)})
+    return maps
+
+
+def export_pipeline(model, feature_cols: list,
+                    feature_labels: dict = None) -> TreeEnsemble:
+    """Export a fitted benchmark pipeline
+
+    The feature string indexers are fitted outside the pipeline, their
+    labels are saved with the model (`preprocessing.feature_labels`)
+
+    :param model: PipelineModel with a label indexer, a vector indexer,
+        a random forest and an IndexToString stage
+    :param feature_cols: feature columns the model was fitted with
+    :param feature_labels: raw column to labels of the feature indexers
+    :return: TreeEnsemble
+    """
+    # pylint:disable=protected-access
+    from pyspark.ml.classification import RandomForestClassificationModel
+    from pyspark.ml.feature import (
+        IndexToString, StringIndexerModel, VectorIndexerModel)
+
+    trees, labels, category_maps = [], [], {}
+    for stage in model.stages:
+        if isinstance(stage, StringIndexerModel):
+            if not labels:
+                labels = list(stage.labels)
+        elif isinstance(stage, VectorIndexerModel):
+            category_maps = stage.categoryMaps
+        elif isinstance(stage, RandomForestClassificationModel):
+            trees = [_java_node(tree._java_obj.rootNode())
+                     for tree in stage.trees]
+        elif isinstance(stage, IndexToString):
+            labels = list(stage.getLabels())
+    return TreeEnsemble.from_trees(
+        trees, feature_cols, labels, category_maps,
+        string_maps(feature_cols, feature_labels))
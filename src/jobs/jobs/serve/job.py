@@ -0,0 +1,211 @@
+"""Serving jobs"""
+import json
+from time import time
+
+from pyspark.ml import PipelineModel
+from pyspark.ml.feature import StringIndexerModel
+from pyspark.sql.functions import lit
+from pyspark.storagelevel import StorageLevel
+from jobs.config.secret import Secret
+from jobs.jobs.acquire.common import CSVRecord
+from jobs.jobs.process import CompactSchema, QuantileBinning
+from jobs.jobs.serve.common import StoredModel
+from jobs.jobs.serve.ensemble import export_pipeline
+from jobs.jobs.train import BenchmarkModel
+
+__all__ = ["ScoreLoans", "ExportEnsemble"]
+
+
+class ScoreLoans(StoredModel, CSVRecord):
+    """Batch scoring with a saved benchmark model
+
+    Loans are read from `previous_job_temp_table` or from `filename`, and
+    should carry the features prepared by `SetTrainingData`. Features are
+    cast with the `CompactSchema` casts saved with the model, continuous
+    ones binned with the `QuantileBinning` splits saved with it, and
+    string features indexed with the labels saved with it, never refitted
+    on the batch.
+
+    Predictions go to partitioned Parquet with `output_path`, to a DB
+    table with `output_table`, or to this job's temp table otherwise.
+    """
+
+    metrics = {}
+    prediction_cols = ["prediction", "predictedLabel"]
+
+    @staticmethod
+    def get_target_details() -> dict:
+        """Get target DB JDBC connection details"""
+        secret = Secret()
+        return {
+            "url": secret["TARGET_JDBC_URL"],
+            "user": secret["TARGET_JDBC_USER"],
+            "password": secret["TARGET_JDBC_PASSWORD"]
+        }
+
+    @staticmethod
+    def scoring_model(model: PipelineModel, df_) -> PipelineModel:
+        """Leave out label indexers when the label is not in the input
+
+        :param model: fitted pipeline model
+        :param df_: pyspark df to score
+        :return: pipeline model
+        """
+        return PipelineModel([
+            stage for stage in model.stages
+            if not (isinstance(stage, StringIndexerModel) and
+                    stage.getInputCol() not in df_.columns)])
+
+    @staticmethod
+    def preprocessing(meta: dict) -> (list, dict):
+        """Feature columns and labels of the feature indexers of a model
+
+        :param meta: version metadata, see `StoredModel.load_model`
+        :return: (feature columns, column to labels)
+        """
+        feature_cols = meta.get("features")
+        feature_labels = meta.get("preprocessing", {}).get("feature_labels")
+        if feature_cols is None or feature_labels is None:
+            raise ValueError(
+                "The model has no saved features or indexer labels, save "
+                "it with BenchmarkModel and a model_store_dir")
+        labels = [col_ for col_ in feature_cols
+                  if col_ in BenchmarkModel.label_columns()]
+        if labels:
+            raise ValueError(
+                "The model was fitted with the label %s as a feature, fit "
+                "it again" % labels)
+        return feature_cols, feature_labels
+
+    @staticmethod
+    def binning_splits(meta: dict) -> dict:
+        """Inner splits of the features binned for a model
+
+        :param meta: version metadata, see `StoredModel.load_model`
+        :return: column to inner splits
+        """
+        return meta.get("preprocessing", {}).get("splits") or {}
+
+    @staticmethod
+    def compact_casts(meta: dict) -> dict:
+        """`CompactSchema` casts of the features of a model
+
+        :param meta: version metadata, see `StoredModel.load_model`
+        :return: column to its cast
+        """
+        return meta.get("preprocessing", {}).get("casts") or {}
+
+    def load_source(self, splits: dict, casts: dict = None):
+        """Loans to score, cast and binned like the training data
+
+        Columns compacted upstream are restored first, as their codes were
+        fitted on this batch, then cast like the training data. Columns
+        binned upstream, with splits in their metadata, are left as they
+        are. Models saved without splits bin with the `QuantileBinning`
+        `splits_path` when `bin_features=True`.
+
+        :param splits: column to inner splits, see `binning_splits`
+        :param casts: column to its cast, see `compact_casts`
+        """
+        if self.kwargs.get("previous_job_temp_table"):
+            df = self.df_from_temp_table(
+                self.kwargs["previous_job_temp_table"])
+        else:
+            df = self.load_file()
+        if not splits and self.kwargs.get("bin_features"):
+            with open(self.kwargs["splits_path"]) as f_splits:
+                splits = json.load(f_splits)
+        df = CompactSchema.compact(CompactSchema.uncompact(df), casts or {})
+        binned = QuantileBinning.column_splits(df)
+        return QuantileBinning.bucketize(df, {
+            col_: inner for col_, inner in splits.items()
+            if col_ not in binned})
+
+    def write_predictions(self, df_):
+        """Write predictions to Parquet, a DB table or a temp table
+
+        :param df_: pyspark df with predictions
+        :return: Where the predictions are
+        """
+        mode = self.kwargs.get("write_mode", "append")
+        if self.kwargs.get("output_path"):
+            partition_by = self.kwargs.get("partition_by", ["date"])
+            df_.write.mode(mode) \
+                .partitionBy(*[col_ for col_ in partition_by
+                               if col_ in df_.columns]) \
+                .parquet(self.kwargs["output_path"])
+            return self.kwargs["output_path"]
+
+        if self.kwargs.get("output_table"):
+            details = self.get_target_details()
+            df_.write.jdbc(
+                details["url"],
+                self.kwargs["output_table"],
+                mode=mode,
+                properties={
+                    "user": details["user"],
+                    "password": details["password"]})
+            return self.kwargs["output_table"]
+
+        df_.createOrReplaceTempView(self.temp_table)
+        return self.temp_table
+
+    def _execute(self) -> str:
+        """Run this job"""
+        model, meta = self.load_model()
+        feature_cols, feature_labels = self.preprocessing(meta)
+        df = self.load_source(
+            self.binning_splits(meta), self.compact_casts(meta))
+        input_cols = [col_ for col_ in df.columns
+                      if col_ not in self.prediction_cols]
+
+        start_time = float(time())
+        df, feature_cols, _ = BenchmarkModel.assemble_features(
+            df, feature_cols, feature_labels)
+        predictions = self.scoring_model(model, df).transform(df) \
+            .select(*input_cols, *self.prediction_cols)
+        if self.kwargs.get("date"):
+            predictions = predictions.withColumn(
+                "date", lit(self.kwargs["date"]))
+
+        # Score once, then write from the cached predictions. A view is
+        # only scored by the jobs reading it, it is left uncached
+        to_view = not (self.kwargs.get("output_path") or
+                       self.kwargs.get("output_table"))
+        if not to_view:
+            predictions = predictions.persist(StorageLevel.MEMORY_AND_DISK)
+        try:
+            num_records = predictions.count()
+            output = self.write_predictions(predictions)
+        finally:
+            if not to_view:
+                predictions.unpersist()
+        elapsed = time() - start_time
+
+        self.metrics["num_records"] = num_records
+        self.metrics["num_features"] = len(feature_cols)
+        self.metrics["rows_per_second"] = \
+            num_records / elapsed if elapsed else 0.0
+        return output
+
+
+class ExportEnsemble(StoredModel):
+    """Export a saved benchmark model for Spark-free scoring
+
+    Writes a `TreeEnsemble` to `output_path` (`.npz`)
+    """
+
+    metrics = {}
+
+    def _execute(self) -> str:
+        """Run this job"""
+        model, meta = self.load_model()
+        feature_cols = meta.get("features") or self.kwargs["feature_cols"]
+        ensemble = export_pipeline(
+            model, feature_cols,
+            meta.get("preprocessing", {}).get("feature_labels"))
+        ensemble.save(self.kwargs["output_path"])
+        self.metrics["num_trees"] = len(ensemble.roots)
+        self.metrics["num_nodes"] = len(ensemble.feature)
+        self.metrics["max_depth"] = ensemble.max_depth
+        return self.kwargs["output_path"]
@@ -0,0 +1,7 @@
+"""Streaming jobs, such as:
+- acquiring and cleaning files as they land
+"""
+
+from .job import StreamLoans
+
+__all__ = ["StreamLoans"]
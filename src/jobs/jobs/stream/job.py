@@ -0,0 +1,204 @@
+"""Streaming jobs"""
+import inspect
+import json
+import os
+
+from pyspark.sql.functions import current_timestamp
+from pyspark.sql.streaming import DataStreamWriter
+from pyspark.sql.types import StructType
+from jobs.core.local import local_paths
+from jobs.jobs.acquire.common import CSVRecord
+from jobs.jobs.process import (
+    DropNullAndDuplicateRow, DropNullColumns, GetTrainingData)
+
+__all__ = ["StreamLoans"]
+
+
+class StreamLoans(CSVRecord):
+    """Acquire and clean loan files as they land
+
+    A Structured Streaming query over the `filename` landing directory
+    running the logic of `LoadCSV`, `GetTrainingData`, `DropNullColumns`
+    and `DropNullAndDuplicateRow` on each micro-batch. Cleaned loans are
+    appended to Parquet at `output_path`, progress is kept in
+    `checkpoint_dir`.
+
+    Duplicates on `dedup_keys` (all columns by default) are dropped
+    within `watermark_delay` of `event_time_col`, the ingestion time when
+    not given. Null columns can't be found one micro-batch at a time, so
+    they are worked out with the schema from the files landed before the
+    first start, and pinned in the checkpoint for every restart. When
+    nothing has landed yet, the files' `schema` must be declared (a Spark
+    schema as JSON) and no column is dropped.
+
+    Without `trigger_interval` the files landed so far are processed and
+    the job ends; otherwise micro-batches run every interval, for
+    `await_timeout` seconds or until the query is stopped.
+    """
+
+    metrics = {}
+    state_file = "pinned.json"
+    ingest_col = "_ingested_at"
+
+    @property
+    def state_path(self) -> str:
+        """Pinned schema and null columns, next to Spark's checkpoint"""
+        return os.path.join(self.kwargs["checkpoint_dir"], self.state_file)
+
+    @property
+    def na_threshold(self) -> float:
+        """Share of null values dropping a column or row"""
+        return float(self.kwargs.get("na_threshold", "0.7"))
+
+    def load_state(self) -> dict:
+        """Pinned state of the stream or None before the first start"""
+        if not os.path.isfile(self.state_path):
+            return None
+        with open(self.state_path) as f_state:
+            return json.load(f_state)
+
+    def save_state(self, state: dict):
+        """Pin the state of the stream"""
+        os.makedirs(self.kwargs["checkpoint_dir"], exist_ok=True)
+        with open(self.state_path, "w") as f_state:
+            json.dump(state, f_state, sort_keys=True)
+
+    def declared_schema(self) -> StructType:
+        """Schema of the landing files from the `schema` kwarg, if any"""
+        schema = self.kwargs.get("schema")
+        if not schema:
+            return None
+        if isinstance(schema, str):
+            schema = json.loads(schema)
+        return StructType.fromJson(schema)
+
+    def bootstrap_state(self) -> dict:
+        """Schema and null columns of the files landed so far
+
+        Null columns are found after dropping null rows, as in batch
+        """
+        schema = self.declared_schema()
+        filename = self.kwargs["filename"]
+        # Only local paths can be listed up front, `[]` is nothing landed
+        if schema is None and local_paths(filename) == []:
+            raise ValueError(
+                "Nothing landed in %s to infer the schema from, declare "
+                "it with the `schema` kwarg" % filename)
+        df = self.read_file(self.get_sql_context().read, schema)
+        if not df.columns:
+            raise ValueError(
+                "No schema for %s, declare it with the `schema` kwarg"
+                % filename)
+        schema = df.schema.jsonValue()
+        df = DropNullAndDuplicateRow.drop_null_rows(
+            GetTrainingData.transform(df), self.na_threshold)
+        num_rows = df.count()
+        null_columns = DropNullColumns(
+            self.spark_context, **self.kwargs
+        ).null_columns(df, num_rows, self.na_threshold) if num_rows else []
+        return {"schema": schema, "null_columns": null_columns}
+
+    def pinned_state(self) -> dict:
+        """State of the stream, bootstrapped on the first start"""
+        state = self.load_state()
+        if state is None:
+            state = self.bootstrap_state()
+            self.save_state(state)
+        return state
+
+    def drop_duplicates(self, df_):
+        """Drop duplicates within the watermark
+
+        `dropDuplicatesWithinWatermark` (Spark 3.5+) matches on the keys
+        only. Before that, rows must share their event time as well, so
+        with the ingestion time duplicates are dropped within a
+        micro-batch.
+
+        :param df_: streaming pyspark dataframe
+        :return: streaming pyspark dataframe
+        """
+        event_col = self.kwargs.get("event_time_col")
+        if not event_col:
+            event_col = self.ingest_col
+            df_ = df_.withColumn(event_col, current_timestamp())
+        keys = DropNullAndDuplicateRow(
+            self.spark_context, **self.kwargs).dedup_keys()
+        keys = keys or [col_ for col_ in df_.columns if col_ != event_col]
+
+        df_ = df_.withWatermark(
+            event_col, self.kwargs.get("watermark_delay", "1 hour"))
+        if hasattr(df_, "dropDuplicatesWithinWatermark"):
+            return df_.dropDuplicatesWithinWatermark(keys)
+        return df_.dropDuplicates(keys + [event_col])
+
+    def transform(self, df_, null_columns: list):
+        """Clean a streaming dataframe with the batch jobs' logic, in the
+        batch order: null and duplicate rows, then null columns
+
+        :param df_: streaming pyspark dataframe of raw loans
+        :param null_columns: pinned columns to drop
+        :return: streaming pyspark dataframe
+        """
+        df = GetTrainingData.transform(df_)
+        df = DropNullAndDuplicateRow.drop_null_rows(df, self.na_threshold)
+        # The ingestion time is only there for the watermark
+        return self.drop_duplicates(df).drop(self.ingest_col, *null_columns)
+
+    def trigger(self) -> dict:
+        """Trigger of the query, `trigger_interval` or available files"""
+        if self.kwargs.get("trigger_interval"):
+            return {"processingTime": self.kwargs["trigger_interval"]}
+        if "availableNow" in inspect.signature(
+                DataStreamWriter.trigger).parameters:
+            return {"availableNow": True}
+        return {"once": True}
+
+    def read_stream(self, schema: StructType):
+        """Streaming dataframe of the landing directory"""
+        reader = self.get_sql_context().readStream
+        if self.kwargs.get("max_files_per_trigger"):
+            reader = reader.option("maxFilesPerTrigger", int(
+                self.kwargs["max_files_per_trigger"]))
+        return self.read_file(reader, schema)
+
+    def progress_metrics(self, query):
+        """Rows, micro-batches and dedup state of a query"""
+        progress = query.recentProgress
+        self.metrics["num_batches"] = len(progress)
+        self.metrics["num_input_rows"] = sum(
+            batch["numInputRows"] for batch in progress)
+        state = progress[-1].get("stateOperators") if progress else None
+        self.metrics["num_state_rows"] = \
+            state[0]["numRowsTotal"] if state else 0
+
+    def _execute(self) -> str:
+        """Run this job"""
+        state = self.pinned_state()
+        df = self.transform(
+            self.read_stream(StructType.fromJson(state["schema"])),
+            state["null_columns"])
+
+        query = df.writeStream \
+            .format("parquet") \
+            .outputMode("append") \
+            .queryName(self.temp_table) \
+            .option("path", self.kwargs["output_path"]) \
+            .option("checkpointLocation", self.kwargs["checkpoint_dir"]) \
+            .trigger(**self.trigger()) \
+            .start()
+        try:
+            if self.kwargs.get("await_timeout") is None:
+                query.awaitTermination()
+            else:
+                query.awaitTermination(int(self.kwargs["await_timeout"]))
+        finally:
+            query.stop()
+        self.progress_metrics(query)
+
+        # Batch view of all cleaned loans for the next jobs
+        df = self.get_sql_context().read.parquet(self.kwargs["output_path"])
+        self.metrics["num_records"] = df.count()
+        self.metrics["num_columns"] = len(df.columns)
+        self.metrics["columns_dropped"] = len(state["null_columns"])
+        df.createOrReplaceTempView(self.temp_table)
+        return self.temp_table
@@ -1,35 +1,120 @@
 """Create a benchmark Model"""
+from contextlib import contextmanager
+from threading import Lock
+from time import time
+
 from pyspark.ml import Pipeline
 from pyspark.ml.classification import RandomForestClassifier
-from pyspark.ml.feature import IndexToString, StringIndexer, VectorIndexer, VectorAssembler
+from pyspark.ml.feature import (
+    IndexToString, StringIndexer, StringIndexerModel, VectorIndexer,
+    VectorAssembler)
 from pyspark.ml.evaluation import MulticlassClassificationEvaluator
+from pyspark.ml.tuning import (
+    CrossValidator, ParamGridBuilder, TrainValidationSplit)
+from pyspark.storagelevel import StorageLevel
+from jobs.config.file import THIS_DIR, FromJson
 from jobs.jobs.common import SparkSQL
+from jobs.jobs.process import CompactSchema, QuantileBinning
+from jobs.jobs.train.store import ModelStore
 
 
 __all__ = ["BenchmarkModel"]
 
 
+class TimedPipeline(Pipeline):
+    """Pipeline that records how long each fit takes
+
+    Tuning estimators call `fit` with the param maps of their grid, so the
+    timings are keyed by the id of the param map used. Copies share the
+    timings.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.fit_times = {}
+        # (param map id, seconds) in the order the fits ended
+        self.fits = []
+        self._lock = Lock()
+
+    def fit(self, dataset, params=None):
+        """Fit and record the time taken"""
+        start_time = float(time())
+        model = super().fit(dataset, params)
+        elapsed = time() - start_time
+        with self._lock:
+            self.fit_times.setdefault(id(params), []).append(elapsed)
+            self.fits.append((id(params), elapsed))
+        return model
+
+    def pop_last_fit(self) -> float:
+        """Seconds of the last fit, no longer counted in `fit_times`"""
+        with self._lock:
+            params_id, elapsed = self.fits.pop()
+            self.fit_times[params_id].remove(elapsed)
+        return elapsed
+
+
 class BenchmarkModel(SparkSQL):
-    """Create a benchmark model"""
+    """Create a benchmark model
+
+    Pass `mode="tune"` to search the `param_grid` in `conf/modelling.json`
+    and `model_store_dir` to keep fitted models and skip refitting when
+    the data and params are unchanged. With `feature_store_dir`, train on
+    a date range of stored features, see `load_training_data`
+
+    The labels of the string feature indexers, the `QuantileBinning`
+    splits of binned features and the `CompactSchema` casts are saved
+    with the model for scoring.
+    """
 
     target_label = "loan_status"
     metrics = {}
 
+    @property
+    def indexed_label(self):
+        """Label column used by the classifier"""
+        return "indexed{}".format(self.target_label)
+
+    @classmethod
+    def label_columns(cls) -> tuple:
+        """The label and its index, never features"""
+        return cls.target_label, "indexed{}".format(cls.target_label)
+
     @staticmethod
-    def index_str_columns(df_, cols_to_index: list):
-        """Index str columns
+    def fit_indexers(df_, cols: list) -> dict:
+        """Labels of string columns, most frequent first, in one fit
 
         :param df_: pyspark DF
-        :param cols_to_index: Columns to index
+        :param cols: Columns to index
+        :return: column to labels, the index of a value is its position
+        """
+        if not cols:
+            return {}
+        indexer_ = StringIndexer(
+            inputCols=cols,
+            outputCols=["indexed{}".format(col_) for col_ in cols],
+            handleInvalid="skip")
+        model_ = indexer_.fit(df_)
+        return {col_: list(labels)
+                for col_, labels in zip(cols, model_.labelsArray)}
+
+    @staticmethod
+    def index_str_columns(df_, labels: dict):
+        """Index str columns with fitted labels
+
+        :param df_: pyspark DF
+        :param labels: column to labels, see `fit_indexers`
         :return: pyspark df with indexed columns
         """
-        for col_ in cols_to_index:
-            indexer_ = StringIndexer(
-                inputCol=col_, outputCol="indexed{}".format(col_))
-            indexer_.setHandleInvalid("skip")
-            model_ = indexer_.fit(df_)
-            df_ = model_.transform(df_)
-        return df_
+        if not labels:
+            return df_
+        cols = sorted(labels)
+        model_ = StringIndexerModel.from_arrays_of_labels(
+            [labels[col_] for col_ in cols],
+            inputCols=cols,
+            outputCols=["indexed{}".format(col_) for col_ in cols],
+            handleInvalid="skip")
+        return model_.transform(df_)
 
     @staticmethod
     def create_feature_vector(df_, cols):
@@ -45,26 +130,70 @@ class BenchmarkModel(SparkSQL):
             handleInvalid="skip")
         return assembler.transform(df_)
 
-    def _execute(self):
-        df = self.df_from_temp_table(self.kwargs["previous_job_temp_table"])
-        if self.target_label in df.columns:
-            df = df.drop(self.target_label)
-        cols_to_index = [k for k, v in df.dtypes if
-                         (v == "string" and k != self.target_label)]
-        cols_not_to_index = [k for k, v in df.dtypes if v != "string"]
+    @classmethod
+    def assemble_features(cls, df_, feature_cols: list = None,
+                          feature_labels: dict = None):
+        """Index the string columns and assemble the features
+
+        Codes of upstream jobs (e.g. SetTrainingData) are fitted on their
+        own batch, so string columns are indexed again here: with labels
+        fitted on `df_` for training, with the labels saved with the model
+        for scoring.
 
-        feature_cols = cols_not_to_index + [
-            "indexed{}".format(col_) for col_ in cols_to_index]
+        :param df_: pyspark DF
+        :param feature_cols: feature columns in order, derived when None
+        :param feature_labels: labels of the string columns, fitted when
+            None
+        :return: (pyspark df with a feature vector column, feature columns,
+            labels of the string columns)
+        """
+        if feature_labels is None:
+            cols_to_index = [k for k, v in df_.dtypes if
+                             (v == "string" and
+                              k not in cls.label_columns())]
+            if feature_cols is not None:
+                cols_to_index = [
+                    col_ for col_ in cols_to_index
+                    if "indexed{}".format(col_) in feature_cols]
+            feature_labels = cls.fit_indexers(df_, cols_to_index)
+        missing = [col_ for col_ in feature_labels if col_ not in df_.columns]
+        if missing:
+            raise ValueError("Missing string columns %s" % missing)
+        df_ = df_.drop(*[
+            "indexed{}".format(col_) for col_ in feature_labels
+            if "indexed{}".format(col_) in df_.columns])
+        df_ = cls.index_str_columns(df_, feature_labels)
+
+        if feature_cols is None:
+            feature_cols = []
+            for col_, type_ in df_.dtypes:
+                if type_ != "string" and col_ not in feature_cols and \
+                        col_ not in cls.label_columns():
+                    feature_cols.append(col_)
+
+        return cls.create_feature_vector(df_, feature_cols), feature_cols, \
+            feature_labels
+
+    def evaluator(self):
+        """Accuracy evaluator"""
+        return MulticlassClassificationEvaluator(
+            labelCol=self.indexed_label,
+            predictionCol="prediction",
+            metricName="accuracy")
 
-        df = self.create_feature_vector(df, feature_cols)
+    def build_pipeline(self, df_) -> (Pipeline, RandomForestClassifier):
+        """Build the model pipeline
 
+        :param df_: pyspark DF with a feature vector column
+        :return: (pipeline, random forest stage)
+        """
         # Index labels, adding metadata to the label column.
         # Fit on whole dataset to include all labels in index.
         label_indexer = StringIndexer(
             inputCol=self.target_label,
-            outputCol="{}loan_status".format("indexed"))
+            outputCol=self.indexed_label)
         label_indexer.setHandleInvalid("skip")
-        label_indexer = label_indexer.fit(df)
+        label_indexer = label_indexer.fit(df_)
 
         # Automatically identify categorical features, and index them.
         # Set maxCategories so features with > 12 distinct values are
@@ -75,12 +204,9 @@ class BenchmarkModel(SparkSQL):
             maxCategories=12)
         feature_indexer.setHandleInvalid("skip")
 
-        # Split the data into training and test sets (30% held out for testing)
-        (trainingData, testData) = df.randomSplit([0.7, 0.3])
-
         # Train a RandomForest model.
         rf = RandomForestClassifier(
-            labelCol="{}loan_status".format("indexed"),
+            labelCol=self.indexed_label,
             featuresCol="indexedFeatures",
             predictionCol="prediction",
             numTrees=10)
@@ -94,21 +220,325 @@ class BenchmarkModel(SparkSQL):
         # Chain indexers and forest in a Pipeline
         pipeline = Pipeline(
             stages=[label_indexer, feature_indexer, rf, label_converter])
+        return pipeline, rf
 
-        # Train model.  This also runs the indexers.
-        model = pipeline.fit(trainingData)
+    def tuning_conf(self) -> dict:
+        """Tuning settings from `conf/modelling.json` and kwargs"""
+        conf = FromJson(THIS_DIR)
+        tuning = dict(conf["conf.modelling.tuning"])
+        tuning["param_grid"] = conf["conf.modelling.param_grid"]
+        for key in ("method", "parallelism", "num_folds", "train_ratio",
+                    "seed", "param_grid"):
+            if key in self.kwargs:
+                tuning[key] = self.kwargs[key]
+        return tuning
 
-        # # Make predictions.
-        predictions = model.transform(testData)
+    @staticmethod
+    def param_maps(rf_, param_grid: dict) -> list:
+        """Build param maps for the random forest
 
-        # Select (prediction, true label) and compute test error
-        evaluator = MulticlassClassificationEvaluator(
-            labelCol="{}loan_status".format("indexed"),
-            predictionCol="prediction",
-            metricName="accuracy")
+        :param rf_: RandomForestClassifier stage
+        :param param_grid: param name to list of candidate values
+        :return: list of param maps
+        """
+        builder = ParamGridBuilder()
+        for name, values in sorted(param_grid.items()):
+            builder = builder.addGrid(rf_.getParam(name), values)
+        return builder.build()
 
-        accuracy = evaluator.evaluate(predictions)
+    def tune(self, pipeline: Pipeline, rf_, training_data):
+        """Search the param grid in parallel
+
+        :param pipeline: model pipeline
+        :param rf_: random forest stage in the pipeline
+        :param training_data: persisted pyspark df to search on
+        :return: best pipeline model
+        """
+        tuning = self.tuning_conf()
+        param_maps = self.param_maps(rf_, tuning["param_grid"])
+        estimator = TimedPipeline(stages=pipeline.getStages())
+
+        if tuning["method"] == "cross_validator":
+            search = CrossValidator(
+                estimator=estimator,
+                estimatorParamMaps=param_maps,
+                evaluator=self.evaluator(),
+                numFolds=int(tuning["num_folds"]),
+                parallelism=int(tuning["parallelism"]),
+                seed=tuning["seed"])
+        else:
+            search = TrainValidationSplit(
+                estimator=estimator,
+                estimatorParamMaps=param_maps,
+                evaluator=self.evaluator(),
+                trainRatio=float(tuning["train_ratio"]),
+                parallelism=int(tuning["parallelism"]),
+                seed=tuning["seed"])
+
+        # Every candidate reads the same persisted training data
+        search_model = search.fit(training_data)
+        # The best params are fitted again on all the training data once
+        # the search is over, that fit is not part of the search
+        refit_time = estimator.pop_last_fit()
+
+        if tuning["method"] == "cross_validator":
+            scores = search_model.avgMetrics
+        else:
+            scores = search_model.validationMetrics
+
+        candidates = []
+        for param_map, score in zip(param_maps, scores):
+            fit_times = estimator.fit_times.get(id(param_map), [])
+            candidates.append({
+                "params": {
+                    param.name: value for param, value in param_map.items()},
+                "accuracy": score,
+                "fit_time": sum(fit_times),
+                "num_fits": len(fit_times)
+            })
+        best = max(candidates, key=lambda candidate: candidate["accuracy"])
+
+        self.metrics["tuning"] = {
+            "method": tuning["method"],
+            "parallelism": int(tuning["parallelism"]),
+            "best_params": best["params"],
+            "refit_time": refit_time,
+            "candidates": candidates
+        }
+        return search_model.bestModel
+
+    def split_conf(self) -> (list, int):
+        """Split ratios and seed from `conf/modelling.json` and kwargs"""
+        split = dict(FromJson(THIS_DIR)["conf.modelling.split"])
+        for key in ("ratios", "seed"):
+            if key in self.kwargs:
+                split[key] = self.kwargs[key]
+        return [float(ratio) for ratio in split["ratios"]], int(split["seed"])
+
+    def sampling_conf(self) -> dict:
+        """Training sample settings from `conf/modelling.json` and kwargs,
+        None when training on the whole training split
+
+        - `sample_size`: rows to train on
+        - `sample_ratio`: share of the training split to train on
+        - `balance`: as many rows of each class, up to what it has
+        - `sample_seed`: seed of the sample
+        """
+        sampling = dict(FromJson(THIS_DIR)["conf.modelling.sampling"])
+        for key in ("sample_size", "sample_ratio", "balance"):
+            if key in self.kwargs:
+                sampling[key] = self.kwargs[key]
+        if "sample_seed" in self.kwargs:
+            sampling["seed"] = self.kwargs["sample_seed"]
+        if not (sampling["sample_size"] or sampling["sample_ratio"] or
+                sampling["balance"]):
+            return None
+        return sampling
+
+    @staticmethod
+    def sample_fractions(class_counts: dict, sample_size: int = None,
+                         sample_ratio: float = None,
+                         balance: bool = False) -> dict:
+        """Fraction of each class to sample
+
+        :param class_counts: rows of each class
+        :param sample_size: rows to sample in all
+        :param sample_ratio: share of all rows to sample, when no size
+        :param balance: sample as many rows of each class, the size of
+            the smallest class by default
+        :return: class to fraction, between 0 and 1
+        """
+        total = sum(class_counts.values())
+        if not total:
+            return {label: 0.0 for label in class_counts}
+        if sample_size:
+            target = float(sample_size)
+        elif sample_ratio:
+            target = float(sample_ratio) * total
+        elif balance:
+            target = float(min(class_counts.values()) * len(class_counts))
+        else:
+            target = float(total)
+
+        if not balance:
+            return {label: min(1.0, target / total)
+                    for label in class_counts}
+        per_class = target / len(class_counts)
+        return {label: min(1.0, per_class / count) if count else 0.0
+                for label, count in class_counts.items()}
+
+    def class_counts(self, df_) -> dict:
+        """Rows of each class"""
+        return {row[self.target_label]: row["count"]
+                for row in df_.groupBy(self.target_label).count().collect()
+                if row[self.target_label] is not None}
+
+    def sample(self, df_, sampling: dict):
+        """Stratified sample of the training data, with `sampleBy`
+
+        :param df_: persisted training data
+        :param sampling: see `sampling_conf`
+        :return: sample, not persisted
+        """
+        class_counts = self.class_counts(df_)
+        fractions = self.sample_fractions(
+            class_counts, sampling["sample_size"], sampling["sample_ratio"],
+            sampling["balance"])
+        self.metrics["sampling"] = {
+            "fractions": fractions,
+            "class_counts": class_counts,
+            "seed": int(sampling["seed"])
+        }
+        return df_.sampleBy(self.target_label, fractions,
+                            int(sampling["seed"]))
+
+    @contextmanager
+    def training_data(self, df_):
+        """Persisted training and test sets of the assembled features
+
+        The features are materialized once and split with a seed, so the
+        fit, its several passes and the test predictions all read the same
+        partitions instead of recomputing the upstream lineage.
+        Everything is released when the block exits.
+
+        :param df_: pyspark DF with a feature vector column
+        :return: (training data, test data)
+        """
+        ratios, seed = self.split_conf()
+        features = df_.select(self.target_label, "features") \
+            .persist(StorageLevel.MEMORY_AND_DISK)
+        splits = []
+        try:
+            features.count()
+            splits = [
+                split.persist(StorageLevel.MEMORY_AND_DISK)
+                for split in features.randomSplit(ratios, seed)]
+            self.metrics["num_train_records"] = splits[0].count()
+            self.metrics["num_test_records"] = splits[1].count()
+            # The splits are cached, the assembled features are not needed
+            features.unpersist()
+            training = splits[0]
+            sampling = self.sampling_conf()
+            if sampling:
+                # Only the training split, the test split stays whole
+                training = self.sample(training, sampling).persist(
+                    StorageLevel.MEMORY_AND_DISK)
+                splits.append(training)
+                splits[0].unpersist()
+                self.metrics["sampling"]["sample_counts"] = \
+                    self.class_counts(training)
+                self.metrics["num_sample_records"] = sum(
+                    self.metrics["sampling"]["sample_counts"].values())
+            yield training, splits[1]
+        finally:
+            for split in splits:
+                split.unpersist()
+            features.unpersist()
+
+    def model_params(self) -> dict:
+        """Params identifying how a model is fitted"""
+        params = {
+            "mode": self.kwargs.get("mode", "fit"),
+            "split": list(self.split_conf()),
+            "numTrees": 10
+        }
+        if params["mode"] == "tune":
+            params["tuning"] = self.tuning_conf()
+        if self.sampling_conf():
+            params["sampling"] = self.sampling_conf()
+        return params
+
+    def model_store(self) -> ModelStore:
+        """Model store, when `model_store_dir` is given"""
+        root_dir = self.kwargs.get("model_store_dir")
+        if not root_dir:
+            return None
+        return ModelStore(
+            root_dir, int(self.kwargs.get("model_retention", 5)))
+
+    def reads_feature_store(self) -> bool:
+        """Whether to train on the feature store: dates are given or there
+        is no previous job"""
+        return bool(self.kwargs.get("feature_store_dir") and (
+            self.kwargs.get("start_date") or self.kwargs.get("end_date") or
+            not self.kwargs.get("previous_job_temp_table")))
+
+    def feature_partitions(self) -> dict:
+        """Manifest entries of the `start_date` to `end_date` partitions"""
+        store = self.feature_store()
+        partitions = store.manifest(self.feature_table)["partitions"]
+        return {date: partitions[date] for date in store.dates(
+            self.feature_table, self.kwargs.get("start_date"),
+            self.kwargs.get("end_date"))}
+
+    def load_training_data(self):
+        """Previous job's temp table, or the `start_date` to `end_date`
+        partitions of the feature store"""
+        if not self.reads_feature_store():
+            return self.df_from_temp_table(
+                self.kwargs["previous_job_temp_table"])
+        store = self.feature_store()
+        df = store.read(
+            self.get_sql_context().read, self.feature_table,
+            self.kwargs.get("start_date"), self.kwargs.get("end_date"))
+        self.metrics["feature_dates"] = sorted(self.feature_partitions())
+        return df.drop(store.partition_column)
+
+    def memo_inputs(self) -> list:
+        """Stored partitions, as written, when training on the feature
+        store"""
+        if not self.reads_feature_store():
+            return super().memo_inputs()
+        return [[date, entry["rows"], entry["written_at"]]
+                for date, entry in sorted(self.feature_partitions().items())]
+
+    def _execute(self):
+        df = self.load_training_data()
+        store = self.model_store()
+        model_name = self.kwargs.get("model_name", self.__class__.__name__)
+        fingerprint = self.fingerprint(df) if store else None
+        bin_splits = QuantileBinning.column_splits(df)
+        casts = CompactSchema.saved_casts(df)
+        df, feature_cols, feature_labels = self.assemble_features(df)
+        params = self.model_params()
+
+        # Split the data into training and test sets (30% held out for testing)
+        with self.training_data(df) as (trainingData, testData):
+            stored = store.find(
+                model_name, fingerprint, params, feature_cols) \
+                if store else None
+            start_time = float(time())
+            if stored:
+                # Same data and params, re-evaluate the stored model
+                model = store.load(stored)
+            elif self.kwargs.get("mode") == "tune":
+                pipeline, rf = self.build_pipeline(
+                    trainingData.union(testData))
+                model = self.tune(pipeline, rf, trainingData)
+            else:
+                pipeline, rf = self.build_pipeline(
+                    trainingData.union(testData))
+                # Train model.  This also runs the indexers.
+                model = pipeline.fit(trainingData)
+            self.metrics["fit_time"] = time() - start_time
+
+            # # Make predictions.
+            predictions = model.transform(testData)
+
+            # Select (prediction, true label) and compute test error
+            accuracy = self.evaluator().evaluate(predictions)
 
         self.metrics["accuracy"] = accuracy
 
+        if store:
+            self.metrics["model_reused"] = stored is not None
+            if not stored:
+                stored = store.save(
+                    model_name, model, fingerprint, feature_cols, params,
+                    {"accuracy": accuracy},
+                    {"feature_labels": feature_labels, "splits": bin_splits,
+                     "casts": casts})
+            self.metrics["model_version"] = stored["version"]
+            self.metrics["models_removed"] = store.cleanup(model_name)
+
         return str(accuracy)
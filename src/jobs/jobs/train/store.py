@@ -0,0 +1,189 @@
+"""Versioned model artifacts on the local filesystem"""
+import json
+import os
+import re
+import shutil
+from threading import Lock
+from time import time
+
+from pyspark.ml import PipelineModel
+
+
+__all__ = ["ModelStore"]
+
+
+class ModelStore:
+    """Save, find and load fitted models
+
+    Layout::
+
+        <root_dir>/<name>/v<version>/model      saved pipeline model
+        <root_dir>/<name>/v<version>/meta.json  version, data fingerprint,
+                                                features, params, metrics,
+                                                preprocessing
+        <root_dir>/<name>/last_version          last version number given
+
+    Version numbers are never reused, even once cleaned up.
+    """
+
+    meta_file = "meta.json"
+    counter_file = "last_version"
+    version_dir = re.compile(r"^v\d+$")
+    _lock = Lock()
+
+    def __init__(self, root_dir: str, retention: int = 5):
+        """
+        :param root_dir: Directory to keep the models in
+        :param retention: Number of versions to keep per model
+        """
+        self.root_dir = root_dir
+        self.retention = retention
+
+    def model_dir(self, name: str, version: int) -> str:
+        """Directory of a model version"""
+        return os.path.join(self.root_dir, name, "v{}".format(version))
+
+    def versions(self, name: str) -> list:
+        """Metadata of all saved versions, oldest first
+
+        :param name: model name
+        """
+        base_dir = os.path.join(self.root_dir, name)
+        if not os.path.isdir(base_dir):
+            return []
+        metas = []
+        for dir_ in os.listdir(base_dir):
+            if not self.version_dir.match(dir_):
+                # Staging directories of versions being saved
+                continue
+            meta_path = os.path.join(base_dir, dir_, self.meta_file)
+            if os.path.isfile(meta_path):
+                with open(meta_path) as f_meta:
+                    metas.append(json.load(f_meta))
+        return sorted(metas, key=lambda meta: meta["version"])
+
+    def latest(self, name: str) -> dict:
+        """Metadata of the latest version or None"""
+        metas = self.versions(name)
+        return metas[-1] if metas else None
+
+    def next_version(self, name: str) -> int:
+        """Take the next version number of a model"""
+        base_dir = os.path.join(self.root_dir, name)
+        os.makedirs(base_dir, exist_ok=True)
+        counter_path = os.path.join(base_dir, self.counter_file)
+        with self._lock:
+            last = 0
+            if os.path.isfile(counter_path):
+                with open(counter_path) as f_counter:
+                    last = int(f_counter.read().strip() or 0)
+            latest = self.latest(name)
+            # Stores saved before the counter existed
+            version = max(last, latest["version"] if latest else 0) + 1
+            with open(counter_path + ".tmp", "w") as f_counter:
+                f_counter.write(str(version))
+            os.replace(counter_path + ".tmp", counter_path)
+        return version
+
+    def find(self, name: str, fingerprint: str, params: dict,
+             features: list) -> dict:
+        """Latest version fitted on the same data with the same params
+
+        :param name: model name
+        :param fingerprint: input data fingerprint
+        :param params: model params
+        :param features: feature columns in order
+        :return: version metadata or None
+        """
+        params = json.loads(json.dumps(params, sort_keys=True))
+        for meta in reversed(self.versions(name)):
+            if (meta["fingerprint"] == fingerprint and
+                    meta["params"] == params and
+                    meta["features"] == list(features)):
+                return meta
+        return None
+
+    def save(self, name: str, model, fingerprint: str, features: list,
+             params: dict, metrics: dict, preprocessing: dict = None) -> dict:
+        """Save a new version of a model
+
+        :param name: model name
+        :param model: fitted model with a `save(path)` method
+        :param fingerprint: input data fingerprint
+        :param features: feature columns in order
+        :param params: model params
+        :param metrics: model metrics
+        :param preprocessing: state fitted outside the model that scoring
+            applies, e.g. the labels of the feature indexers, the
+            splits of binned features and the casts of compacted ones
+        :return: version metadata
+        """
+        version = self.next_version(name)
+        now = time()
+        meta = {
+            "name": name,
+            "version": version,
+            "fingerprint": fingerprint,
+            "features": list(features),
+            "params": params,
+            "metrics": metrics,
+            "preprocessing": preprocessing or {},
+            "created_at": now,
+            "last_used": now
+        }
+        target_dir = self.model_dir(name, version)
+        # Write next to the target and rename, readers never see half
+        # written versions
+        tmp_dir = target_dir + ".tmp"
+        if os.path.isdir(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+        model.save(os.path.join(tmp_dir, "model"))
+        self._write_meta(tmp_dir, meta)
+        os.rename(tmp_dir, target_dir)
+        return self._read_meta(target_dir)
+
+    def load(self, meta: dict, loader=PipelineModel.load):
+        """Load a saved version and mark it as recently used
+
+        :param meta: version metadata
+        :param loader: callable loading a model from a path
+        :return: the model
+        """
+        version_dir = self.model_dir(meta["name"], meta["version"])
+        model = loader(os.path.join(version_dir, "model"))
+        self.touch(meta)
+        return model
+
+    def touch(self, meta: dict):
+        """Mark a version as recently used"""
+        meta["last_used"] = time()
+        self._write_meta(self.model_dir(meta["name"], meta["version"]), meta)
+
+    def cleanup(self, name: str, retention: int = None) -> list:
+        """Remove the least recently used versions beyond retention
+
+        :param name: model name
+        :param retention: number of versions to keep
+        :return: removed versions
+        """
+        retention = self.retention if retention is None else retention
+        metas = sorted(
+            self.versions(name),
+            key=lambda meta: (meta["last_used"], meta["version"]),
+            reverse=True)
+        removed = []
+        for meta in metas[retention:]:
+            shutil.rmtree(self.model_dir(name, meta["version"]))
+            removed.append(meta["version"])
+        return sorted(removed)
+
+    def _write_meta(self, version_dir: str, meta: dict):
+        """Write metadata of a version"""
+        with open(os.path.join(version_dir, self.meta_file), "w") as f_meta:
+            json.dump(meta, f_meta, sort_keys=True)
+
+    def _read_meta(self, version_dir: str) -> dict:
+        """Read metadata of a version"""
+        with open(os.path.join(version_dir, self.meta_file)) as f_meta:
+            return json.load(f_meta)
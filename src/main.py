@@ -0,0 +1,72 @@
+"""Driver entry point running a pipeline of jobs
+
+Submitted as a Spark (Livy batch) application with the `jobs` package in
+`pyFiles`::
+
+    main.py --pipeline benchmark --run-id 2020-01-01 \\
+        --kwargs '{"filename": "s3://bucket/loan.csv"}'
+
+Prints the results of the jobs as JSON on a line starting with
+`RESULT_MARKER`, and exits with 1 when a job fails.
+"""
+import argparse
+import json
+import sys
+import traceback
+
+
+RESULT_MARKER = "PIPELINE_RESULT "
+
+
+def parse_args(argv=None):
+    """Parse the command line arguments"""
+    parser = argparse.ArgumentParser(description="Run a pipeline of jobs")
+    parser.add_argument(
+        "--pipeline", required=True,
+        help="Pipeline name in conf/pipelines.json or comma separated jobs")
+    parser.add_argument("--run-id", help="Run id of the pipeline")
+    parser.add_argument(
+        "--kwargs", default="{}", help="JSON object of job kwargs")
+    parser.add_argument(
+        "--job-kwargs", default="{}",
+        help="JSON object of job name to kwargs of that job only")
+    parser.add_argument("--spark-profile", help="Profile in conf/spark.json")
+    return parser.parse_args(argv)
+
+
+def pipeline_arg(pipeline: str):
+    """Pipeline name or list of job names"""
+    if "," in pipeline:
+        return [job.strip() for job in pipeline.split(",") if job.strip()]
+    return pipeline
+
+
+def main(argv=None) -> int:
+    """Run a pipeline and print its results"""
+    args = parse_args(argv)
+    kwargs = json.loads(args.kwargs)
+    if args.spark_profile:
+        kwargs["spark_profile"] = args.spark_profile
+
+    from jobs.core.eventlog import safe_run_id
+    from jobs.core.session import SessionManager
+    from jobs.jobs.pipeline import run_pipeline
+
+    session = SessionManager(kwargs.get("spark_profile")).session
+    try:
+        results = run_pipeline(
+            session.sparkContext, pipeline_arg(args.pipeline),
+            safe_run_id(args.run_id),
+            job_kwargs=json.loads(args.job_kwargs), **kwargs)
+    except Exception as err:  # pylint:disable=broad-except
+        traceback.print_exc()
+        print(RESULT_MARKER + json.dumps(
+            {"status": "failed", "error": repr(err)}))
+        return 1
+    print(RESULT_MARKER + json.dumps(
+        {"status": "success", "results": results}, default=str))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,112 @@
+"""Fake Livy server for testing batch submission"""
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import re
+from threading import Thread
+
+
+class FakeLivy:
+    """Livy `/batches` API on a local port
+
+    Batches report `starting`, then `running` for `polls` state checks,
+    then `final_state`. Their log holds `log_lines`.
+    """
+
+    def __init__(self, final_state="success", polls=2, log_lines=None):
+        self.final_state = final_state
+        self.polls = polls
+        self.log_lines = log_lines or []
+        self.batches = {}
+        self.requests = []
+        self.server = HTTPServer(("127.0.0.1", 0), self.handler())
+        self.thread = Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        """Base url of the server"""
+        return "http://127.0.0.1:{}".format(self.server.server_port)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def state(self, batch: dict) -> str:
+        """State of a batch, advancing on each check"""
+        if batch["state"] in ("success", "dead", "killed"):
+            return batch["state"]
+        batch["checks"] += 1
+        if batch["checks"] == 1:
+            batch["state"] = "starting"
+        elif batch["checks"] <= self.polls + 1:
+            batch["state"] = "running"
+        else:
+            batch["state"] = self.final_state
+        return batch["state"]
+
+    def handler(self):
+        """Request handler bound to this server"""
+        livy = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def log_message(self, *args):
+                pass
+
+            def reply(self, code, body=None):
+                content = json.dumps(body or {}).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def batch(self):
+                match = re.match(r"^/batches/(\d+)", self.path)
+                if not match or int(match.group(1)) not in livy.batches:
+                    self.reply(404, {"msg": "not found"})
+                    return None
+                return livy.batches[int(match.group(1))]
+
+            def do_POST(self):
+                length = int(self.headers["Content-Length"])
+                body = json.loads(self.rfile.read(length))
+                livy.requests.append(("POST", self.path, body))
+                batch_id = len(livy.batches)
+                livy.batches[batch_id] = {
+                    "id": batch_id, "body": body, "state": "not_started",
+                    "checks": 0}
+                self.send_response(201)
+                content = json.dumps(
+                    {"id": batch_id, "state": "starting"}).encode("utf-8")
+                self.send_header("Location", "/batches/{}".format(batch_id))
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def do_GET(self):
+                livy.requests.append(("GET", self.path, None))
+                batch = self.batch()
+                if batch is None:
+                    return
+                if "/state" in self.path:
+                    self.reply(200, {"id": batch["id"],
+                                     "state": livy.state(batch)})
+                elif "/log" in self.path:
+                    self.reply(200, {"id": batch["id"],
+                                     "log": livy.log_lines})
+                else:
+                    self.reply(200, {"id": batch["id"],
+                                     "state": batch["state"]})
+
+            def do_DELETE(self):
+                livy.requests.append(("DELETE", self.path, None))
+                batch = self.batch()
+                if batch is not None:
+                    batch["state"] = "killed"
+                    self.reply(200, {"msg": "deleted"})
+
+        return Handler
@@ -0,0 +1,184 @@
+"""Testing acquisition jobs"""
+import gzip
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+from jobs.config.file import FromJson, THIS_DIR
+from jobs.jobs.acquire import LoadExport
+from jobs.jobs.acquire.common import CSVRecord, DBRecord
+from jobs.jobs.acquire.export import (
+    LocalExporter, PostgresExporter, RedshiftExporter)
+from jobs.jobs.process import GetTrainingData
+
+
+class PushdownTest(unittest.TestCase):
+
+    def test_training_data_pushdown(self):
+        self.assertEqual(
+            GetTrainingData.pushdown_columns(),
+            FromJson(THIS_DIR)["conf.modelling.drop_columns"])
+        self.assertEqual(
+            GetTrainingData.pushdown_predicate(),
+            "loan_status IN ('Fully Paid', 'Charged Off')")
+
+    def test_no_pushdown(self):
+        A = type("A", (CSVRecord,), {"_execute": lambda self: ""})
+        obj = A(None, filename="foo.csv")
+        self.assertIsNone(obj.pushdown_job())
+        df = MagicMock()
+        self.assertIs(obj.apply_pushdown(df), df)
+        df.drop.assert_not_called()
+
+    def test_csv_pushdown(self):
+        A = type("A", (CSVRecord,), {"_execute": lambda self: ""})
+        obj = A(None, filename="foo.csv", pushdown_for="GetTrainingData")
+        self.assertIs(obj.pushdown_job(), GetTrainingData)
+        df = MagicMock()
+        obj.apply_pushdown(df)
+        df.drop.assert_called_with(*GetTrainingData.pushdown_columns())
+        df.drop().where.assert_called_with(
+            GetTrainingData.pushdown_predicate())
+
+    def test_build_query(self):
+        self.assertEqual(DBRecord.build_query("loans"), "SELECT * FROM loans")
+        self.assertEqual(
+            DBRecord.build_query("loans", ["a", "b"], "a > 1"),
+            "SELECT a, b FROM loans WHERE a > 1")
+
+    @patch('jobs.jobs.acquire.common.DBRecord.run_spark_jdbc_sql_query')
+    def test_db_pushdown(self, query_mock):
+        query_mock.return_value = MagicMock(
+            columns=["id", "loan_amnt", "loan_status"])
+        A = type("A", (DBRecord,), {"_execute": lambda self: ""})
+        obj = A(None, pushdown_for="GetTrainingData")
+        query = obj.pushdown_query(None, "loans", {})
+        query_mock.assert_called_with(
+            None, "SELECT * FROM loans WHERE 1 = 0", {})
+        self.assertEqual(
+            query,
+            "SELECT loan_amnt, loan_status FROM loans "
+            "WHERE loan_status IN ('Fully Paid', 'Charged Off')")
+
+
+class ExportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.database = os.path.join(self.tmp_dir.name, "loans.db")
+        conn = sqlite3.connect(self.database)
+        conn.execute("CREATE TABLE loans "
+                     "(id INTEGER, loan_amnt REAL, loan_status TEXT)")
+        conn.executemany("INSERT INTO loans VALUES (?, ?, ?)", [
+            (1, 1000.0, "Fully Paid"), (2, 2000.0, "Current"),
+            (3, 1500.0, "Charged Off")])
+        conn.commit()
+        conn.close()
+        self.staging_dir = os.path.join(self.tmp_dir.name, "staging")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_local_exporter(self):
+        exporter = LocalExporter(self.database, part_rows=2)
+        self.assertEqual(exporter.columns("SELECT * FROM loans WHERE 1 = 0"),
+                         ["id", "loan_amnt", "loan_status"])
+        exporter.export("SELECT id FROM loans", self.staging_dir)
+        self.assertEqual(sorted(os.listdir(self.staging_dir)),
+                         ["part-00000.csv.gz", "part-00001.csv.gz"])
+        with gzip.open(os.path.join(
+                self.staging_dir, "part-00001.csv.gz"), "rt") as f_part:
+            self.assertEqual(f_part.read().split(), ["id", "3"])
+
+    def test_local_exporter_empty(self):
+        LocalExporter(self.database).export(
+            "SELECT id FROM loans WHERE 1 = 0", self.staging_dir)
+        with gzip.open(os.path.join(
+                self.staging_dir, "part-00000.csv.gz"), "rt") as f_part:
+            self.assertEqual(f_part.read().split(), ["id"])
+
+    def test_unload_statement(self):
+        exporter = RedshiftExporter({}, "arn:role", "256 MB")
+        self.assertEqual(
+            exporter.unload_statement(
+                "SELECT * FROM loans WHERE grade = 'A'", "s3://b/stage/"),
+            "UNLOAD ('SELECT * FROM loans WHERE grade = ''A''') "
+            "TO 's3://b/stage/part-' IAM_ROLE 'arn:role' "
+            "FORMAT AS PARQUET MAXFILESIZE 256 MB")
+
+    def test_copy_parts(self):
+        self.assertEqual(PostgresExporter({}, 4).part_queries("q"), ["q"])
+        queries = PostgresExporter({}, 2, "id").part_queries("SELECT 1")
+        self.assertEqual(queries[0], "SELECT * FROM (SELECT 1) AS export "
+                                     "WHERE mod(id, 2) IN (0, -0) "
+                                     "OR id IS NULL")
+        self.assertEqual(queries[1], "SELECT * FROM (SELECT 1) AS export "
+                                     "WHERE mod(id, 2) IN (1, -1)")
+        with self.assertRaises(ValueError):
+            PostgresExporter({}).export("SELECT 1", "s3://bucket/staging")
+        self.assertEqual(
+            PostgresExporter.copy_statement("SELECT 1"),
+            "COPY (SELECT 1) TO STDOUT WITH (FORMAT csv, HEADER)")
+
+    @patch('jobs.jobs.acquire.export.get_pool_conn')
+    def test_copy_snapshot(self, conn_mock):
+        cursor = conn_mock.return_value.__enter__.return_value.cursor \
+            .return_value.__enter__.return_value
+        cursor.fetchone.return_value = ["00000003-1"]
+        with tempfile.TemporaryDirectory() as staging_dir:
+            PostgresExporter({}, 2, "id").export("SELECT 1", staging_dir)
+            self.assertEqual(sorted(os.listdir(staging_dir)), [
+                "part-00000.csv.gz", "part-00001.csv.gz"])
+        # One snapshot exported, then imported by each COPY
+        cursor.execute.assert_any_call("SELECT pg_export_snapshot()")
+        snapshot_calls = [
+            call_ for call_ in cursor.execute.call_args_list
+            if call_[0][0] == "SET TRANSACTION SNAPSHOT %s"]
+        self.assertEqual([call_[0][1] for call_ in snapshot_calls],
+                         [("00000003-1",)] * 2)
+        self.assertEqual(cursor.copy_expert.call_count, 2)
+
+    @patch('jobs.jobs.acquire.export.get_pool_conn')
+    def test_db_columns(self, conn_mock):
+        cursor = conn_mock.return_value.__enter__.return_value.cursor \
+            .return_value.__enter__.return_value
+        cursor.description = [("id",), ("grade",)]
+        self.assertEqual(
+            PostgresExporter({}).columns("SELECT id, grade FROM loans"),
+            ["id", "grade"])
+        # Planned, no rows fetched
+        cursor.execute.assert_called_once_with(
+            "SELECT * FROM (SELECT id, grade FROM loans) AS q LIMIT 0")
+
+    def test_unknown_exporter(self):
+        with self.assertRaises(ValueError):
+            LoadExport(None, exporter="oracle").get_exporter()
+
+    @patch('jobs.jobs.common.SparkSQL.get_sql_context')
+    def test_load_export(self, context_mock):
+        reader = context_mock.return_value.read
+        df = reader.csv.return_value.persist.return_value
+        df.count.return_value = 2
+        df.columns = ["loan_amnt", "loan_status"]
+        job = LoadExport(
+            None, exporter="local", database=self.database,
+            table="loans", staging_dir=self.staging_dir,
+            pushdown_for="GetTrainingData")
+
+        def read_csv(path, **options):
+            # Staged files are there while Spark reads them
+            self.assertEqual(options, {"header": True, "inferSchema": True})
+            with gzip.open(os.path.join(path, "part-00000.csv.gz"),
+                           "rt") as f_part:
+                self.assertEqual(f_part.read().splitlines(), [
+                    "loan_amnt,loan_status", "1000.0,Fully Paid",
+                    "1500.0,Charged Off"])
+            return reader.csv.return_value
+        reader.csv.side_effect = read_csv
+
+        self.assertEqual(job.execute(), "LoadExport_data")
+        self.assertEqual(job.metrics["num_records"], 2)
+        self.assertGreater(job.metrics["staged_bytes"], 0)
+        self.assertFalse(os.path.exists(job.staging_dir()))
@@ -0,0 +1,142 @@
+"""Testing memoization of job results"""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from jobs.core.base import BaseRegistry
+from jobs.core.cache import ResultCache
+
+
+def write_file(size):
+    def save(path):
+        with open(os.path.join(path, "data"), "w") as f_obj:
+            f_obj.write("x" * size)
+    return save
+
+
+class ResultCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root_dir = tempfile.mkdtemp()
+        self.cache = ResultCache(self.root_dir, max_bytes=2500)
+
+    def tearDown(self):
+        shutil.rmtree(self.root_dir)
+
+    def test_key(self):
+        self.assertEqual(
+            ResultCache.key("A", {"a": 1, "b": 2}),
+            ResultCache.key("A", {"b": 2, "a": 1}))
+        self.assertNotEqual(
+            ResultCache.key("A", {"a": 1}), ResultCache.key("A", {"a": 2}))
+
+    def test_get_put(self):
+        self.assertIsNone(self.cache.get("k1"))
+        self.cache.put("k1", write_file(10), "table", {"num_records": 3})
+        entry = self.cache.get("k1")
+        self.assertEqual(entry["result"], "table")
+        self.assertEqual(entry["metrics"], {"num_records": 3})
+        self.assertEqual(self.cache.stats(), {"hits": 1, "misses": 1})
+
+    def test_lru_eviction(self):
+        self.cache.put("k1", write_file(1000), "", {})
+        self.cache.put("k2", write_file(1000), "", {})
+        self.cache.get("k1")
+        evicted = self.cache.put("k3", write_file(1000), "", {})
+        self.assertEqual(evicted, ["k2"])
+        self.assertEqual(
+            sorted(meta["key"] for meta in self.cache.entries()),
+            ["k1", "k3"])
+
+    def test_kept_entries(self):
+        self.cache.put("k1", write_file(1000), "", {})
+        self.cache.put("k2", write_file(1000), "", {})
+        # k1 backs a view, the entry just written is never evicted
+        evicted = self.cache.put("k3", write_file(3000), "", {}, keep={"k1"})
+        self.assertEqual(evicted, ["k2"])
+        self.assertEqual(
+            sorted(meta["key"] for meta in self.cache.entries()),
+            ["k1", "k3"])
+
+    def test_failed_save(self):
+        def save(path):
+            raise IOError()
+        with self.assertRaises(IOError):
+            self.cache.put("k1", save, "", {})
+        self.assertEqual(os.listdir(self.root_dir), [])
+
+
+class MemoizedJobTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root_dir = tempfile.mkdtemp()
+        self.runs = []
+
+        def _execute(job):
+            self.runs.append(job.kwargs)
+            job.metrics["num_records"] = 7
+            return "output"
+
+        def memo_restore(job, key, result, path):
+            job.restored = os.listdir(path)
+            return result
+
+        self.job_cls = type("MemoJob", (BaseRegistry,), {
+            "_execute": _execute,
+            "side_effect": lambda job: None,
+            "memo_save": lambda job, key, result, path: write_file(5)(path),
+            "memo_restore": memo_restore,
+            "metrics": {}
+        })
+
+    def tearDown(self):
+        shutil.rmtree(self.root_dir)
+
+    def run_job(self, **kwargs):
+        job = self.job_cls()
+        job.kwargs = dict(kwargs, memo_dir=self.root_dir)
+        return job, [res for res in job.execute_extra()][0]
+
+    def test_memoized(self):
+        job, result = self.run_job(date="2020-01-01")
+        self.assertEqual(result, "output")
+        self.assertFalse(job.get_metrics()["memo"]["hit"])
+
+        job, result = self.run_job(date="2020-01-01")
+        self.assertEqual(result, "output")
+        metrics = job.get_metrics()
+        self.assertTrue(metrics["memo"]["hit"])
+        self.assertEqual(metrics["memo"]["hits"], 1)
+        self.assertEqual(metrics["num_records"], 7)
+        self.assertIn("data", job.restored)
+        self.assertEqual(len(self.runs), 1)
+
+        job, _ = self.run_job(date="2020-01-02")
+        self.assertFalse(job.get_metrics()["memo"]["hit"])
+        self.assertEqual(len(self.runs), 2)
+
+    def test_memoized_across_runs(self):
+        job, _ = self.run_job(
+            date="2020-01-01", run_id="r1", previous_job_temp_table="A_r1",
+            plan_dir="/tmp/plans")
+        self.assertFalse(job.get_metrics()["memo"]["hit"])
+        # Saved output is restored from the cache, not the save directory
+        self.assertIn("data", job.restored)
+
+        job, _ = self.run_job(
+            date="2020-01-01", run_id="r2", previous_job_temp_table="A_r2")
+        self.assertTrue(job.get_metrics()["memo"]["hit"])
+        self.assertEqual(len(self.runs), 1)
+
+    def test_code_version(self):
+        self.assertEqual(
+            self.job_cls.code_version(), self.job_cls.code_version())
+        self.assertNotEqual(
+            self.job_cls.code_version(), BaseRegistry.code_version())
+
+    def test_code_version_conf(self):
+        version = self.job_cls.code_version()
+        with patch("jobs.core.base.conf_version", return_value="changed"):
+            self.assertNotEqual(self.job_cls.code_version(), version)
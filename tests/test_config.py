@@ -1,9 +1,14 @@
 """Test config module and configs available"""
 import os
+import subprocess
+import sys
+import tempfile
 import unittest
+import zipfile
 from unittest.mock import patch
 
-from jobs.config.file import FromFile, FromJson, THIS_DIR
+from jobs.config.file import (
+    FromFile, FromJson, THIS_DIR, conf_filenames, conf_version)
 from jobs.config.secret import Secret
 
 
@@ -52,6 +57,31 @@ class ConfigTest(unittest.TestCase):
         with self.assertRaises(AttributeError):
             conf["sql.queries.dummy_query"]
 
+    def test_from_zip(self):
+        package_dir = os.path.dirname(THIS_DIR)
+        code = (
+            "import jobs\n"
+            "from jobs.config.file import FromJson, THIS_DIR, conf_filenames,"
+            " conf_version\n"
+            "assert jobs.__file__.startswith(sys.argv[1]), jobs.__file__\n"
+            "print(FromJson(THIS_DIR)['conf.sample.sample_key'])\n"
+            "print(conf_filenames())\n"
+            "print(conf_version())\n")
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            archive = os.path.join(tmp_dir, "jobs.zip")
+            with zipfile.ZipFile(archive, "w") as f_zip:
+                for dir_, _, files in os.walk(package_dir):
+                    for file_ in files:
+                        path = os.path.join(dir_, file_)
+                        f_zip.write(path, os.path.relpath(
+                            path, os.path.dirname(package_dir)))
+            output = subprocess.check_output(
+                [sys.executable, "-c", "import sys\n" + code, archive],
+                env=dict(os.environ, PYTHONPATH=archive),
+                universal_newlines=True)
+        self.assertEqual(output.splitlines(), [
+            "sample_value", str(conf_filenames()), conf_version()])
+
 
 class TestSecrets(unittest.TestCase):
 
@@ -0,0 +1,103 @@
+"""Testing Spark-free scoring"""
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+import numpy as np
+
+from jobs.jobs.serve.ensemble import TreeEnsemble, export_pipeline
+
+
+def leaf(*stats):
+    return {"stats": list(stats)}
+
+
+TREES = [
+    {"feature": 0, "threshold": 5.0,
+     "left": {"feature": 1, "left_categories": [0.0, 2.0],
+              "left": leaf(8, 2), "right": leaf(1, 3)},
+     "right": leaf(0, 4)},
+    {"feature": 2, "threshold": -1.5,
+     "left": leaf(3, 1),
+     "right": {"feature": 0, "threshold": 10.0,
+               "left": leaf(2, 2), "right": leaf(0, 5)}},
+]
+CATEGORY_MAPS = {1: {10.0: 0, 20.0: 1, 30.0: 2}}
+
+
+def walk(node, features):
+    """Reference evaluation, one record one tree"""
+    while "stats" not in node:
+        value = features[node["feature"]]
+        if "left_categories" in node:
+            go_left = value in node["left_categories"]
+        else:
+            go_left = value <= node["threshold"]
+        node = node["left"] if go_left else node["right"]
+    stats = np.array(node["stats"], dtype=float)
+    return stats / stats.sum()
+
+
+def reference_proba(record):
+    features = list(record)
+    features[1] = CATEGORY_MAPS[1][features[1]]
+    votes = sum(walk(tree, features) for tree in TREES)
+    return votes / votes.sum()
+
+
+class TreeEnsembleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.ensemble = TreeEnsemble.from_trees(
+            TREES, ["amount", "grade", "score"],
+            ["Fully Paid", "Charged Off"], CATEGORY_MAPS,
+            {"grade": ("grade_raw", {"A": 10.0, "B": 20.0, "C": 30.0})})
+
+    def random_matrix(self, size):
+        rng = np.random.RandomState(7)
+        return np.column_stack([
+            rng.uniform(0, 15, size),
+            rng.choice([10.0, 20.0, 30.0], size),
+            rng.uniform(-3, 3, size)])
+
+    def test_matches_reference(self):
+        matrix = self.random_matrix(200)
+        proba = self.ensemble.predict_proba(matrix)
+        expected = np.array([reference_proba(row) for row in matrix])
+        np.testing.assert_allclose(proba, expected)
+        np.testing.assert_array_equal(
+            self.ensemble.predict(matrix), np.argmax(expected, axis=1))
+
+    def test_invalid_records(self):
+        matrix = np.array([[1.0, 40.0, 0.0], [np.nan, 10.0, 0.0]])
+        self.assertEqual(self.ensemble.predict(matrix).tolist(), [-1, -1])
+
+    def test_records(self):
+        labels = self.ensemble.predict_labels([
+            {"amount": 1.0, "grade": 10.0, "score": 0.0},
+            {"amount": 1.0, "grade_raw": "B", "score": -2.0},
+            {"amount": 1.0, "score": 0.0}])
+        self.assertEqual(labels, ["Fully Paid", "Fully Paid", None])
+
+    def test_save_load(self):
+        matrix = self.random_matrix(50)
+        with tempfile.TemporaryDirectory() as dir_:
+            path = os.path.join(dir_, "model.npz")
+            self.ensemble.save(path)
+            loaded = TreeEnsemble.load(path)
+        np.testing.assert_allclose(
+            loaded.predict_proba(matrix), self.ensemble.predict_proba(matrix))
+        self.assertEqual(loaded.labels, self.ensemble.labels)
+        self.assertEqual(
+            loaded.predict_labels([{"amount": 1.0, "grade_raw": "B",
+                                    "score": -2.0}]), ["Fully Paid"])
+
+    def test_export_string_maps(self):
+        ensemble = export_pipeline(
+            MagicMock(stages=[]), ["amount", "indexedgrade"],
+            {"grade": ["B", "A"], "term": ["36 months"]})
+        self.assertEqual(ensemble.string_maps, {
+            "indexedgrade": ("grade", {"B": 0.0, "A": 1.0})})
+        self.assertEqual(ensemble.to_matrix([
+            {"amount": 1.0, "grade": "A"}]).tolist(), [[1.0, 1.0]])
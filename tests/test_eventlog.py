@@ -0,0 +1,169 @@
+"""Testing event log reports"""
+import gzip
+import json
+import os
+import tempfile
+import unittest
+
+from jobs.core.eventlog import (
+    LAZY_NOTE, compare_runs, job_reports, main, parse_events, read_events,
+    report_text, safe_run_id)
+
+
+def task(stage_id, launch, finish, failed=False, gc_time=0, spilled=0):
+    return {
+        "Event": "SparkListenerTaskEnd", "Stage ID": stage_id,
+        "Task Info": {"Launch Time": launch, "Finish Time": finish,
+                      "Failed": failed},
+        "Task Metrics": {
+            "Executor Run Time": finish - launch, "JVM GC Time": gc_time,
+            "Memory Bytes Spilled": spilled, "Disk Bytes Spilled": spilled,
+            "Shuffle Read Metrics": {"Remote Bytes Read": 100,
+                                     "Local Bytes Read": 50,
+                                     "Fetch Wait Time": 0},
+            "Shuffle Write Metrics": {"Shuffle Bytes Written": 10}}}
+
+
+def stage(stage_id, submitted, completed, parents=()):
+    return {"Event": "SparkListenerStageCompleted", "Stage Info": {
+        "Stage ID": stage_id, "Stage Name": "stage %s" % stage_id,
+        "Parent IDs": list(parents), "Submission Time": submitted,
+        "Completion Time": completed}}
+
+
+def run_events(run_id, slow=1):
+    """Two jobs: A with a stage DAG 0 -> (1, 2) -> 3, B with one stage"""
+    return [
+        {"Event": "SparkListenerApplicationStart", "App Name": "jobs",
+         "App ID": "app-1"},
+        {"Event": "SparkListenerJobStart", "Job ID": 0,
+         "Submission Time": 0, "Stage IDs": [0, 1, 2, 3],
+         "Stage Infos": [{"Stage ID": 0}, {"Stage ID": 1, "Parent IDs": [0]},
+                         {"Stage ID": 2, "Parent IDs": [0]},
+                         {"Stage ID": 3, "Parent IDs": [1, 2]}],
+         "Properties": {"spark.jobGroup.id": run_id + ":A"}},
+        stage(0, 0, 1000),
+        task(0, 0, 1000),
+        stage(1, 1000, 2000 * slow, [0]),
+        task(1, 1000, 1100), task(1, 1000, 1100), task(1, 1000, 2000 * slow),
+        stage(2, 1000, 5000, [0]),
+        task(2, 1000, 5000, gc_time=1000, spilled=2048),
+        stage(3, 5000, 6000, [1, 2]),
+        task(3, 5000, 6000, failed=True),
+        {"Event": "SparkListenerJobEnd", "Job ID": 0,
+         "Completion Time": 6000, "Job Result": {"Result": "JobSucceeded"}},
+        {"Event": "SparkListenerJobStart", "Job ID": 1,
+         "Submission Time": 7000, "Stage IDs": [4],
+         "Stage Infos": [{"Stage ID": 4}],
+         "Properties": {"spark.jobGroup.id": run_id + ":B"}},
+        stage(4, 7000, 7000 + 1000 * slow),
+        {"Event": "SparkListenerJobEnd", "Job ID": 1,
+         "Completion Time": 7000 + 1000 * slow,
+         "Job Result": {"Result": "JobSucceeded"}},
+    ]
+
+
+class EventLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.log_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.log_dir.cleanup()
+
+    def write(self, name, events, compress=False):
+        path = os.path.join(self.log_dir.name, name)
+        with (gzip.open(path, "wt") if compress else open(path, "w")) as f_:
+            for event in events:
+                f_.write(json.dumps(event) + "\n")
+        return path
+
+    def test_report(self):
+        reports = job_reports(parse_events(run_events("r1")))
+        self.assertEqual(list(reports), ["r1:A", "r1:B"])
+        report = reports["r1:A"]
+        self.assertEqual((report["run_id"], report["job"]), ("r1", "A"))
+        self.assertEqual(report["wall_time"], 6.0)
+        self.assertEqual(report["critical_path"], 6.0)
+        self.assertEqual(report["critical_stages"], [0, 2, 3])
+        self.assertEqual((report["tasks"], report["failed_tasks"]), (6, 1))
+        self.assertEqual(report["shuffle_read_bytes"], 900)
+        self.assertEqual(report["disk_spilled"], 2048)
+        self.assertEqual(report["gc_time"], 1.0)
+        self.assertEqual(report["skew"]["stage"], 1)
+        self.assertEqual(report["skew"]["max_median_ratio"], 10.0)
+        self.assertEqual(reports["r1:B"]["wall_time"], 1.0)
+        self.assertIsNone(reports["r1:B"]["skew"])
+
+    def test_runs(self):
+        events = run_events("r1")[1:] + [
+            dict(event, **{"Job ID": event["Job ID"] + 2})
+            for event in run_events("r2")[1:]
+            if event["Event"].startswith("SparkListenerJob")]
+        for event in events:
+            if "Properties" in event and event["Job ID"] > 1:
+                event["Properties"] = {"spark.jobGroup.id": "r2:A"}
+        reports = job_reports(parse_events(events), "r2")
+        self.assertEqual(list(reports), ["r2:A"])
+        self.assertEqual(list(job_reports(parse_events([
+            dict(run_events("r1")[1], Properties={})]))), ["(ungrouped)"])
+
+    def test_run_as_given(self):
+        self.assertEqual(safe_run_id("2020-01-01T00:00"), "2020_01_01T00_00")
+        self.assertIsNone(safe_run_id(None))
+        # Jobs sanitize the run id of their groups, the report takes either
+        reports = job_reports(parse_events(run_events("2020_01_01T00_00")),
+                              "2020-01-01T00:00")
+        self.assertEqual(list(reports),
+                         ["2020_01_01T00_00:A", "2020_01_01T00_00:B"])
+
+    def test_compare(self):
+        base = job_reports(parse_events(run_events("r1")))
+        head = job_reports(parse_events(run_events("r2", slow=3)))
+        compared = compare_runs(base, head)
+        self.assertEqual(compared["regressed"], ["B"])
+        self.assertEqual(compared["jobs"]["B"]["wall_time"]["change"], 2.0)
+        self.assertEqual(compared["jobs"]["A"]["wall_time"]["change"], 0.0)
+        del head["r2:B"]
+        self.assertEqual(compare_runs(base, head)["removed"], ["B"])
+
+    def test_compare_several_runs(self):
+        both = job_reports(parse_events(run_events("r1")))
+        both.update(job_reports(parse_events(run_events("r2", slow=3))))
+        with self.assertRaisesRegex(ValueError, "r1:A, r2:A"):
+            compare_runs(both, both)
+        self.assertTrue(report_text(both).endswith(LAZY_NOTE))
+
+    def test_read(self):
+        rolling = os.path.join(self.log_dir.name, "eventlog_v2_app-1")
+        os.mkdir(rolling)
+        events = run_events("r1")
+        self.write("eventlog_v2_app-1/events_10_app-1", events[10:])
+        self.write("eventlog_v2_app-1/events_2_app-1", events[:10])
+        self.assertEqual(list(read_events(rolling)), events)
+        path = self.write("app-1.gz", events, compress=True)
+        self.assertEqual(list(read_events(path)), events)
+        with self.assertRaises(ValueError):
+            list(read_events(os.path.join(self.log_dir.name, "app.lz4")))
+
+    def test_main(self):
+        base = self.write("base", run_events("r1"))
+        head = self.write("head", run_events("r2", slow=3))
+        self.assertEqual(main([base]), 0)
+        self.assertEqual(main([base, base]), 0)
+        self.assertEqual(main([base, head, "--json"]), 1)
+        self.assertEqual(main([base, head, "--threshold", "5"]), 0)
+        self.assertEqual(main([base, "--base-run", "r1", "--head-run", "r2"]),
+                         2)
+        events = run_events("r1") + [
+            dict(event, **{"Job ID": event["Job ID"] + 2})
+            if "Job ID" in event else event
+            for event in run_events("r2", slow=3)[1:]]
+        both = self.write("both", events)
+        self.assertEqual(main([both, both]), 2)
+        self.assertEqual(main([both, "--base-run", "r1", "--head-run", "r2"]),
+                         1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+"""Testing data quality checks"""
+import unittest
+from unittest.mock import MagicMock, patch
+
+import pandas as pd
+
+from jobs.core.expectations import (
+    ExpectationError, check_expectation, evaluate, pandas_stats)
+from jobs.core.local import LocalCatalog
+from jobs.jobs.common import SparkSQL
+from jobs.jobs.process import GetTrainingData
+
+
+EXPECTATIONS = [
+    {"type": "row_count", "min": 1},
+    {"type": "not_null", "column": "amount", "max_fraction": 0.25},
+    {"type": "range", "column": "amount", "min": 0, "max": 100},
+    {"type": "allowed_values", "column": "grade", "values": ["A", "B"],
+     "policy": "warn"},
+    {"type": "unique", "columns": ["id"], "name": "unique id"}
+]
+
+Checked = type("Checked", (SparkSQL,), {"_execute": lambda self: ""})
+
+
+class ExpectationsTest(unittest.TestCase):
+
+    def setUp(self):
+        LocalCatalog._instance = None
+        self.pdf = pd.DataFrame({
+            "id": [1, 2, 2, None],
+            "amount": [10.0, None, 150.0, 20.0],
+            "grade": ["A", "C", None, "B"]})
+
+    def tearDown(self):
+        LocalCatalog._instance = None
+
+    def test_invalid(self):
+        for expectation in ({"type": "fuzzy"},
+                            {"type": "allowed_values", "column": "a"},
+                            {"type": "row_count", "policy": "ignore"}):
+            with self.assertRaises(ValueError):
+                check_expectation(expectation)
+
+    def test_pandas_evaluate(self):
+        report = evaluate(EXPECTATIONS, pandas_stats(self.pdf, EXPECTATIONS))
+        self.assertFalse(report["passed"])
+        self.assertEqual(report["failed"], ["range(amount)", "unique id"])
+        self.assertEqual(report["warned"], ["allowed_values(grade)"])
+        self.assertEqual(report["observed"]["range(amount)"], {
+            "failed": 1, "fraction": 0.25, "min": 10.0, "max": 150.0})
+        self.assertEqual(report["observed"]["unique id"]["failed"], 1)
+        self.assertEqual(report["observed"]["not_null(amount)"]["failed"], 1)
+
+    def test_empty(self):
+        report = evaluate(EXPECTATIONS[:3],
+                          pandas_stats(self.pdf.iloc[:0], EXPECTATIONS[:3]))
+        self.assertEqual(report["failed"], ["row_count()"])
+        self.assertIsNone(report["observed"]["range(amount)"]["min"])
+
+    def test_configured(self):
+        self.assertEqual(
+            GetTrainingData(None).expectations()[1]["column"], "loan_status")
+        self.assertEqual(GetTrainingData(None, expectations=False)
+                         .expectations(), [])
+        self.assertEqual(Checked(None).expectations(), [])
+
+    def test_local_output(self):
+        job = Checked(None, expectations=EXPECTATIONS[3:4])
+        LocalCatalog().register(job.temp_table, self.pdf)
+        with self.assertLogs('jobs.jobs.common', level='WARNING'):
+            job.side_effect()
+        self.assertEqual(job.metrics["expectations"]["warned"],
+                         ["allowed_values(grade)"])
+
+        job = Checked(None, expectations=EXPECTATIONS)
+        with self.assertRaises(ExpectationError):
+            job.side_effect()
+        self.assertFalse(job.metrics["expectations"]["passed"])
+
+    @patch('jobs.jobs.common.spark_aggs')
+    @patch('jobs.jobs.common.SparkSQL.df_from_temp_table')
+    @patch('jobs.jobs.common.SparkSQL.has_output', return_value=True)
+    def test_spark_output(self, _, df_mock, aggs_mock):
+        df_mock.return_value.agg.return_value.first.return_value = MagicMock(
+            asDict=MagicMock(return_value={"_rows": 10, "e0_failed": 0}))
+        expectations = [{"type": "not_null", "column": "amount"}]
+        job = Checked(None, expectations=expectations)
+        job.side_effect()
+        # All checks in one aggregation
+        df_mock.return_value.agg.assert_called_once_with(
+            *aggs_mock.return_value)
+        aggs_mock.assert_called_once_with(expectations)
+        self.assertTrue(job.metrics["expectations"]["passed"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+"""Testing the feature store"""
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+import pandas as pd
+
+from jobs.core.features import FeatureStore
+from jobs.jobs.train import BenchmarkModel
+
+
+class FeatureStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.store = FeatureStore(self.tmp_dir.name)
+        self.pdf = pd.DataFrame({"a": [1, 2], "b": [0.5, 1.5]})
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def files(self, date):
+        return os.listdir(self.store.partition_dir("features", date))
+
+    def test_overwrite_append(self):
+        entry = self.store.write_pandas(self.pdf, "features", "2020-01-01")
+        self.assertEqual(entry["rows"], 2)
+        self.assertEqual(entry["schema"], [["a", "bigint"], ["b", "double"]])
+        self.store.write_pandas(self.pdf, "features", "2020-01-01")
+        self.assertEqual(len(self.files("2020-01-01")), 1)
+
+        entry = self.store.write_pandas(
+            self.pdf, "features", "2020-01-01", mode="append")
+        self.assertEqual(entry["rows"], 4)
+        self.assertEqual(len(self.files("2020-01-01")), 2)
+        self.assertEqual(len(pd.read_parquet(
+            self.store.partition_dir("features", "2020-01-01"))), 4)
+        # No staging directories left behind
+        self.assertEqual(sorted(os.listdir(self.store.table_dir("features"))),
+                         ["date=2020-01-01", "manifest.json"])
+
+    def test_invalid_writes(self):
+        self.store.write_pandas(self.pdf, "features", "2020-01-01")
+        with self.assertRaises(ValueError):
+            self.store.write_pandas(self.pdf[["a"]], "features",
+                                    "2020-01-01", mode="append")
+        with self.assertRaises(ValueError):
+            self.store.write_pandas(self.pdf, "features", "2020-01-01",
+                                    mode="merge")
+        with self.assertRaises(ValueError):
+            self.store.write_pandas(self.pdf, "features", "../2020")
+        with self.assertRaises(ValueError):
+            self.store.write_pandas(self.pdf.assign(date=1), "features",
+                                    "2020-01-02")
+        self.assertEqual(self.store.dates("features"), ["2020-01-01"])
+        self.assertEqual(self.files("2020-01-01")[0][-8:], ".parquet")
+
+    def test_write_spark(self):
+        df = MagicMock(dtypes=[("a", "int")])
+        df.write.parquet.side_effect = lambda path: os.makedirs(path) or \
+            open(os.path.join(path, "part-0.parquet"), "w").close()
+        self.store.write_spark(df, "features", "2020-01-01", 10)
+        entry = self.store.write_spark(
+            df, "features", "2020-01-01", 5, mode="append")
+        self.assertEqual(entry["rows"], 15)
+        # Same file names from both writes, the first is replaced
+        self.assertEqual(self.files("2020-01-01"), ["part-0.parquet"])
+
+    def test_read_range(self):
+        for date in ("2020-01-01", "2020-01-02", "2020-01-03"):
+            self.store.write_pandas(self.pdf, "features", date)
+        self.assertEqual(self.store.dates("features", "2020-01-02"),
+                         ["2020-01-02", "2020-01-03"])
+        reader = MagicMock()
+        self.store.read(reader, "features", end="2020-01-02")
+        reader.option.assert_called_once_with(
+            "basePath", self.store.table_dir("features"))
+        reader.option().parquet.assert_called_once_with(
+            self.store.partition_dir("features", "2020-01-01"),
+            self.store.partition_dir("features", "2020-01-02"))
+        with self.assertRaises(ValueError):
+            self.store.read(reader, "features", "2021-01-01")
+
+    def test_read_merge_schema(self):
+        self.store.write_pandas(self.pdf, "features", "2020-01-01")
+        self.store.write_pandas(self.pdf[["a"]], "features", "2020-01-02")
+        reader = MagicMock()
+        self.store.read(reader, "features")
+        reader.option.assert_called_once_with("mergeSchema", "true")
+
+
+class BenchmarkFeaturesTest(unittest.TestCase):
+
+    def test_reads_feature_store(self):
+        self.assertFalse(BenchmarkModel(
+            None, previous_job_temp_table="t").reads_feature_store())
+        self.assertFalse(BenchmarkModel(
+            None, previous_job_temp_table="t",
+            start_date="2020-01-01").reads_feature_store())
+        self.assertFalse(BenchmarkModel(
+            None, feature_store_dir="s", previous_job_temp_table="t")
+            .reads_feature_store())
+        self.assertTrue(BenchmarkModel(
+            None, feature_store_dir="s", previous_job_temp_table="t",
+            start_date="2020-01-01").reads_feature_store())
+        self.assertTrue(BenchmarkModel(None, feature_store_dir="s")
+                        .reads_feature_store())
+
+    @patch('jobs.jobs.common.SparkSQL.get_sql_context')
+    def test_load_training_data(self, context_mock):
+        with tempfile.TemporaryDirectory() as root_dir:
+            store = FeatureStore(root_dir)
+            pdf = pd.DataFrame({"a": [1]})
+            for date in ("2020-01-01", "2020-01-02"):
+                store.write_pandas(pdf, "training_data", date)
+            job = BenchmarkModel(None, feature_store_dir=root_dir,
+                                 start_date="2020-01-02")
+            df = job.load_training_data()
+            stored = context_mock.return_value.read.option.return_value \
+                .parquet.return_value
+            self.assertIs(df, stored.drop.return_value)
+            stored.drop.assert_called_once_with("date")
+            self.assertEqual(job.metrics["feature_dates"], ["2020-01-02"])
+            self.assertEqual(job.memo_inputs()[0][:2], ["2020-01-02", 1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+"""Testing the spark job base"""
+import unittest
+from unittest.mock import MagicMock, patch
+
+import pandas as pd
+import pyarrow as pa
+
+from jobs.core.util import to_bytes
+from jobs.jobs.common import SparkSQL, DriverMemoryError
+
+
+class SparkSQLTest(unittest.TestCase):
+
+    def setUp(self):
+        A = type("A", (SparkSQL,), {"_execute": lambda self: ""})
+        self.job = A(MagicMock())
+        self.df = MagicMock(columns=["a", "b"])
+        self.batches = [
+            pa.RecordBatch.from_pydict({"a": [2], "b": ["2"]}),
+            pa.RecordBatch.from_pydict({"a": [0, 1], "b": ["0", "1"]})]
+
+    def test_to_bytes(self):
+        self.assertEqual(to_bytes(10), 10)
+        self.assertEqual(to_bytes("2k"), 2048)
+        self.assertEqual(to_bytes("512m"), 512 * 1024 ** 2)
+        self.assertEqual(to_bytes("1.5G"), int(1.5 * 1024 ** 3))
+        with self.assertRaises(ValueError):
+            to_bytes("lots")
+
+    @patch('jobs.jobs.common.SparkSQL.arrow_stream')
+    def test_arrow_transfer(self, stream_mock):
+        # Batches arrive out of partition order
+        stream_mock.return_value = iter(self.batches + [[1, 0]])
+        pdf = self.job.to_pandas(self.df)
+        self.assertEqual(pdf["a"].tolist(), [0, 1, 2])
+        self.assertEqual(list(pdf.columns), ["a", "b"])
+        self.df.toPandas.assert_not_called()
+
+    @patch('jobs.jobs.common.SparkSQL.arrow_stream')
+    def test_over_budget(self, stream_mock):
+        received = []
+
+        def stream(_):
+            for batch in self.batches + [[1, 0]]:
+                received.append(batch)
+                yield batch
+        stream_mock.side_effect = stream
+        with self.assertRaises(DriverMemoryError):
+            self.job.to_pandas(
+                self.df, max_bytes=self.batches[0].nbytes + 1)
+        # Stops at the first batch over the budget, in a single pass
+        self.assertEqual(received, self.batches)
+        stream_mock.assert_called_once_with(self.df)
+
+    @patch('jobs.jobs.common.SparkSQL.arrow_stream')
+    def test_empty_transfer(self, stream_mock):
+        stream_mock.return_value = iter([[]])
+        self.df.limit.return_value.toPandas.return_value = pd.DataFrame(
+            {"a": [], "b": []})
+        pdf = self.job.to_pandas(self.df)
+        self.assertEqual(list(pdf.columns), ["a", "b"])
+        self.df.limit.assert_called_once_with(0)
+
+    @patch('jobs.jobs.common.SparkSQL.partition_sizes')
+    def test_partition_stats(self, sizes_mock):
+        sizes_mock.return_value = [(10, 100), (10, 100), (100, 1000)]
+        with self.assertLogs('jobs.jobs.common', level='WARNING'):
+            stats = self.job.partition_stats(self.df, warn_ratio=5.0)
+        self.assertTrue(stats["skewed"])
+        self.assertEqual(stats["rows"], [10, 10, 100])
+        self.assertEqual(stats["bytes"], [100, 100, 1000])
+        self.assertEqual(stats["max_median_ratio"], 10.0)
+
+    def test_side_effect_disabled(self):
+        self.job.side_effect()
+        self.assertNotIn("partition_skew", self.job.metrics)
+        self.job.spark_context.assert_not_called()
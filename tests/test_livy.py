@@ -0,0 +1,99 @@
+"""Testing Livy batch submission against a fake server"""
+from itertools import count
+import json
+import os
+import sys
+import unittest
+from unittest.mock import patch
+
+from fake_livy import FakeLivy
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(__file__), "..", "orchestration", "airflow", "contrib"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+import livy  # noqa: E402 pylint:disable=wrong-import-position
+import main  # noqa: E402 pylint:disable=wrong-import-position
+
+
+def result_line(result):
+    return livy.RESULT_MARKER + json.dumps(result)
+
+
+@patch('livy.time.sleep')
+class LivyBatchTest(unittest.TestCase):
+
+    def run_batch(self, fake, **kwargs):
+        with fake, patch('livy.LIVY_HOST', fake.url):
+            return livy.execute_batch_output(
+                "benchmark", run_id="2020-01-01", size="small",
+                filename="loan.csv", **kwargs)
+
+    def test_success(self, sleep_mock):
+        fake = FakeLivy(polls=3, log_lines=[
+            "spark-submit ...",
+            result_line({"status": "success", "results": [{"job": "A"}]})])
+        self.assertEqual(self.run_batch(fake), [{"job": "A"}])
+
+        _, path, body = fake.requests[0]
+        self.assertEqual(path, "/batches")
+        self.assertEqual(body["file"], livy.JOBS_DRIVER)
+        self.assertEqual(body["pyFiles"], [livy.JOBS_PACKAGE])
+        self.assertEqual(body["numExecutors"], 2)
+        self.assertRegex(body["name"], r"^benchmark-2020-01-01-\w{8}$")
+        args = main.parse_args(body["args"])
+        self.assertEqual(args.pipeline, "benchmark")
+        self.assertEqual(args.run_id, "2020-01-01")
+        self.assertEqual(json.loads(args.kwargs), {"filename": "loan.csv"})
+        # Back-off between polls
+        self.assertEqual(
+            [call[0][0] for call in sleep_mock.call_args_list],
+            [1.0, 2.0, 4.0, 8.0])
+
+    def test_failed_pipeline(self, _):
+        fake = FakeLivy(final_state="dead", polls=0, log_lines=[
+            result_line({"status": "failed", "error": "KeyError('x')"})])
+        with self.assertRaisesRegex(livy.SparkAppError, "KeyError"):
+            self.run_batch(fake)
+
+    def test_dead_without_result(self, _):
+        fake = FakeLivy(final_state="dead", polls=0, log_lines=["OOM"])
+        with self.assertRaisesRegex(livy.SparkAppError, "OOM"):
+            self.run_batch(fake)
+
+    def test_timeout_kills_batch(self, _):
+        fake = FakeLivy(polls=100)
+        with patch('livy.time.time', side_effect=count(0, 10)):
+            with self.assertRaises(livy.SparkAppError):
+                self.run_batch(fake, timeout=5)
+        self.assertEqual(fake.requests[-1][0], "DELETE")
+        self.assertEqual(fake.batches[0]["state"], "killed")
+
+
+class DriverTest(unittest.TestCase):
+
+    def test_pipeline_arg(self):
+        self.assertEqual(main.pipeline_arg("benchmark"), "benchmark")
+        self.assertEqual(main.pipeline_arg("LoadCSV, GetTrainingData"),
+                         ["LoadCSV", "GetTrainingData"])
+
+    @patch('jobs.core.session.SessionManager')
+    @patch('jobs.jobs.pipeline.run_pipeline')
+    def test_main(self, run_mock, _):
+        run_mock.return_value = [{"job": "LoadCSV", "result": "t"}]
+        with patch('builtins.print') as print_mock:
+            self.assertEqual(main.main([
+                "--pipeline", "clean", "--run-id", "2020-01-01T00:00",
+                "--kwargs", '{"filename": "loan.csv"}',
+                "--job-kwargs", '{"LoadCSV": {"header": true}}']), 0)
+        # The run id of the job groups and tables
+        self.assertEqual(run_mock.call_args[0][1:],
+                         ("clean", "2020_01_01T00_00"))
+        self.assertEqual(run_mock.call_args[1], {
+            "filename": "loan.csv", "job_kwargs": {"LoadCSV": {"header": True}}
+        })
+        output = print_mock.call_args[0][0]
+        self.assertTrue(output.startswith(main.RESULT_MARKER))
+
+        run_mock.side_effect = ValueError("boom")
+        with patch('builtins.print'), patch('traceback.print_exc'):
+            self.assertEqual(main.main(["--pipeline", "clean"]), 1)
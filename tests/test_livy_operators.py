@@ -0,0 +1,142 @@
+"""Testing the Livy operators and sensors
+
+Without Airflow, the few Airflow classes the operators use are stubbed
+"""
+from abc import ABCMeta
+import importlib.util
+import os
+import sys
+import types
+import unittest
+from unittest.mock import MagicMock, patch
+
+from fake_livy import FakeLivy
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(__file__), "..", "orchestration", "airflow", "contrib"))
+
+
+def stub_airflow():
+    """Minimal `airflow` modules, operators as in Airflow 2"""
+    # pylint:disable=too-few-public-methods
+
+    class AirflowException(Exception):
+        """Stub of `airflow.exceptions.AirflowException`"""
+
+    class BaseOperator(metaclass=ABCMeta):
+        """Stub of `airflow.models.BaseOperator`"""
+
+        def __init__(self, task_id, **kwargs):
+            self.task_id = task_id
+            for key, value in kwargs.items():
+                setattr(self, key, value)
+
+    class BaseSensorOperator(BaseOperator):
+        """Stub of `airflow.sensors.base.BaseSensorOperator`"""
+
+        def __init__(self, mode="poke", poke_interval=60, **kwargs):
+            super().__init__(**kwargs)
+            self.mode = mode
+            self.poke_interval = poke_interval
+
+    modules = {
+        "airflow": {},
+        "airflow.exceptions": {"AirflowException": AirflowException},
+        "airflow.models": {"BaseOperator": BaseOperator},
+        "airflow.sensors": {},
+        "airflow.sensors.base": {"BaseSensorOperator": BaseSensorOperator}
+    }
+    for name, attrs in modules.items():
+        module = types.ModuleType(name)
+        module.__dict__.update(attrs)
+        sys.modules[name] = module
+
+
+if importlib.util.find_spec("airflow") is None:
+    stub_airflow()
+
+# pylint:disable=wrong-import-position
+from airflow.exceptions import AirflowException  # noqa: E402
+import livy  # noqa: E402
+from livy_operators import (  # noqa: E402
+    LivyBatchOperator, LivyBatchSensor, LivySensor, LivySessionSensor,
+    LivyStatementSensor)
+
+
+def task_context():
+    xcoms = {}
+    ti = MagicMock()
+    ti.xcom_push.side_effect = \
+        lambda key, value: xcoms.__setitem__(key, value)
+    ti.xcom_pull.side_effect = lambda key, task_ids: xcoms[key]
+    return {"ti": ti}
+
+
+class LivyBatchSensorTest(unittest.TestCase):
+
+    def test_submit_and_sense(self):
+        submit = LivyBatchOperator(
+            task_id="benchmark", pipeline="benchmark", run_id="r1")
+        sensor = LivyBatchSensor(
+            task_id="benchmark_done", submit_task_id="benchmark")
+        self.assertEqual(sensor.mode, "reschedule")
+
+        context = task_context()
+        fake = FakeLivy(final_state="dead", polls=1, log_lines=["OOM"])
+        with fake, patch('livy.LIVY_HOST', fake.url):
+            self.assertEqual(submit.execute(context), "/batches/0")
+            self.assertFalse(sensor.poke(context))
+            self.assertFalse(sensor.poke(context))
+            with self.assertRaisesRegex(AirflowException, "OOM"):
+                sensor.poke(context)
+        self.assertEqual(fake.batches[0]["body"]["file"], livy.JOBS_DRIVER)
+
+
+class LivySensorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.context = task_context()
+        self.context["ti"].xcom_push(key="statement_url", value="/s/0")
+        self.context["ti"].xcom_push(key="sess_url", value="/sessions/0")
+
+    def test_abstract(self):
+        with self.assertRaises(TypeError):
+            LivySensor(task_id="livy", submit_task_id="submit")
+
+    @patch('livy.check_statement')
+    def test_statement(self, check_mock):
+        sensor = LivyStatementSensor(
+            task_id="load_done", submit_task_id="load")
+        check_mock.return_value = {"state": "running"}
+        self.assertFalse(sensor.poke(self.context))
+        check_mock.return_value = {
+            "state": "available",
+            "output": {"status": "ok", "data": {"text/plain": "done"}}}
+        self.assertTrue(sensor.poke(self.context))
+        check_mock.assert_called_with("/s/0")
+
+        for state in ("error", "cancelling", "cancelled"):
+            check_mock.return_value = {"state": state}
+            with self.assertRaisesRegex(AirflowException, state):
+                sensor.poke(self.context)
+
+    @patch('livy.check_statement')
+    def test_statement_failed(self, check_mock):
+        sensor = LivyStatementSensor(
+            task_id="load_done", submit_task_id="load")
+        check_mock.return_value = {"state": "available", "output": {
+            "status": "error", "traceback": ["Traceback\n", "boom\n"]}}
+        with self.assertRaisesRegex(AirflowException, "boom"):
+            sensor.poke(self.context)
+
+    @patch('livy.check_job')
+    def test_session(self, check_mock):
+        sensor = LivySessionSensor(
+            task_id="session_ready", submit_task_id="init_session")
+        check_mock.return_value = "starting"
+        self.assertFalse(sensor.poke(self.context))
+        check_mock.return_value = "idle"
+        self.assertTrue(sensor.poke(self.context))
+        check_mock.return_value = "dead"
+        with self.assertRaises(AirflowException):
+            sensor.poke(self.context)
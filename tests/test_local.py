@@ -0,0 +1,226 @@
+"""Testing the local (pandas) engine"""
+import os
+import tempfile
+import unittest
+
+import pandas as pd
+
+from jobs.core.expectations import ExpectationError
+from jobs.core.local import LocalCatalog, local_size, read_csv_chunked
+from jobs.jobs.acquire import LoadCSV
+from jobs.jobs.process import (
+    CompactSchema, DropNullAndDuplicateRow, DropNullColumns, GetTrainingData,
+    SetTrainingData)
+
+
+CSV = """id,loan_amnt,int_rate,grade,term,loan_status,desc
+1,1000,10.5,A,36 months,Fully Paid,
+2,2000,11.5,B,60 months,Charged Off,
+3,1500,12.0,A,36 months,Current,
+4,1000,10.5,A,36 months,Fully Paid,
+5,,,,,Fully Paid,
+6,3000,9.5,C,36 months,Fully Paid,x
+"""
+
+
+class LocalTest(unittest.TestCase):
+
+    def setUp(self):
+        LocalCatalog._instance = None
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.csv = os.path.join(self.tmp_dir.name, "loans.csv")
+        with open(self.csv, "w") as f_csv:
+            f_csv.write(CSV)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+        LocalCatalog._instance = None
+
+
+class LocalCatalogTest(LocalTest):
+
+    def test_register_get_drop(self):
+        pdf = pd.DataFrame({"a": [1]})
+        LocalCatalog().register("t", pdf)
+        self.assertIn("t", LocalCatalog())
+        self.assertIs(LocalCatalog().get("t"), pdf)
+        LocalCatalog().drop("t")
+        LocalCatalog().drop("t")
+        with self.assertRaises(KeyError):
+            LocalCatalog().get("t")
+
+    def test_local_size(self):
+        self.assertEqual(local_size(self.csv), len(CSV))
+        self.assertEqual(local_size(self.tmp_dir.name), len(CSV))
+        self.assertIsNone(local_size("s3://bucket/loans.csv"))
+        self.assertIsNone(local_size(os.path.join(self.tmp_dir.name, "no")))
+
+    def test_read_csv_chunked(self):
+        pdf = read_csv_chunked(
+            self.csv, exclude=["id", "desc"],
+            row_filter=lambda chunk: chunk["loan_status"] != "Current",
+            chunk_rows=2)
+        self.assertEqual(list(pdf.columns), [
+            "loan_amnt", "int_rate", "grade", "term", "loan_status"])
+        self.assertEqual(len(pdf), 5)
+        self.assertEqual(list(pdf.index), list(range(5)))
+
+
+class EngineTest(LocalTest):
+
+    def test_default(self):
+        self.assertEqual(LoadCSV(None, filename=self.csv).engine(), "spark")
+        LocalCatalog().register("t", pd.DataFrame())
+        self.assertEqual(DropNullColumns(
+            None, previous_job_temp_table="t").engine(), "spark")
+
+    def test_auto(self):
+        self.assertEqual(LoadCSV(None, filename=self.csv, engine="auto")
+                         .engine(), "local")
+        self.assertEqual(LoadCSV(None, filename=self.csv, engine="auto",
+                                 local_max_bytes=10).engine(), "spark")
+        self.assertEqual(LoadCSV(None, filename="s3://b/loans.csv",
+                                 engine="auto").engine(), "spark")
+        self.assertEqual(LoadCSV(None, filename=self.csv, header=False,
+                                 engine="auto").engine(), "spark")
+
+    def test_previous_table(self):
+        job = DropNullColumns(
+            None, previous_job_temp_table="t", engine="auto")
+        self.assertEqual(job.engine(), "spark")
+        LocalCatalog().register("t", pd.DataFrame())
+        self.assertEqual(job.engine(), "local")
+        self.assertEqual(DropNullColumns(
+            None, previous_job_temp_table="t", engine="spark").engine(),
+            "spark")
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            LoadCSV(None, filename=self.csv, engine="dask").engine()
+
+
+class PipelineTest(LocalTest):
+
+    def run_job(self, job_class, **kwargs):
+        job = job_class(None, engine="auto", **kwargs)
+        result = job.execute()
+        self.assertEqual(job.metrics["engine"], "local")
+        return result, job.metrics
+
+    def test_clean(self):
+        table, metrics = self.run_job(
+            LoadCSV, filename=self.csv, pushdown_for="GetTrainingData")
+        self.assertEqual(metrics["num_records"], 5)
+        self.assertNotIn("id", metrics["num_columns"])
+
+        table, metrics = self.run_job(
+            GetTrainingData, previous_job_temp_table=table)
+        table, metrics = self.run_job(
+            DropNullAndDuplicateRow, previous_job_temp_table=table)
+        self.assertEqual(metrics["num_duplicates"], 1)
+        self.assertEqual(metrics["num_records"], 3)
+
+        table, metrics = self.run_job(
+            DropNullColumns, previous_job_temp_table=table, na_threshold="0.5")
+        self.assertEqual(metrics["columns_dropped"], 1)
+
+        table, metrics = self.run_job(
+            CompactSchema, previous_job_temp_table=table)
+        self.assertEqual(metrics["casts"], {
+            "loan_amnt": "double -> smallint",
+            "int_rate": "double -> float",
+            "grade": "string -> tinyint",
+            "term": "string -> tinyint"})
+        pdf = LocalCatalog().get(table)
+        self.assertEqual(pdf["grade"].tolist(), [0, 1, 2])
+        self.assertEqual(str(pdf["loan_amnt"].dtype), "Int16")
+        self.assertEqual(LocalCatalog().get_metadata(table)["grade"], {
+            "compact_cast": {"type": "string", "cast": "tinyint",
+                             "codes": ["A", "B", "C"]}})
+
+        table, metrics = self.run_job(
+            SetTrainingData, previous_job_temp_table=table)
+        pdf = LocalCatalog().get(table)
+        self.assertEqual(pdf["indexedloan_status"].tolist(), [0.0, 1.0, 0.0])
+        self.assertEqual(metrics["num_records"], 3)
+        self.assertEqual(metrics["num_columns"], len(pdf.columns))
+        # Casts stay with the columns for BenchmarkModel
+        self.assertIn("compact_cast",
+                      LocalCatalog().get_metadata(table)["term"])
+
+    def test_feature_store(self):
+        LocalCatalog().register("t", pd.DataFrame(
+            {"a": [1.0, 2.0], "loan_status": ["Fully Paid", "Charged Off"]}))
+        store_dir = os.path.join(self.tmp_dir.name, "features")
+        job = SetTrainingData(
+            None, previous_job_temp_table="t", engine="auto",
+            feature_store_dir=store_dir, date="2020-01-01")
+        job.execute()
+        # Written once the expectations are checked
+        self.assertNotIn("feature_store", job.metrics)
+        job.side_effect()
+        self.assertEqual(job.metrics["feature_store"]["rows"], 2)
+        stored = pd.read_parquet(os.path.join(
+            store_dir, "training_data", "date=2020-01-01"))
+        self.assertEqual(sorted(stored.columns), ["a", "loan_status"])
+
+    def test_feature_store_failed_expectations(self):
+        LocalCatalog().register("t", pd.DataFrame(
+            {"a": [1.0], "loan_status": [None]}, dtype="object"))
+        store_dir = os.path.join(self.tmp_dir.name, "features")
+        job = SetTrainingData(
+            None, previous_job_temp_table="t", engine="auto",
+            feature_store_dir=store_dir, date="2020-01-01")
+        job.execute()
+        with self.assertRaises(ExpectationError):
+            job.side_effect()
+        self.assertFalse(os.path.exists(store_dir))
+
+    def test_stale_table_key(self):
+        LocalCatalog().register("t", pd.DataFrame(
+            {"a": [1.0], "loan_status": ["Fully Paid"]}))
+        job = GetTrainingData(
+            None, previous_job_temp_table="t", engine="auto")
+        job.table_keys[job.temp_table] = "memoized"
+        job.execute()
+        self.assertNotIn(job.temp_table, job.table_keys)
+
+    def test_memo_metadata(self):
+        job = GetTrainingData(None, engine="auto")
+        job.local_output(pd.DataFrame({"a": [1.0]}), {"a": {"k": [1.0]}})
+        job.memo_save("key", job.temp_table, self.tmp_dir.name)
+        LocalCatalog().drop(job.temp_table)
+        job.memo_restore("key", job.temp_table, self.tmp_dir.name)
+        self.assertEqual(LocalCatalog().get_metadata(job.temp_table),
+                         {"a": {"k": [1.0]}})
+        job.table_keys.pop(job.temp_table)
+
+    def test_memoized_across_runs(self):
+        memo_dir = os.path.join(self.tmp_dir.name, "memo")
+        pdf = pd.DataFrame({"a": [1.0, 2.0], "b": [None, None]})
+        tables = []
+        for run_id in ("2020-01-01T00:00", "2020-01-02T00:00"):
+            table = "LoadCSV_{}_data".format(run_id)
+            LocalCatalog().register(table, pdf.copy())
+            job = DropNullColumns(
+                None, engine="auto", run_id=run_id,
+                previous_job_temp_table=table, memo_dir=memo_dir)
+            tables.append(job.execute_memoized(job.result_cache()))
+        self.assertTrue(job.metrics["memo"]["hit"])
+        # Each run reads its own table, restored for the second run
+        self.assertEqual(tables, [
+            "DropNullColumns_2020_01_01T00_00_data",
+            "DropNullColumns_2020_01_02T00_00_data"])
+        self.assertEqual(
+            list(LocalCatalog().get(tables[1]).columns), ["a"])
+        job.table_keys.clear()
+
+    def test_index_columns_local(self):
+        pdf = SetTrainingData.index_columns_local(pd.DataFrame(
+            {"a": ["y", "x", "y", None, "x", "z"]}), ["a"])
+        # Ties alphabetically, the null row is skipped
+        self.assertEqual(pdf["indexeda"].tolist(), [1.0, 0.0, 1.0, 0.0, 2.0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+"""Testing pipeline runs"""
+from threading import Barrier
+import unittest
+from unittest.mock import MagicMock
+
+from jobs.jobs.common import SparkSQL
+from jobs.jobs.pipeline import PipelineFanOut, pipeline_jobs, run_pipeline
+
+
+BARRIER = Barrier(2, timeout=5)
+
+
+def source_execute(job):
+    if job.kwargs.get("wait"):
+        BARRIER.wait()
+    job.metrics["file"] = job.kwargs["filename"]
+    return job.temp_table
+
+
+def sink_execute(job):
+    job.metrics["previous"] = job.kwargs["previous_job_temp_table"]
+    return job.temp_table
+
+
+FanSource = type("FanSource", (SparkSQL,), {"_execute": source_execute})
+FanSink = type("FanSink", (SparkSQL,), {"_execute": sink_execute})
+
+
+class PipelineTest(unittest.TestCase):
+
+    def test_named_pipeline(self):
+        self.assertEqual(pipeline_jobs("benchmark")[0], "LoadCSV")
+        self.assertEqual(pipeline_jobs(["A", "B"]), ["A", "B"])
+
+    def test_run_scoped_names(self):
+        job = FanSource(None, run_id="2020-01-01")
+        self.assertEqual(job.temp_table, "FanSource_2020_01_01_data")
+        self.assertEqual(job.job_group, "2020_01_01:FanSource")
+        job = FanSource(None)
+        self.assertEqual(job.temp_table, "FanSource_data")
+        self.assertEqual(job.job_group, "FanSource")
+
+    def test_run_pipeline(self):
+        spark_context = MagicMock()
+        results = run_pipeline(
+            spark_context, ["FanSource", "FanSink"], "r1", filename="f.csv")
+        self.assertEqual(results[0]["metrics"]["file"], "f.csv")
+        self.assertEqual(
+            results[1]["metrics"]["previous"], "FanSource_r1_data")
+        self.assertEqual(results[1]["result"], "FanSink_r1_data")
+        spark_context.setJobGroup.assert_called_with(
+            "r1:FanSink", unittest.mock.ANY)
+
+    def test_job_kwargs(self):
+        results = run_pipeline(
+            MagicMock(), ["FanSource", "FanSink"], filename="f.csv",
+            job_kwargs={"FanSource": {"filename": "g.csv"}})
+        self.assertEqual(results[0]["metrics"]["file"], "g.csv")
+
+    def test_fan_out(self):
+        spark_context = MagicMock()
+        fan_out = PipelineFanOut(
+            spark_context, ["FanSource", "FanSink"], max_workers=2)
+        outcomes = fan_out.run({
+            "a": {"filename": "a.csv", "wait": True},
+            "b": {"filename": "b.csv", "wait": True},
+            "c": {}
+        })
+        self.assertEqual(outcomes["a"]["status"], "success")
+        self.assertEqual(
+            outcomes["b"]["results"][1]["metrics"]["previous"],
+            "FanSource_b_data")
+        self.assertEqual(outcomes["c"]["status"], "failed")
+        spark_context.setLocalProperty.assert_any_call(
+            "spark.scheduler.pool", "pipeline_a")
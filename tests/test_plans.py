@@ -0,0 +1,94 @@
+"""Testing query plan capture and diffs"""
+import shutil
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+from jobs.core.plans import (
+    PlanStore, diff_plans, main, normalize_plan, plan_fingerprint)
+from jobs.jobs.common import SparkSQL
+
+
+BASE_PLAN = """AdaptiveSparkPlan isFinalPlan=false
++- *(2) HashAggregate(keys=[grade#12], functions=[count(1)])
+   +- Exchange hashpartitioning(grade#12, 200), ENSURE_REQUIREMENTS, [id=#31]
+      +- *(1) HashAggregate(keys=[grade#12], functions=[partial_count(1)])
+         +- FileScan parquet [grade#12] Batched: true"""
+
+HEAD_PLAN = """AdaptiveSparkPlan isFinalPlan=false
++- *(3) SortMergeJoin [grade#40], [grade#52], Inner
+   :- Exchange hashpartitioning(grade#40, 200), ENSURE_REQUIREMENTS, [id=#77]
+   :  +- FileScan parquet [grade#40] Batched: true
+   +- Exchange hashpartitioning(grade#52, 200), ENSURE_REQUIREMENTS, [id=#78]
+      +- FileScan csv [grade#52] Batched: false"""
+
+
+class PlansTest(unittest.TestCase):
+
+    def setUp(self):
+        self.plan_dir = tempfile.mkdtemp()
+        self.store = PlanStore(self.plan_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.plan_dir)
+
+    def test_normalize(self):
+        normalized = normalize_plan(BASE_PLAN)
+        self.assertNotIn("#", normalized)
+        self.assertNotIn("*(", normalized)
+        self.assertIn("Exchange hashpartitioning(grade, 200)", normalized)
+
+    def test_fingerprint(self):
+        renumbered = BASE_PLAN.replace("#12", "#99").replace("#31", "#5") \
+            .replace("*(2)", "*(7)")
+        self.assertEqual(
+            plan_fingerprint(BASE_PLAN), plan_fingerprint(renumbered))
+        self.assertNotEqual(
+            plan_fingerprint(BASE_PLAN), plan_fingerprint(HEAD_PLAN))
+
+    def test_diff(self):
+        base = self.store.save("A", "r1", "", BASE_PLAN)
+        head = self.store.save("A", "r2", "", HEAD_PLAN)
+        self.assertFalse(diff_plans(base, base)["changed"])
+        diff = diff_plans(base, head)
+        self.assertTrue(diff["changed"])
+        self.assertEqual(
+            diff["new_exchanges"], {"Exchange hashpartitioning": 1})
+        self.assertEqual(diff["new_scans"], {"FileScan csv": 1})
+        self.assertEqual(diff["removed"], {"HashAggregate": 2})
+        self.assertTrue(diff["join_strategy_changed"])
+
+    def test_store(self):
+        self.assertEqual(self.store.runs("A"), [])
+        self.store.save("A", "r1", "", BASE_PLAN)
+        self.store.save("A", "r2", "", HEAD_PLAN)
+        self.assertEqual(
+            [run["run_id"] for run in self.store.runs("A")], ["r1", "r2"])
+        self.assertEqual(self.store.get("A", "r1")["physical"], BASE_PLAN)
+
+    def test_main(self):
+        self.assertEqual(main([self.plan_dir, "A"]), 2)
+        self.store.save("A", "r1", "", BASE_PLAN)
+        self.store.save("A", "r2", "", BASE_PLAN.replace("#12", "#13"))
+        self.assertEqual(main([self.plan_dir, "A"]), 0)
+        self.store.save("A", "r3", "", HEAD_PLAN)
+        self.assertEqual(main([self.plan_dir, "A"]), 1)
+        self.assertEqual(
+            main([self.plan_dir, "A", "--base", "r3", "--head", "r1"]), 0)
+
+    def test_capture_plans(self):
+        job_class = type("A", (SparkSQL,), {"_execute": lambda self: ""})
+        df = MagicMock()
+        query_execution = df._jdf.queryExecution()
+        query_execution.optimizedPlan().toString.return_value = "Relation"
+        query_execution.executedPlan().toString.return_value = BASE_PLAN
+        job = job_class(MagicMock(), plan_dir=self.plan_dir, run_id="r1")
+        self.assertFalse(job.capture_plans(df)["changed"])
+
+        query_execution.executedPlan().toString.return_value = HEAD_PLAN
+        job = job_class(MagicMock(), plan_dir=self.plan_dir, run_id="r2")
+        with self.assertLogs('jobs.jobs.common', level='WARNING'):
+            plan = job.capture_plans(df)
+        self.assertTrue(plan["changed"])
+        self.assertEqual(plan["new_scans"], {"FileScan csv": 1})
+        self.assertEqual(plan["fingerprint"], plan_fingerprint(HEAD_PLAN))
@@ -0,0 +1,274 @@
+"""Testing processing jobs"""
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+import pandas as pd
+
+from jobs.core.local import LocalCatalog
+from jobs.jobs.process import (
+    CompactSchema, DropNullAndDuplicateRow, QuantileBinning, SetTrainingData)
+
+
+class DropNullAndDuplicateRowTest(unittest.TestCase):
+
+    def test_dedup_keys(self):
+        job = DropNullAndDuplicateRow(None, dedup_keys="member_id, issue_d")
+        self.assertEqual(job.dedup_keys(), ["member_id", "issue_d"])
+        job = DropNullAndDuplicateRow(None, dedup_keys=["member_id"])
+        self.assertEqual(job.dedup_keys(), ["member_id"])
+        self.assertEqual(DropNullAndDuplicateRow(None).dedup_keys(), [])
+
+    @patch('jobs.jobs.common.SparkSQL.df_from_temp_table')
+    def test_invalid_strategy(self, df_mock):
+        df_mock.return_value = MagicMock(columns=["a", "b"])
+        job = DropNullAndDuplicateRow(
+            None, previous_job_temp_table="t", dedup_strategy="fuzzy")
+        with self.assertRaises(ValueError):
+            job.execute()
+        job = DropNullAndDuplicateRow(
+            None, previous_job_temp_table="t", dedup_strategy="key")
+        with self.assertRaises(ValueError):
+            job.execute()
+
+    @patch('jobs.jobs.common.SparkSQL.df_from_temp_table')
+    def test_full_dedup_metrics(self, df_mock):
+        cached = df_mock.return_value.dropna.return_value.persist \
+            .return_value
+        cached.count.return_value = 10
+        deduped = cached.dropDuplicates.return_value.persist.return_value
+        deduped.count.return_value = 8
+        deduped.columns = ["a"]
+        job = DropNullAndDuplicateRow(None, previous_job_temp_table="t")
+        self.assertEqual(job.execute(), "DropNullAndDuplicateRow_data")
+        self.assertEqual(job.metrics["num_duplicates"], 2)
+        self.assertEqual(job.metrics["dedup_strategy"], "full")
+        # The input is read once for both counts, then released
+        cached.unpersist.assert_called_once_with()
+        deduped.createOrReplaceTempView.assert_called_once_with(
+            "DropNullAndDuplicateRow_data")
+
+    @patch('jobs.jobs.process.job.DropNullAndDuplicateRow'
+           '.drop_hash_duplicates')
+    @patch('jobs.jobs.common.SparkSQL.df_from_temp_table')
+    def test_hash_dedup_unpersist(self, _, dedup_mock):
+        deduped, hashed = MagicMock(), MagicMock()
+        deduped.persist.return_value.count.return_value = 8
+        dedup_mock.return_value = (deduped, 2, hashed)
+        job = DropNullAndDuplicateRow(
+            None, previous_job_temp_table="t", dedup_strategy="hash")
+        job.execute()
+        self.assertEqual(job.metrics["num_records"], 8)
+        hashed.unpersist.assert_called_once_with()
+        deduped.persist.return_value.createOrReplaceTempView \
+            .assert_called_once_with("DropNullAndDuplicateRow_data")
+
+
+class CompactSchemaTest(unittest.TestCase):
+
+    def test_smallest_int_type(self):
+        self.assertEqual(CompactSchema.smallest_int_type(0, 127), "tinyint")
+        self.assertEqual(
+            CompactSchema.smallest_int_type(-129, 0), "smallint")
+        self.assertEqual(CompactSchema.smallest_int_type(0, 40000), "int")
+        self.assertEqual(
+            CompactSchema.smallest_int_type(0, 2 ** 40), "bigint")
+        self.assertIsNone(CompactSchema.smallest_int_type(0, 2 ** 70))
+
+    def test_compact_type(self):
+        def compact(dtype, **profile):
+            return CompactSchema.compact_type(dtype, profile, 10)
+
+        self.assertEqual(
+            compact("double", min=500.0, max=30000.0, fractions=0),
+            "smallint")
+        self.assertEqual(
+            compact("double", min=5.3, max=30.9, fractions=12), "float")
+        self.assertEqual(compact("int", min=0, max=99), "tinyint")
+        self.assertIsNone(compact("tinyint", min=0, max=99))
+        self.assertIsNone(
+            compact("float", min=5.3, max=30.9, fractions=12))
+        self.assertIsNone(
+            compact("double", min=-1e300, max=1e300, fractions=1))
+        self.assertEqual(compact("string", distinct=3), "tinyint")
+        self.assertIsNone(compact("string", distinct=11))
+        self.assertIsNone(compact("timestamp", min=None, max=None))
+
+    def test_row_bytes(self):
+        profile = {"term": {"length": 9.0}}
+        self.assertEqual(CompactSchema.row_bytes(
+            [("term", "string"), ("loan_amnt", "double")], profile), 25.0)
+        self.assertEqual(CompactSchema.row_bytes(
+            [("term", "tinyint"), ("loan_amnt", "smallint")], profile), 3.0)
+
+    def test_saved_codes(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "codes.json")
+            job = CompactSchema(None, codes_path=path)
+            codes_mock = MagicMock(return_value={"term": ["36 months"]})
+            self.assertEqual(job.load_codes(["term"], codes_mock),
+                             {"term": ["36 months"]})
+            codes_mock.return_value = {"grade": ["B", "A"]}
+            self.assertEqual(job.load_codes(["term", "grade"], codes_mock), {
+                "term": ["36 months"], "grade": ["B", "A"]})
+            codes_mock.assert_called_with(["grade"])
+            with open(path) as f_codes:
+                self.assertEqual(sorted(json.load(f_codes)),
+                                 ["grade", "term"])
+
+    def test_continuous_kept(self):
+        dtypes = [("loan_amnt", "double"), ("annual_inc", "double")]
+        profile = {col_: {"min": 500.0, "max": 30000.0, "fractions": 0}
+                   for col_, _ in dtypes}
+        job = CompactSchema(None, binning_columns=["annual_inc"])
+        self.assertEqual(job.plan_casts(dtypes, profile),
+                         {"loan_amnt": ("double", "smallint")})
+
+    @patch('jobs.jobs.process.job.create_map')
+    @patch('jobs.jobs.process.job.lit', side_effect=lambda value: value)
+    @patch('jobs.jobs.process.job.col')
+    def test_compact(self, col_mock, _, map_mock):
+        casts = CompactSchema.column_casts(
+            {"grade": ("string", "tinyint"), "amnt": ("double", "smallint")},
+            {"grade": ["B", "A"]})
+        self.assertEqual(casts["grade"], {
+            "type": "string", "cast": "tinyint", "codes": ["B", "A"]})
+        df = MagicMock(columns=["grade", "amnt", "term"])
+        CompactSchema.compact(df, casts)
+        # Codes in the order saved, whatever the batch
+        map_mock.assert_called_once_with("B", 0, "A", 1)
+        map_mock.return_value.__getitem__.return_value.cast \
+            .return_value.alias.assert_called_once_with(
+                "grade", metadata={"compact_cast": casts["grade"]})
+        col_mock.return_value.cast.assert_called_once_with("smallint")
+        self.assertIs(CompactSchema.compact(df, {"other": {}}), df)
+
+    @patch('jobs.jobs.process.job.create_map')
+    @patch('jobs.jobs.process.job.lit', side_effect=lambda value: value)
+    @patch('jobs.jobs.process.job.col')
+    def test_uncompact(self, col_mock, _, map_mock):
+        df = MagicMock(columns=["grade", "amnt"])
+        df.schema.fields = [
+            MagicMock(metadata={"compact_cast": {
+                "type": "string", "cast": "tinyint", "codes": ["B", "A"]}}),
+            MagicMock(metadata={"compact_cast": {
+                "type": "double", "cast": "smallint"}})]
+        df.schema.fields[0].name = "grade"
+        df.schema.fields[1].name = "amnt"
+        CompactSchema.uncompact(df)
+        map_mock.assert_called_once_with(0, "B", 1, "A")
+        col_mock.return_value.cast.assert_called_once_with("double")
+
+
+class SetTrainingDataTest(unittest.TestCase):
+
+    @patch('jobs.jobs.common.SparkSQL.side_effect')
+    @patch('jobs.jobs.process.job.SetTrainingData.write_features')
+    def test_release_persisted(self, write_mock, _):
+        job = SetTrainingData(None, feature_store_dir="s")
+        persisted = job.persisted = MagicMock()
+        write_mock.side_effect = IOError()
+        # Released once written, or when the write fails
+        with self.assertRaises(IOError):
+            job.side_effect()
+        persisted.unpersist.assert_called_once_with()
+        self.assertIsNone(job.persisted)
+        write_mock.side_effect = None
+        job.side_effect()
+
+
+class QuantileBinningTest(unittest.TestCase):
+
+    def setUp(self):
+        LocalCatalog._instance = None
+
+    def tearDown(self):
+        LocalCatalog._instance = None
+
+    def test_binning_columns(self):
+        dtypes = [("int_rate", "float"), ("annual_inc", "double"),
+                  ("grade", "tinyint"), ("indexedterm", "double"),
+                  ("loan_status", "string")]
+        self.assertEqual(QuantileBinning(None).binning_columns(dtypes),
+                         ["int_rate", "annual_inc"])
+        self.assertEqual(QuantileBinning(None, binning_columns=["grade"])
+                         .binning_columns(dtypes), ["grade"])
+        self.assertEqual(QuantileBinning(None, num_buckets=4).probabilities,
+                         [0.25, 0.5, 0.75])
+
+    def test_fit_once(self):
+        df = MagicMock()
+        df.approxQuantile.return_value = [[1.0, 2.0, 2.0], []]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            job = QuantileBinning(
+                None, num_buckets=4, relative_error=0.01,
+                splits_path=os.path.join(tmp_dir, "splits.json"))
+            compute = MagicMock(
+                side_effect=lambda columns: job.fit_splits(df, columns))
+            for _ in range(2):
+                splits = job.load_fitted("splits_path", ["a", "b"], compute)
+            self.assertEqual(splits, {"a": [1.0, 2.0], "b": []})
+            # All columns in one pass, the second run reuses the splits
+            df.approxQuantile.assert_called_once_with(
+                ["a", "b"], [0.25, 0.5, 0.75], 0.01)
+
+    def test_bucketize_local(self):
+        pdf = pd.DataFrame({"a": [0.5, 1.0, 1.5, 3.0, np.inf, None],
+                            "b": [1.0] * 6})
+        binned = QuantileBinning.bucketize_local(
+            pdf, {"a": [1.0, 2.0], "b": []})
+        self.assertEqual(binned["a"].tolist(),
+                         [0.0, 1.0, 1.0, 2.0, 2.0, 3.0])
+        self.assertEqual(binned["b"].tolist(), [1.0] * 6)
+
+    def test_local(self):
+        LocalCatalog().register("t", pd.DataFrame({
+            "int_rate": np.arange(100, dtype="float32"),
+            "loan_status": ["Fully Paid"] * 100}))
+        job = QuantileBinning(
+            None, previous_job_temp_table="t", engine="auto")
+        table = job.execute()
+        self.assertEqual(job.metrics["engine"], "local")
+        self.assertEqual(job.metrics["binned_columns"], {"int_rate": 10})
+        binned = LocalCatalog().get(table)["int_rate"]
+        self.assertEqual(sorted(binned.unique()), list(range(10)))
+        self.assertEqual(
+            LocalCatalog().get_metadata(table)["int_rate"]
+            ["quantile_splits"], list(range(9, 90, 10)))
+        # The 10% quantile is 9, taken from the values like Spark
+        self.assertEqual(binned[:10].tolist(), [0.0] * 9 + [1.0])
+
+    @patch('jobs.jobs.process.job.lit')
+    @patch('jobs.jobs.process.job.when')
+    @patch('jobs.jobs.process.job.col')
+    @patch('jobs.jobs.process.job.Bucketizer')
+    def test_bucketize(self, bucketizer_mock, col_mock, when_mock, lit_mock):
+        df = MagicMock(columns=["a", "b", "c"])
+        binned = bucketizer_mock.return_value.transform.return_value
+        binned.schema = {
+            "a_bucket": MagicMock(metadata={"ml_attr": {}}),
+            "c_bucket": MagicMock(metadata={})}
+        QuantileBinning.bucketize(df, {"a": [1.0], "b": [], "c": [2.0]})
+        bucketizer_mock.assert_called_once_with(
+            splitsArray=[[-float("inf"), 1.0, float("inf")],
+                         [-float("inf"), 2.0, float("inf")]],
+            inputCols=["a", "c"], outputCols=["a_bucket", "c_bucket"],
+            handleInvalid="keep")
+        # Nulls are NaN before binning, so they go to the extra bucket
+        self.assertEqual(when_mock.call_count, 2)
+        self.assertTrue(np.isnan(lit_mock.call_args[0][0]))
+        col_mock.return_value.alias.assert_any_call("a", metadata={
+            "ml_attr": {}, "quantile_splits": [1.0]})
+        col_mock.return_value.alias.assert_any_call("c", metadata={
+            "quantile_splits": [2.0]})
+
+    def test_column_splits(self):
+        df = MagicMock()
+        df.schema.fields = [
+            MagicMock(metadata={"quantile_splits": [1.0]}),
+            MagicMock(metadata={})]
+        df.schema.fields[0].name = "a"
+        self.assertEqual(QuantileBinning.column_splits(df), {"a": [1.0]})
@@ -0,0 +1,94 @@
+"""Testing driver profiling"""
+import os
+import tempfile
+from time import sleep, time
+import unittest
+
+from jobs.core.base import BaseRegistry
+from jobs.core.profiling import CProfiler, Profiler, SamplingProfiler
+
+
+def busy(seconds):
+    end = time() + seconds
+    while time() < end:
+        pass
+    return "done"
+
+
+def slow_job():
+    sleep(0.02)
+    return busy(0.1)
+
+
+Profiled = type("Profiled", (BaseRegistry,), {
+    "_execute": lambda self: slow_job(),
+    "side_effect": lambda self: None})
+
+
+class ProfilingTest(unittest.TestCase):
+
+    def job(self, **kwargs):
+        job = Profiled()
+        job.kwargs = kwargs
+        job.metrics = {}
+        return job
+
+    def test_disabled(self):
+        job = self.job()
+        self.assertIsNone(job.profiler())
+        self.assertEqual([res for res in job.execute_extra()], ["done"])
+        self.assertNotIn("profile", job.metrics)
+        with self.assertRaises(ValueError):
+            self.job(profile="perf").profiler()
+
+    def test_abstract(self):
+        with self.assertRaises(TypeError):
+            Profiler()
+
+    def test_cprofile(self):
+        profiler = CProfiler(top=5)
+        with profiler.running():
+            slow_job()
+        hotspots = profiler.hotspots()
+        self.assertEqual(len(hotspots), 5)
+        self.assertIn("busy", [spot["function"].rsplit("(", 1)[1][:-1]
+                               for spot in hotspots])
+        self.assertEqual(hotspots, sorted(
+            hotspots, key=lambda spot: spot["self_time"], reverse=True))
+
+    def test_sampling(self):
+        profiler = SamplingProfiler(top=3, interval=0.001)
+        with profiler.running():
+            slow_job()
+        hotspots = profiler.hotspots()
+        self.assertGreater(profiler.samples, 10)
+        # Sleeping in a builtin is time spent in the caller
+        self.assertEqual(
+            sorted(spot["function"].rsplit("(", 1)[1]
+                   for spot in hotspots[:2]), ["busy)", "slow_job)"])
+        self.assertAlmostEqual(
+            sum(spot["total_time"] for spot in hotspots
+                if spot["function"].endswith("(slow_job)")),
+            profiler.duration, delta=0.02)
+        self.assertLessEqual(len(hotspots), 3)
+        self.assertTrue(all(0 < spot["fraction"] <= 1 for spot in hotspots))
+
+    def test_execute_extra(self):
+        with tempfile.TemporaryDirectory() as profile_dir:
+            for profile, extension in (("cprofile", ".prof"),
+                                       ("sampling", ".folded")):
+                job = self.job(profile=profile, profile_dir=profile_dir,
+                               profile_top=3, profile_interval=0.002)
+                self.assertEqual([res for res in job.execute_extra()],
+                                 ["done"])
+                summary = job.get_metrics()["profile"]
+                self.assertGreaterEqual(summary["duration"], 0.1)
+                self.assertLessEqual(len(summary["hotspots"]), 3)
+                self.assertTrue(summary["path"].endswith(extension))
+                self.assertEqual(os.path.dirname(summary["path"]),
+                                 os.path.join(profile_dir, "Profiled"))
+                self.assertTrue(os.path.getsize(summary["path"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
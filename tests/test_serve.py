@@ -0,0 +1,119 @@
+"""Testing serving jobs"""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from jobs.jobs.serve import ScoreLoans
+from jobs.jobs.train.store import ModelStore
+
+
+ENV = {
+    "TARGET_JDBC_URL": "jdbc:postgresql://hostfoo:5432/dbfoo",
+    "TARGET_JDBC_USER": "userfoo",
+    "TARGET_JDBC_PASSWORD": "password_foo"
+}
+
+
+class MockModel:
+
+    def save(self, path):
+        os.makedirs(path)
+
+
+class ScoreLoansTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root_dir = tempfile.mkdtemp()
+        store = ModelStore(self.root_dir)
+        for fingerprint in ("abc", "def"):
+            store.save("BenchmarkModel", MockModel(), fingerprint,
+                       ["loan_amnt", "indexedterm"], {}, {},
+                       {"feature_labels": {"term": ["36 months"]}})
+
+    def tearDown(self):
+        shutil.rmtree(self.root_dir)
+
+    def test_target_details(self):
+        with patch.dict(os.environ, ENV):
+            details = ScoreLoans.get_target_details()
+        self.assertEqual(details["url"], ENV["TARGET_JDBC_URL"])
+        self.assertEqual(details["user"], ENV["TARGET_JDBC_USER"])
+
+    @patch('jobs.jobs.serve.common.ModelStore.load')
+    def test_load_latest_model(self, load_mock):
+        job = ScoreLoans(None, model_store_dir=self.root_dir)
+        model, meta = job.load_model()
+        self.assertIs(model, load_mock.return_value)
+        self.assertEqual(meta["version"], 2)
+        self.assertEqual(load_mock.call_args[0][0]["version"], 2)
+        self.assertEqual(job.preprocessing(meta), (
+            ["loan_amnt", "indexedterm"], {"term": ["36 months"]}))
+
+    @patch('jobs.jobs.serve.common.PipelineModel.load')
+    def test_load_model_path(self, load_mock):
+        model_path = os.path.join(
+            self.root_dir, "BenchmarkModel", "v1", "model")
+        job = ScoreLoans(None, model_path=model_path + "/")
+        model, meta = job.load_model()
+        load_mock.assert_called_once_with(model_path)
+        self.assertEqual(meta["fingerprint"], "abc")
+        job = ScoreLoans(None, model_path=self.root_dir)
+        self.assertEqual(job.load_model()[1], {})
+
+    def test_preprocessing(self):
+        # No labels: the batch would be indexed with its own frequencies
+        with self.assertRaises(ValueError):
+            ScoreLoans.preprocessing({"features": ["indexedterm"]})
+        with self.assertRaises(ValueError):
+            ScoreLoans.preprocessing({
+                "features": ["loan_amnt", "indexedloan_status"],
+                "preprocessing": {"feature_labels": {}}})
+
+    @patch('jobs.jobs.serve.job.QuantileBinning.bucketize')
+    @patch('jobs.jobs.serve.job.QuantileBinning.column_splits')
+    @patch('jobs.jobs.common.SparkSQL.df_from_temp_table')
+    def test_load_source_binned(self, df_mock, binned_mock, bucketize_mock):
+        self.assertEqual(ScoreLoans.binning_splits({"preprocessing": {}}), {})
+        splits = ScoreLoans.binning_splits({"preprocessing": {"splits": {
+            "int_rate": [1.0], "annual_inc": [2.0]}}})
+        # Binned upstream already
+        binned_mock.return_value = {"int_rate": [1.0]}
+        job = ScoreLoans(None, previous_job_temp_table="t")
+        self.assertIs(job.load_source(splits), bucketize_mock.return_value)
+        bucketize_mock.assert_called_once_with(
+            df_mock.return_value, {"annual_inc": [2.0]})
+
+    @patch('jobs.jobs.serve.job.QuantileBinning.bucketize')
+    @patch('jobs.jobs.serve.job.CompactSchema')
+    @patch('jobs.jobs.common.SparkSQL.df_from_temp_table')
+    def test_load_source_cast(self, df_mock, compact_mock, bucketize_mock):
+        casts = ScoreLoans.compact_casts({"preprocessing": {"casts": {
+            "grade": {"type": "string", "cast": "tinyint",
+                      "codes": ["B", "A"]}}}})
+        job = ScoreLoans(None, previous_job_temp_table="t")
+        job.load_source({}, casts)
+        # Codes fitted on the batch are undone, the saved ones applied
+        compact_mock.uncompact.assert_called_once_with(df_mock.return_value)
+        compact_mock.compact.assert_called_once_with(
+            compact_mock.uncompact.return_value, casts)
+        self.assertIs(bucketize_mock.call_args[0][0],
+                      compact_mock.compact.return_value)
+
+    @patch('jobs.jobs.serve.common.ModelStore.load')
+    def test_load_model_version(self, load_mock):
+        job = ScoreLoans(
+            None, model_store_dir=self.root_dir, model_version=1)
+        job.load_model()
+        self.assertEqual(load_mock.call_args[0][0]["fingerprint"], "abc")
+
+    def test_load_model_missing(self):
+        job = ScoreLoans(
+            None, model_store_dir=self.root_dir, model_version=7)
+        with self.assertRaisesRegex(ValueError, "version 7 of model"):
+            job.load_model()
+        job = ScoreLoans(
+            None, model_store_dir=self.root_dir, model_name="Other")
+        with self.assertRaisesRegex(ValueError, "model Other"):
+            job.load_model()
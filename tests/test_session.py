@@ -0,0 +1,118 @@
+"""Testing the Spark session manager"""
+from threading import Event, Thread
+import unittest
+from unittest.mock import MagicMock
+
+from jobs.core.session import SessionManager
+from jobs.jobs.common import SparkSQL
+
+
+class SessionManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        SessionManager._instance = None
+        self.manager = SessionManager("default")
+        self.conf = {"spark.sql.shuffle.partitions": "200"}
+        runtime_conf = MagicMock()
+        runtime_conf.isModifiable.side_effect = \
+            lambda key: key.startswith("spark.sql.")
+        runtime_conf.get.side_effect = \
+            lambda key, default: self.conf.get(key, default)
+        runtime_conf.set.side_effect = self.conf.__setitem__
+        runtime_conf.unset.side_effect = self.conf.pop
+        self.manager._session = MagicMock(conf=runtime_conf)
+
+    def tearDown(self):
+        SessionManager._instance = None
+
+    def test_singleton(self):
+        self.assertIs(SessionManager("local"), self.manager)
+        self.assertEqual(SessionManager().profile, "default")
+
+    def test_profile_conf(self):
+        conf = self.manager.profile_conf()
+        self.assertEqual(conf["spark.sql.adaptive.enabled"], "true")
+        self.assertEqual(conf["spark.executor.memory"], "4g")
+        self.assertEqual(
+            conf["spark.sql.execution.arrow.pyspark.enabled"], "true")
+        self.assertEqual(conf["spark.scheduler.mode"], "FAIR")
+        self.assertEqual(
+            conf["spark.serializer"],
+            "org.apache.spark.serializer.KryoSerializer")
+        self.manager.profile = "huge"
+        with self.assertRaises(ValueError):
+            self.manager.profile_conf()
+
+    def test_hint_conf(self):
+        self.assertEqual(SessionManager.hint_conf({
+            "shuffle_partitions": 16,
+            "broadcast_threshold": "64m",
+            "conf": {"spark.sql.adaptive.enabled": "false"}
+        }), {
+            "spark.sql.shuffle.partitions": 16,
+            "spark.sql.autoBroadcastJoinThreshold": 64 * 1024 ** 2,
+            "spark.sql.adaptive.enabled": "false"
+        })
+
+    def test_configured_restores(self):
+        hints = {"shuffle_partitions": 16, "broadcast_threshold": -1,
+                 "conf": {"spark.executor.cores": "4"}}
+        with self.manager.configured(hints) as applied:
+            self.assertEqual(applied, {
+                "spark.sql.shuffle.partitions": "16",
+                "spark.sql.autoBroadcastJoinThreshold": "-1"})
+            self.assertEqual(self.conf["spark.sql.shuffle.partitions"], "16")
+        self.assertEqual(
+            self.conf, {"spark.sql.shuffle.partitions": "200"})
+
+    def test_overlapping_hints(self):
+        hints = {"shuffle_partitions": 16}
+        first, second = self.manager.configured(hints), \
+            self.manager.configured(hints)
+        first.__enter__()
+        second.__enter__()
+        # Released out of order, the setting stays while a job holds it
+        first.__exit__(None, None, None)
+        self.assertEqual(self.conf["spark.sql.shuffle.partitions"], "16")
+        second.__exit__(None, None, None)
+        self.assertEqual(self.conf["spark.sql.shuffle.partitions"], "200")
+
+    def test_conflicting_hints(self):
+        seen, started = [], Event()
+
+        def other_job():
+            started.set()
+            with self.manager.configured({"shuffle_partitions": 8}):
+                seen.append(self.conf["spark.sql.shuffle.partitions"])
+
+        with self.manager.configured({"shuffle_partitions": 16}):
+            thread = Thread(target=other_job)
+            thread.start()
+            started.wait()
+            thread.join(0.2)
+            # Waits for the running job to release its setting
+            self.assertTrue(thread.is_alive())
+            self.assertEqual(self.conf["spark.sql.shuffle.partitions"], "16")
+        thread.join()
+        self.assertEqual(seen, ["8"])
+        self.assertEqual(self.conf["spark.sql.shuffle.partitions"], "200")
+
+    def test_memory_class(self):
+        self.assertTrue(self.manager.check_memory_class("small", "A"))
+        self.assertTrue(self.manager.check_memory_class(None, "A"))
+        with self.assertLogs('jobs.core.session', level='WARNING'):
+            self.assertFalse(self.manager.check_memory_class("large", "A"))
+
+    def test_job_hints(self):
+        job_class = type("A", (SparkSQL,), {
+            "_execute": lambda job: self.conf[
+                "spark.sql.shuffle.partitions"],
+            "spark_hints": {"shuffle_partitions": 8}
+        })
+        job = job_class(MagicMock())
+        self.assertEqual(job.execute(), "8")
+        self.assertEqual(job.metrics["spark_conf"],
+                         {"spark.sql.shuffle.partitions": "8"})
+        job = job_class(MagicMock(), spark_hints={"shuffle_partitions": 4})
+        self.assertEqual(job.execute(), "4")
+        self.assertEqual(self.conf["spark.sql.shuffle.partitions"], "200")
@@ -0,0 +1,30 @@
+"""Testing summary statistics"""
+import unittest
+
+from jobs.core.stats import gini, histogram, median, skew_stats
+
+
+class StatsTest(unittest.TestCase):
+
+    def test_median(self):
+        self.assertEqual(median([]), 0.0)
+        self.assertEqual(median([3, 1, 2]), 2.0)
+        self.assertEqual(median([4, 1, 2, 3]), 2.5)
+
+    def test_gini(self):
+        self.assertEqual(gini([]), 0.0)
+        self.assertAlmostEqual(gini([5, 5, 5, 5]), 0.0)
+        self.assertAlmostEqual(gini([0, 0, 0, 10]), 0.75)
+
+    def test_histogram(self):
+        hist = histogram([0, 1, 2, 10], bins=2)
+        self.assertEqual(hist["counts"], [3, 1])
+        self.assertEqual(hist["edges"], [0, 5.0, 10.0])
+        self.assertEqual(histogram([3, 3], bins=2)["counts"], [2, 0])
+
+    def test_skew_stats(self):
+        stats = skew_stats([10, 10, 10, 100])
+        self.assertEqual(stats["max"], 100)
+        self.assertEqual(stats["median"], 10.0)
+        self.assertEqual(stats["max_median_ratio"], 10.0)
+        self.assertEqual(skew_stats([])["max_median_ratio"], 0.0)
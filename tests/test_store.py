@@ -0,0 +1,93 @@
+"""Testing the model store"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from jobs.jobs.train.store import ModelStore
+
+
+class MockModel:
+
+    def __init__(self, name="model"):
+        self.name = name
+
+    def save(self, path):
+        os.makedirs(path)
+        with open(os.path.join(path, "data"), "w") as f_obj:
+            f_obj.write(self.name)
+
+
+def load_mock(path):
+    with open(os.path.join(path, "data")) as f_obj:
+        return MockModel(f_obj.read())
+
+
+class ModelStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root_dir = tempfile.mkdtemp()
+        self.store = ModelStore(self.root_dir, retention=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.root_dir)
+
+    def save(self, fingerprint="abc", params=None, name="model"):
+        return self.store.save(
+            "Benchmark", MockModel(name), fingerprint, ["a", "b"],
+            params or {"numTrees": 10}, {"accuracy": 0.9})
+
+    def test_save_versions(self):
+        self.assertIsNone(self.store.latest("Benchmark"))
+        self.assertEqual(self.save()["version"], 1)
+        meta = self.save(fingerprint="def")
+        self.assertEqual(meta["version"], 2)
+        self.assertEqual(meta["features"], ["a", "b"])
+        self.assertEqual(meta["metrics"], {"accuracy": 0.9})
+        self.assertEqual(self.store.latest("Benchmark"), meta)
+        self.assertTrue(os.path.isfile(os.path.join(
+            self.store.model_dir("Benchmark", 2), "model", "data")))
+
+    def test_find(self):
+        self.save(name="first")
+        self.save(fingerprint="def")
+        meta = self.store.find(
+            "Benchmark", "abc", {"numTrees": 10}, ("a", "b"))
+        self.assertEqual(meta["version"], 1)
+        self.assertIsNone(
+            self.store.find("Benchmark", "abc", {"numTrees": 20}, ["a", "b"]))
+        self.assertIsNone(
+            self.store.find("Benchmark", "abc", {"numTrees": 10}, ["a"]))
+        self.assertIsNone(
+            self.store.find("Benchmark", "xyz", {"numTrees": 10}, ["a", "b"]))
+        model = self.store.load(meta, loader=load_mock)
+        self.assertEqual(model.name, "first")
+
+    def test_cleanup_lru(self):
+        first = self.save(fingerprint="1")
+        self.save(fingerprint="2")
+        self.save(fingerprint="3")
+        # Using the first version makes the second the least recently used
+        self.store.load(first, loader=load_mock)
+        self.assertEqual(self.store.cleanup("Benchmark"), [2])
+        self.assertEqual(
+            [meta["version"] for meta in self.store.versions("Benchmark")],
+            [1, 3])
+        self.assertEqual(self.save()["version"], 4)
+
+    def test_versions_not_reused(self):
+        self.save(fingerprint="1")
+        self.save(fingerprint="2")
+        # The newest version is cleaned up, its number stays taken
+        self.store.load(self.store.versions("Benchmark")[0],
+                        loader=load_mock)
+        self.assertEqual(self.store.cleanup("Benchmark", 1), [2])
+        self.assertEqual(self.save()["version"], 3)
+
+    def test_versions_skip_staging(self):
+        self.save()
+        staging = self.store.model_dir("Benchmark", 2) + ".tmp"
+        shutil.copytree(self.store.model_dir("Benchmark", 1), staging)
+        self.assertEqual(
+            [meta["version"] for meta in self.store.versions("Benchmark")],
+            [1])
@@ -0,0 +1,112 @@
+"""Testing streaming jobs"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+from jobs.jobs.process import GetTrainingData
+from jobs.jobs.stream import StreamLoans
+
+
+SCHEMA = {"type": "struct", "fields": []}
+
+
+class StreamLoansTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root_dir = tempfile.mkdtemp()
+        self.landing_dir = os.path.join(self.root_dir, "landing")
+        os.makedirs(self.landing_dir)
+        self.kwargs = {
+            "filename": self.landing_dir,
+            "checkpoint_dir": os.path.join(self.root_dir, "checkpoint"),
+            "output_path": os.path.join(self.root_dir, "output")
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.root_dir)
+
+    @patch('jobs.jobs.stream.job.StreamLoans.bootstrap_state')
+    def test_pinned_state(self, bootstrap_mock):
+        bootstrap_mock.return_value = {
+            "schema": SCHEMA, "null_columns": ["desc"]}
+        state = StreamLoans(None, **self.kwargs).pinned_state()
+        self.assertEqual(state["null_columns"], ["desc"])
+
+        # Restarts reuse the pinned state
+        bootstrap_mock.return_value = {"schema": SCHEMA, "null_columns": []}
+        state = StreamLoans(None, **self.kwargs).pinned_state()
+        self.assertEqual(state["null_columns"], ["desc"])
+        self.assertEqual(bootstrap_mock.call_count, 1)
+
+    def test_read_file_with_schema(self):
+        reader = MagicMock()
+        StreamLoans(None, **self.kwargs).read_file(reader, "schema")
+        reader.schema.assert_called_with("schema")
+        reader.schema().csv.assert_called_with(self.landing_dir, header=True)
+
+    def test_trigger(self):
+        self.assertIn(
+            list(StreamLoans(None, **self.kwargs).trigger()),
+            [["availableNow"], ["once"]])
+        job = StreamLoans(None, trigger_interval="1 minute", **self.kwargs)
+        self.assertEqual(job.trigger(), {"processingTime": "1 minute"})
+
+    @patch('jobs.jobs.stream.job.current_timestamp')
+    def test_transform(self, _):
+        job = StreamLoans(None, dedup_keys="id", **self.kwargs)
+        df = MagicMock()
+        cleaned = df.drop().where()
+        cleaned.columns = ["id", "loan_amnt", "desc"]
+        job.transform(df, ["desc"])
+        df.drop.assert_called_with(*GetTrainingData.pushdown_columns())
+        # Null rows are dropped before the null columns, as in batch
+        cleaned.dropna.assert_called_with(thresh=2)
+
+        watermarked = cleaned.dropna().withColumn().withWatermark
+        watermarked.assert_called_with(StreamLoans.ingest_col, "1 hour")
+        watermarked().dropDuplicatesWithinWatermark.assert_called_with(["id"])
+        watermarked().dropDuplicatesWithinWatermark().drop \
+            .assert_called_with(StreamLoans.ingest_col, "desc")
+
+    def test_bootstrap_empty_landing(self):
+        job = StreamLoans(None, **self.kwargs)
+        with self.assertRaises(ValueError):
+            job.bootstrap_state()
+
+    @patch('jobs.jobs.common.SparkSQL.get_sql_context')
+    def test_bootstrap_declared_schema(self, context_mock):
+        schema = {"type": "struct", "fields": [{
+            "name": "id", "type": "string", "nullable": True,
+            "metadata": {}}]}
+        df = context_mock.return_value.read.schema().csv()
+        df.columns = ["id"]
+        df.schema.jsonValue.return_value = schema
+        df.drop().where().dropna().count.return_value = 0
+        job = StreamLoans(None, schema=json.dumps(schema), **self.kwargs)
+        self.assertEqual(job.bootstrap_state(), {
+            "schema": schema, "null_columns": []})
+        self.assertEqual(
+            context_mock.return_value.read.schema.call_args[0][0]
+            .fieldNames(), ["id"])
+
+    def test_dedup_before_spark_35(self):
+        job = StreamLoans(None, event_time_col="issue_ts", **self.kwargs)
+        df = MagicMock(columns=["id", "issue_ts"])
+        df.withWatermark.return_value = MagicMock(spec=["dropDuplicates"])
+        job.drop_duplicates(df)
+        df.withColumn.assert_not_called()
+        df.withWatermark().dropDuplicates.assert_called_with(
+            ["id", "issue_ts"])
+
+    def test_progress_metrics(self):
+        job = StreamLoans(None, **self.kwargs)
+        query = MagicMock(recentProgress=[
+            {"numInputRows": 10, "stateOperators": [{"numRowsTotal": 8}]},
+            {"numInputRows": 5, "stateOperators": [{"numRowsTotal": 12}]}])
+        job.progress_metrics(query)
+        self.assertEqual(job.metrics["num_batches"], 2)
+        self.assertEqual(job.metrics["num_input_rows"], 15)
+        self.assertEqual(job.metrics["num_state_rows"], 12)
@@ -0,0 +1,113 @@
+"""Testing training jobs"""
+import unittest
+from unittest.mock import MagicMock, patch
+
+from jobs.jobs.train import BenchmarkModel
+from jobs.jobs.train.benchmark import TimedPipeline
+
+
+class BenchmarkModelTest(unittest.TestCase):
+
+    def test_tuning_conf(self):
+        job = BenchmarkModel(None, mode="tune", parallelism=2)
+        tuning = job.tuning_conf()
+        self.assertEqual(tuning["parallelism"], 2)
+        self.assertEqual(tuning["method"], "train_validation_split")
+        self.assertEqual(
+            sorted(tuning["param_grid"]),
+            ["maxBins", "maxDepth", "numTrees", "subsamplingRate"])
+
+    def test_timed_pipeline(self):
+        pipeline = TimedPipeline(stages=[])
+        param_map = {}
+        pipeline.fit(None, param_map)
+        pipeline.copy().fit(None, param_map)
+        self.assertEqual(len(pipeline.fit_times[id(param_map)]), 2)
+        last = pipeline.fits[-1][1]
+        # The refit after a search is left out of the candidate's fits
+        self.assertEqual(pipeline.pop_last_fit(), last)
+        self.assertEqual(len(pipeline.fit_times[id(param_map)]), 1)
+        self.assertEqual(len(pipeline.fits), 1)
+
+    @patch('jobs.jobs.train.benchmark.BenchmarkModel.create_feature_vector')
+    @patch('jobs.jobs.train.benchmark.BenchmarkModel.index_str_columns')
+    @patch('jobs.jobs.train.benchmark.BenchmarkModel.fit_indexers',
+           return_value={"grade": ["B", "A"]})
+    def test_assemble_features(self, fit_mock, index_mock, vector_mock):
+        df = MagicMock(
+            dtypes=[("loan_amnt", "double"), ("grade", "string"),
+                    ("indexedgrade", "double"), ("loan_status", "string"),
+                    ("indexedloan_status", "double")],
+            columns=["loan_amnt", "grade", "indexedgrade", "loan_status",
+                     "indexedloan_status"])
+        index_mock.return_value.dtypes = [
+            ("loan_amnt", "double"), ("grade", "string"),
+            ("loan_status", "string"), ("indexedloan_status", "double"),
+            ("indexedgrade", "double")]
+        _, feature_cols, labels = BenchmarkModel.assemble_features(df)
+        # The label is never a feature
+        self.assertEqual(feature_cols, ["loan_amnt", "indexedgrade"])
+        self.assertEqual(labels, {"grade": ["B", "A"]})
+        fit_mock.assert_called_once_with(df, ["grade"])
+        # Upstream codes are replaced
+        df.drop.assert_called_once_with("indexedgrade")
+        index_mock.assert_called_once_with(
+            df.drop.return_value, {"grade": ["B", "A"]})
+        vector_mock.assert_called_once_with(
+            index_mock.return_value, feature_cols)
+
+        # Scoring indexes with the saved labels
+        fit_mock.reset_mock()
+        BenchmarkModel.assemble_features(
+            df, feature_cols, {"grade": ["A", "B"]})
+        fit_mock.assert_not_called()
+        with self.assertRaises(ValueError):
+            BenchmarkModel.assemble_features(
+                df, feature_cols, {"term": ["36 months"]})
+
+    def test_split_conf(self):
+        self.assertEqual(BenchmarkModel(None).split_conf(), ([0.7, 0.3], 42))
+        self.assertEqual(
+            BenchmarkModel(None, ratios=[0.8, 0.2], seed=7).split_conf(),
+            ([0.8, 0.2], 7))
+
+    def test_sampling_conf(self):
+        self.assertIsNone(BenchmarkModel(None).sampling_conf())
+        self.assertEqual(
+            BenchmarkModel(None, balance=True, sample_seed=7).sampling_conf(),
+            {"sample_size": None, "sample_ratio": None, "balance": True,
+             "seed": 7})
+        self.assertIn("sampling", BenchmarkModel(
+            None, sample_ratio=0.5).model_params())
+
+    def test_sample_fractions(self):
+        counts = {"Fully Paid": 800, "Charged Off": 200}
+        fractions = BenchmarkModel.sample_fractions
+        self.assertEqual(fractions(counts, sample_size=500),
+                         {"Fully Paid": 0.5, "Charged Off": 0.5})
+        self.assertEqual(fractions(counts, sample_ratio=0.1),
+                         {"Fully Paid": 0.1, "Charged Off": 0.1})
+        # As many of each class as the smallest has
+        self.assertEqual(fractions(counts, balance=True),
+                         {"Fully Paid": 0.25, "Charged Off": 1.0})
+        # Not more than a class has
+        self.assertEqual(fractions(counts, sample_size=800, balance=True),
+                         {"Fully Paid": 0.5, "Charged Off": 1.0})
+        self.assertEqual(fractions(counts, sample_size=5000),
+                         {"Fully Paid": 1.0, "Charged Off": 1.0})
+        self.assertEqual(fractions({"a": 0}, balance=True), {"a": 0.0})
+
+    def test_sample(self):
+        job = BenchmarkModel(None)
+        df = MagicMock()
+        df.groupBy.return_value.count.return_value.collect.return_value = [
+            {"loan_status": "Fully Paid", "count": 300},
+            {"loan_status": "Charged Off", "count": 100},
+            {"loan_status": None, "count": 5}]
+        sample = job.sample(df, {"sample_size": None, "sample_ratio": None,
+                                 "balance": True, "seed": 42})
+        self.assertIs(sample, df.sampleBy.return_value)
+        df.sampleBy.assert_called_once_with(
+            "loan_status", {"Fully Paid": 1 / 3, "Charged Off": 1.0}, 42)
+        self.assertEqual(job.metrics["sampling"]["class_counts"],
+                         {"Fully Paid": 300, "Charged Off": 100})